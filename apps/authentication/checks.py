@@ -0,0 +1,23 @@
+from django.conf import settings
+from django.core.checks import Error, Tags, register
+
+WRITE_BEHIND_SESSION_ENGINE = 'apps.authentication.sessions'
+
+
+@register(Tags.caches)
+def check_session_cache(app_configs, **kwargs):
+    """
+    Cache-mode sessions are only copied to the database after they are read
+    back from the cache, so with DummyCache every session is silently lost.
+    """
+    if settings.SESSION_ENGINE != WRITE_BEHIND_SESSION_ENGINE:
+        return []
+    backend = settings.CACHES.get(settings.SESSION_CACHE_ALIAS, {}).get('BACKEND', '')
+    if backend != 'django.core.cache.backends.dummy.DummyCache':
+        return []
+    return [Error(
+        f"SESSION_MODE 'cache' needs a cache that stores data, but the "
+        f"'{settings.SESSION_CACHE_ALIAS}' cache is DummyCache.",
+        hint="Configure a real cache (e.g. Redis) for SESSION_CACHE_ALIAS, or use SESSION_MODE 'db'.",
+        id='authentication.E001',
+    )]
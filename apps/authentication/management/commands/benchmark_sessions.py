@@ -0,0 +1,81 @@
+import time
+from importlib import import_module
+from unittest.mock import patch
+
+from django.conf import settings
+from django.contrib.sessions.models import Session
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from apps.authentication import tasks
+from apps.authentication.sessions import persist_session_to_db
+
+
+class Command(BaseCommand):
+    help = 'Measures per-request session overhead of each SESSION_MODE'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--mode', action='append', choices=list(settings.SESSION_ENGINES),
+                            help='Mode to measure (repeatable), defaults to all')
+        parser.add_argument('--count', type=int, default=1000, help='Sessions per mode')
+
+    def _measure(self, operation, items):
+        with CaptureQueriesContext(connection) as queries:
+            started = time.perf_counter()
+            results = [operation(item) for item in items]
+            elapsed = time.perf_counter() - started
+        return results, elapsed / len(items) * 1e6, len(queries) / len(items)
+
+    def handle(self, *args, **options):
+        modes, count = options['mode'] or list(settings.SESSION_ENGINES), options['count']
+        if 'cache' in modes and 'DummyCache' in settings.CACHES[settings.SESSION_CACHE_ALIAS]['BACKEND']:
+            self.stderr.write('The session cache is a DummyCache; cache mode numbers will be meaningless.')
+
+        for mode in modes:
+            store_class = import_module(settings.SESSION_ENGINES[mode]).SessionStore
+
+            def login(i):
+                store = store_class()
+                store['_auth_user_id'] = str(i)
+                store['_auth_user_backend'] = 'django.contrib.auth.backends.ModelBackend'
+                store.save()
+                return store.session_key
+
+            def read(session_key):
+                # An authenticated request that only reads the session.
+                return store_class(session_key).get('_auth_user_id')
+
+            def write(session_key):
+                # A request that changes the session, e.g. a flash message.
+                store = store_class(session_key)
+                store['last_seen'] = time.time()
+                store.save()
+
+            # Background writes are counted, not sent to the broker.
+            with patch.object(tasks.persist_session, 'apply_async') as deferred:
+                keys, login_us, login_queries = self._measure(login, range(count))
+                _, read_us, read_queries = self._measure(read, keys)
+                _, write_us, write_queries = self._measure(write, keys)
+
+            self.stdout.write(
+                f'{mode}: login {login_us:.1f} us / {login_queries:.1f} queries, '
+                f'read {read_us:.1f} us / {read_queries:.1f} queries, '
+                f'write {write_us:.1f} us / {write_queries:.1f} queries per request'
+            )
+            if mode == 'cache':
+                session_keys = [call.kwargs['args'][0] for call in deferred.call_args_list]
+                _, persist_us, persist_queries = self._measure(persist_session_to_db, session_keys)
+                self.stdout.write(
+                    f'  {deferred.call_count} background writes for {count * 2} saves, '
+                    f'{persist_us:.1f} us / {persist_queries:.1f} queries each'
+                )
+            elif mode == 'signed_cookies':
+                self.stdout.write(f'  cookie size {max(len(key) for key in keys)} bytes')
+
+            if mode != 'signed_cookies':
+                with patch.object(tasks.delete_persisted_session, 'delay'):
+                    for session_key in keys:
+                        store_class(session_key).delete()
+                if mode == 'cache':
+                    Session.objects.filter(session_key__in=keys).delete()
@@ -1,7 +1,9 @@
 from rest_framework import serializers
 from django.contrib.auth import authenticate, get_user_model
+from django.contrib.auth.hashers import make_password
 from django.contrib.auth.password_validation import validate_password
 from django.core.exceptions import ValidationError
+from django.db import IntegrityError, transaction
 
 User = get_user_model()
 
@@ -10,12 +12,9 @@ class PasswordResetRequestSerializer(serializers.Serializer):
     email = serializers.EmailField()
 
     def validate_email(self, value):
-        # Check if the email exists in the database
-        if not User.objects.filter(email=value).exists():
-            # We don't want to reveal if an email exists or not for security reasons
-            # So we'll just pass silently
-            pass
-        return value
+        # Whether the email exists is left to the view, which looks the user up
+        # once and responds the same either way so emails cannot be enumerated.
+        return User.objects.normalize_email(value)
 
 
 class PasswordResetConfirmSerializer(serializers.Serializer):
@@ -81,23 +80,35 @@ class UserRegistrationSerializer(serializers.ModelSerializer):
             'email': {'required': True}
         }
 
+    duplicate_email_message = "A user with that email already exists."
+
+    def validate_email(self, value):
+        value = User.objects.normalize_email(value)
+        if User.objects.filter(email=value).exists():
+            raise serializers.ValidationError(self.duplicate_email_message)
+        return value
+
     def validate(self, attrs):
         if attrs['password'] != attrs['password2']:
             raise serializers.ValidationError({"password": "Password fields didn't match."})
         return attrs
 
     def create(self, validated_data):
-        user = User.objects.create(
-            username=validated_data['username'],
-            email=validated_data['email'],
-            first_name=validated_data['first_name'],
-            last_name=validated_data['last_name']
-        )
-
-        user.set_password(validated_data['password'])
-        user.save()
-
-        return user
+        # Hash first so the user is written with a single INSERT.
+        try:
+            with transaction.atomic():
+                return User.objects.create(
+                    username=validated_data['username'],
+                    email=validated_data['email'],
+                    first_name=validated_data['first_name'],
+                    last_name=validated_data['last_name'],
+                    password=make_password(validated_data['password']),
+                )
+        except IntegrityError:
+            # A concurrent registration took the email or username after validation.
+            if User.objects.filter(email=validated_data['email']).exists():
+                raise serializers.ValidationError({'email': [self.duplicate_email_message]})
+            raise serializers.ValidationError({'username': ["A user with that username already exists."]})
 
 
 class AccountDeletionSerializer(serializers.Serializer):
@@ -0,0 +1,97 @@
+"""
+Write-behind session engine, selected with SESSION_MODE = 'cache'.
+
+Sessions are read from and written to the cache (Redis). Each change is
+copied to the django_session table by a Celery task shortly afterwards, so
+the database is off the request path but sessions survive a cache flush:
+a cache miss falls back to the database row.
+"""
+from django.conf import settings
+from django.contrib.sessions.backends.cache import SessionStore as CacheSessionStore
+from django.contrib.sessions.backends.db import SessionStore as DBSessionStore
+from django.contrib.sessions.models import Session
+from django.core.cache import caches
+from django.db import transaction
+
+from utils.logging_utils import get_logger
+
+logger = get_logger(__name__)
+
+KEY_PREFIX = 'apps.authentication.sessions'
+
+
+def _pending_key(session_key):
+    return f'{KEY_PREFIX}:persist-pending:{session_key}'
+
+
+class SessionStore(CacheSessionStore):
+    """
+    Cache-backed session store that persists to the database in the background.
+    """
+    cache_key_prefix = KEY_PREFIX
+
+    def load(self):
+        try:
+            session_data = self._cache.get(self.cache_key)
+        except Exception:
+            # Treat a cache outage like a miss and fall back to the database.
+            session_data = None
+        if session_data is not None:
+            return session_data
+
+        db_store = DBSessionStore(self.session_key)
+        session_data = db_store.load()
+        if db_store.session_key is None:
+            self._session_key = None
+            return {}
+        self._cache.set(self.cache_key, session_data, self.get_expiry_age(expiry=session_data.get('_session_expiry')))
+        return session_data
+
+    def save(self, must_create=False):
+        super().save(must_create)
+        schedule_persist(self.session_key)
+
+    def delete(self, session_key=None):
+        if session_key is None:
+            session_key = self.session_key
+        super().delete(session_key)
+        if session_key is not None:
+            from .tasks import delete_persisted_session
+            transaction.on_commit(lambda: delete_persisted_session.delay(session_key))
+
+
+def schedule_persist(session_key):
+    """
+    Schedule a copy of a session to the database, coalescing bursts of saves.
+
+    Only the first save within SESSION_WRITE_BEHIND_DELAY seconds schedules a
+    task; the task copies whatever the cache holds when it runs.
+    """
+    from .tasks import persist_session
+
+    cache = caches[settings.SESSION_CACHE_ALIAS]
+    if cache.add(_pending_key(session_key), 1, settings.SESSION_WRITE_BEHIND_DELAY):
+        transaction.on_commit(lambda: persist_session.apply_async(
+            args=[session_key], countdown=settings.SESSION_WRITE_BEHIND_DELAY,
+        ))
+
+
+def persist_session_to_db(session_key):
+    """
+    Copy a session from the cache into the django_session table.
+
+    :param session_key: Key of the session to persist
+    :return: True if the session was written, False if it is no longer in the cache
+    """
+    store = SessionStore(session_key)
+    store._cache.delete(_pending_key(session_key))
+    session_data = store._cache.get(store.cache_key)
+    if session_data is None:
+        return False
+    obj = DBSessionStore(session_key).create_model_instance(session_data)
+    Session.objects.update_or_create(
+        session_key=session_key,
+        defaults={'session_data': obj.session_data, 'expire_date': obj.expire_date},
+    )
+    logger.debug(f"Persisted session {session_key[:8]}... to the database")
+    return True
@@ -0,0 +1,18 @@
+from celery import shared_task
+from django.contrib.sessions.models import Session
+from .sessions import persist_session_to_db
+from utils.logging_utils import get_logger, log_exception
+
+logger = get_logger(__name__)
+
+
+@shared_task
+@log_exception(logger)
+def persist_session(session_key):
+    return persist_session_to_db(session_key)
+
+
+@shared_task
+@log_exception(logger)
+def delete_persisted_session(session_key):
+    Session.objects.filter(session_key=session_key).delete()
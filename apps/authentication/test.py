@@ -1,19 +1,34 @@
 import factory
 import time
-from django.test import TestCase, TransactionTestCase
+from django.conf import settings
+from django.contrib.sessions.models import Session
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
 from django.urls import reverse
 from django.db import transaction
 from django.core import mail
+from django.core.cache import cache
 from django.contrib.auth import get_user_model
 from django.contrib.auth.tokens import default_token_generator
 from django.utils.http import urlsafe_base64_encode
 from django.utils.encoding import force_bytes
 from rest_framework.test import APIClient
-from rest_framework import status
-from unittest.mock import patch
+from rest_framework import serializers, status
+from unittest.mock import Mock, patch
+from utils.throttling_utils import AnonSlidingWindowRateThrottle, LoginRateThrottle, UserSlidingWindowRateThrottle
+from .models import AuthToken
+from .serializers.auth_serializers import UserRegistrationSerializer
+from .checks import check_session_cache
+from .sessions import SessionStore
+from .tasks import delete_persisted_session, persist_session
+from .tokens import get_token_user, hash_token
+from .views import LoginView, PasswordResetRequestView, TokenLoginView
 
 User = get_user_model()
 
+# Throttle counters and cached sessions need a cache that stores things; the
+# development settings use DummyCache.
+LOCMEM_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
 
 class UserFactory(factory.django.DjangoModelFactory):
     class Meta:
@@ -106,7 +121,7 @@ class AuthTestCase(TransactionTestCase):
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
 
     @transaction.atomic
-    @patch('apps.authentication.views.send_password_reset_email')
+    @patch('apps.authentication.views.queue_password_reset_email')
     def test_password_reset_request(self, mock_send_email):
         self.client.force_authenticate(user=None)
         data = {'email': self.user.email}
@@ -174,8 +189,36 @@ class AuthTestCase(TransactionTestCase):
         self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
 
 
+class RegistrationSerializerTestCase(TestCase):
+    def test_user_is_written_once(self):
+        serializer = UserRegistrationSerializer(data={
+            'username': 'newuser', 'email': 'new@example.com', 'first_name': 'New', 'last_name': 'User',
+            'password': 'Str0ng-passw0rd!', 'password2': 'Str0ng-passw0rd!',
+        })
+        self.assertTrue(serializer.is_valid(), serializer.errors)
+        # The INSERT plus the savepoint around it.
+        with self.assertNumQueries(3):
+            user = serializer.save()
+        self.assertTrue(get_user_model().objects.get(pk=user.pk).check_password('Str0ng-passw0rd!'))
+
+    def test_concurrent_registration_with_same_email_is_rejected(self):
+        serializer = UserRegistrationSerializer(data={
+            'username': 'newuser', 'email': 'New@example.com', 'first_name': 'New', 'last_name': 'User',
+            'password': 'Str0ng-passw0rd!', 'password2': 'Str0ng-passw0rd!',
+        })
+        self.assertTrue(serializer.is_valid(), serializer.errors)
+        # Another request registers the email between validation and save.
+        UserFactory(email='new@example.com')
+        with self.assertRaises(serializers.ValidationError) as cm:
+            serializer.save()
+        self.assertEqual(cm.exception.detail, {'email': ['A user with that email already exists.']})
+        self.assertFalse(get_user_model().objects.filter(username='newuser').exists())
+
+
 class PerformanceTestCase(TestCase):
     def setUp(self):
+        # Start with empty login throttle counters.
+        cache.clear()
         self.client = APIClient()
         self.users = UserFactory.create_batch(100)
         self.login_url = reverse('login')
@@ -193,3 +236,189 @@ class PerformanceTestCase(TestCase):
 
         print(f"Average login time: {average_time:.4f} seconds")
         self.assertLess(average_time, 0.5)  # Assumes login should take less than 0.5 seconds on average
+
+
+class CachedTokenAuthenticationTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user = UserFactory()
+        response = self.client.post(reverse('token_login'), {'username': self.user.username, 'password': 'testpass123'})
+        self.key = response.json()['data']['token']
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.key}')
+
+    def test_only_the_key_hash_is_stored(self):
+        token = AuthToken.objects.get(user=self.user)
+        self.assertEqual(token.key_hash, hash_token(self.key))
+        self.assertNotEqual(token.key_hash, self.key)
+
+    def test_warm_cache_authenticates_without_queries(self):
+        self.assertEqual(self.client.get(reverse('profile_view')).status_code, status.HTTP_200_OK)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(reverse('profile_view')).status_code, status.HTTP_200_OK)
+
+    def test_logout_revokes_token(self):
+        self.assertEqual(self.client.post(reverse('logout')).status_code, status.HTTP_200_OK)
+        self.assertFalse(AuthToken.objects.exists())
+        self.assertEqual(self.client.get(reverse('profile_view')).status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_password_reset_revokes_tokens(self):
+        self.client.get(reverse('profile_view'))
+        response = APIClient().post(reverse('password_reset_confirm'), {
+            'uid': urlsafe_base64_encode(force_bytes(self.user.pk)),
+            'token': default_token_generator.make_token(self.user),
+            'password': 'N3w-passw0rd!',
+            'password_confirm': 'N3w-passw0rd!',
+        })
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.client.get(reverse('profile_view')).status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_deactivating_user_invalidates_cached_user(self):
+        self.client.get(reverse('profile_view'))
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.client.get(reverse('profile_view')).status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_cached_user_can_delete_account(self):
+        self.client.get(reverse('profile_view'))
+        response = self.client.post(reverse('account_deletion'), {'password': 'testpass123'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        user = User.objects.get(pk=self.user.pk)
+        self.assertFalse(user.is_active)
+        self.assertFalse(AuthToken.objects.filter(user=user).exists())
+
+    def test_saving_cached_user_keeps_password(self):
+        user = get_token_user(hash_token(self.key))
+        user.first_name = 'Changed'
+        user.save()
+        self.assertTrue(User.objects.get(pk=self.user.pk).check_password('testpass123'))
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class WriteBehindSessionTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        # Background writes are run explicitly by each test.
+        patcher = patch.object(persist_session, 'apply_async')
+        self.apply_async = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _login(self):
+        store = SessionStore()
+        store['_auth_user_id'] = '1'
+        with self.captureOnCommitCallbacks(execute=True):
+            store.create()
+        return store.session_key
+
+    def test_reads_come_from_the_cache(self):
+        session_key = self._login()
+        with self.assertNumQueries(0):
+            self.assertEqual(SessionStore(session_key)['_auth_user_id'], '1')
+
+    def test_saves_are_persisted_once_per_window(self):
+        session_key = self._login()
+        store = SessionStore(session_key)
+        store['last_seen'] = 'now'
+        with self.captureOnCommitCallbacks(execute=True):
+            store.save()
+        self.apply_async.assert_called_once_with(args=[session_key], countdown=settings.SESSION_WRITE_BEHIND_DELAY)
+        self.assertFalse(Session.objects.exists())
+
+        persist_session(session_key)
+        self.assertEqual(Session.objects.get(session_key=session_key).get_decoded()['last_seen'], 'now')
+
+    def test_cache_miss_falls_back_to_the_database(self):
+        session_key = self._login()
+        persist_session(session_key)
+        cache.clear()
+        store = SessionStore(session_key)
+        self.assertEqual(store['_auth_user_id'], '1')
+        with self.assertNumQueries(0):
+            self.assertEqual(SessionStore(session_key)['_auth_user_id'], '1')
+
+    def test_delete_removes_the_database_row(self):
+        session_key = self._login()
+        persist_session(session_key)
+        with patch.object(delete_persisted_session, 'delay', side_effect=delete_persisted_session):
+            with self.captureOnCommitCallbacks(execute=True):
+                SessionStore(session_key).delete()
+        self.assertFalse(Session.objects.exists())
+        self.assertEqual(SessionStore(session_key).load(), {})
+
+    @override_settings(SESSION_ENGINE='apps.authentication.sessions',
+                       CACHES={'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}})
+    def test_cache_mode_with_dummy_cache_fails_the_checks(self):
+        self.assertEqual([error.id for error in check_session_cache(None)], ['authentication.E001'])
+
+
+class PasswordResetRequestTestCase(TestCase):
+    def test_lookup_is_case_insensitive_and_single_query(self):
+        user = UserFactory(email='reset@example.com')
+        with patch('apps.authentication.views.queue_password_reset_email') as queue_email:
+            with self.assertNumQueries(1):
+                response = APIClient().post(reverse('password_reset_request'), {'email': 'Reset@Example.com'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        queue_email.assert_called_once()
+        self.assertEqual(queue_email.call_args[0][0], user)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class SlidingWindowThrottleTestCase(SimpleTestCase):
+    class Throttle(LoginRateThrottle):
+        rate = '3/min'
+
+    def setUp(self):
+        cache.clear()
+        self.request = Mock(META={'REMOTE_ADDR': '10.0.0.1'})
+        self.now = 600.0
+
+    def _allow(self):
+        throttle = self.Throttle()
+        throttle.timer = lambda: self.now
+        return throttle.allow_request(self.request, None), throttle
+
+    def test_limit_within_a_window(self):
+        self.assertEqual([self._allow()[0] for _ in range(4)], [True, True, True, False])
+        _, throttle = self._allow()
+        self.assertEqual(throttle.wait(), 60)
+
+    def test_previous_window_is_weighted_by_overlap(self):
+        for _ in range(3):
+            self._allow()
+        # Halfway through the next window, the previous three count as 1.5.
+        self.now += 90
+        self.assertEqual([self._allow()[0] for _ in range(3)], [True, True, False])
+        _, throttle = self._allow()
+        self.assertAlmostEqual(throttle.wait(), 10)
+
+    @override_settings(CACHES={'default': {
+        'BACKEND': 'django_redis.cache.RedisCache', 'LOCATION': 'redis://localhost:6379/1',
+    }})
+    def test_redis_check_and_increment_is_one_script_call(self):
+        script = Mock(return_value=[1, 1, 0])
+        with patch('utils.throttling_utils._get_redis_script', return_value=script):
+            allowed, _ = self._allow()
+        self.assertTrue(allowed)
+        script.assert_called_once_with(
+            keys=[':1:throttle_login_10.0.0.1:10', ':1:throttle_login_10.0.0.1:9'], args=[3, 60, 0.0],
+        )
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class AuthThrottleTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_password_reset_requests_are_throttled(self):
+        client = APIClient()
+        codes = [
+            client.post(reverse('password_reset_request'), {'email': 'nobody@example.com'}).status_code
+            for _ in range(6)
+        ]
+        self.assertEqual(codes, [status.HTTP_200_OK] * 5 + [status.HTTP_429_TOO_MANY_REQUESTS])
+
+    def test_scoped_throttles_add_to_the_defaults(self):
+        for view in (LoginView, TokenLoginView, PasswordResetRequestView):
+            throttles = [type(throttle) for throttle in view().get_throttles()]
+            self.assertIn(AnonSlidingWindowRateThrottle, throttles)
+            self.assertIn(UserSlidingWindowRateThrottle, throttles)
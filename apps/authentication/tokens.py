@@ -0,0 +1,169 @@
+import hashlib
+import secrets
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import transaction
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+
+from utils.cache_utils import LocalTTLCache
+from utils.logging_utils import get_logger
+from .models import AuthToken
+
+logger = get_logger(__name__)
+
+User = get_user_model()
+
+TOKEN_CACHE_PREFIX = 'auth:token'
+USER_CACHE_PREFIX = 'auth:user'
+
+# Bounded per-process layer in front of the shared cache. Invalidations only
+# clear the local layer of the process that performs them, so other processes
+# may accept a revoked token for at most AUTH_TOKEN_LOCAL_TTL seconds.
+_local_cache = LocalTTLCache(
+    maxsize=settings.AUTH_TOKEN_LOCAL_MAXSIZE,
+    ttl=settings.AUTH_TOKEN_LOCAL_TTL,
+)
+
+# The cached user snapshot: every concrete column except the password hash.
+_USER_FIELDS = [field.attname for field in User._meta.concrete_fields if field.name != 'password']
+
+
+def hash_token(key):
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+def _token_cache_key(key_hash):
+    return f'{TOKEN_CACHE_PREFIX}:{key_hash}'
+
+
+def _user_cache_key(user_id):
+    return f'{USER_CACHE_PREFIX}:{user_id}'
+
+
+def create_token(user, name=''):
+    """
+    Create an API token for a user.
+
+    :param user: The User the token authenticates
+    :param name: Optional label, e.g. the device name
+    :return: Tuple of (raw key, AuthToken). The raw key cannot be recovered later.
+    """
+    key = secrets.token_hex(20)
+    token = AuthToken.objects.create(key_hash=hash_token(key), user=user, name=name)
+    return key, token
+
+
+def _cached(key, load):
+    value = _local_cache.get(key)
+    if value is None:
+        value = cache.get(key)
+        if value is None:
+            value = load()
+            if value is None:
+                return None
+            cache.set(key, value, settings.AUTH_TOKEN_CACHE_TIMEOUT)
+        _local_cache.set(key, value)
+    return value
+
+
+def _delete_cached(*keys):
+    def _delete():
+        cache.delete_many(keys)
+        for key in keys:
+            _local_cache.delete(key)
+
+    _delete()
+    transaction.on_commit(_delete)
+
+
+def get_token_user(key_hash):
+    """
+    Resolve a hashed token to its user, reading through the local and shared caches.
+
+    The token's user ID and the user's fields are cached separately, so saving
+    the user only has to drop one key. Each call returns a new User instance,
+    with the password field deferred.
+
+    :param key_hash: SHA-256 hash of the presented key
+    :return: The User, or None if the token does not exist
+    """
+    user_id = _cached(
+        _token_cache_key(key_hash),
+        lambda: AuthToken.objects.filter(key_hash=key_hash).values_list('user_id', flat=True).first(),
+    )
+    if user_id is None:
+        return None
+    fields = _cached(
+        _user_cache_key(user_id),
+        lambda: User.objects.filter(pk=user_id).values(*_USER_FIELDS).first(),
+    )
+    if fields is None:
+        return None
+    # The password hash is never cached; it is left deferred, so check_password()
+    # loads it from the database and save() only writes the loaded fields.
+    return User.from_db('default', _USER_FIELDS, [fields[name] for name in _USER_FIELDS])
+
+
+def invalidate_cached_user(user_id):
+    _delete_cached(_user_cache_key(user_id))
+
+
+def revoke_token(key_hash):
+    """
+    Delete one token and drop it from the caches.
+    """
+    AuthToken.objects.filter(key_hash=key_hash).delete()
+    _delete_cached(_token_cache_key(key_hash))
+
+
+def revoke_user_tokens(user):
+    """
+    Delete every token of a user and drop them from the caches.
+
+    :return: Number of tokens revoked
+    """
+    revoked = revoke_tokens_for_users([user.pk])
+    if revoked:
+        logger.info(f"Revoked {revoked} API tokens for user {user.pk}")
+    return revoked
+
+
+def revoke_tokens_for_users(user_ids):
+    """
+    Delete every token of several users and drop them and the users from the caches.
+
+    Also use this after bulk updates of users, which send no post_save signal.
+
+    :param user_ids: IDs of the users
+    :return: Number of tokens revoked
+    """
+    tokens = AuthToken.objects.filter(user_id__in=user_ids)
+    key_hashes = list(tokens.values_list('key_hash', flat=True))
+    tokens.delete()
+    _delete_cached(
+        *[_user_cache_key(user_id) for user_id in user_ids],
+        *[_token_cache_key(key_hash) for key_hash in key_hashes],
+    )
+    return len(key_hashes)
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    Token authentication against hashed AuthToken keys, served from cache.
+
+    Clients send ``Authorization: Token <key>`` like with DRF's TokenAuthentication.
+    On a warm cache a request is authenticated without touching the database.
+    ``request.auth`` is the hash of the presented key.
+    """
+
+    def authenticate_credentials(self, key):
+        key_hash = hash_token(key)
+        user = get_token_user(key_hash)
+        if user is None:
+            raise exceptions.AuthenticationFailed('Invalid token.')
+        if not user.is_active:
+            raise exceptions.AuthenticationFailed('User inactive or deleted.')
+        return user, key_hash
@@ -1,12 +1,14 @@
 from django.urls import path
 
 from .views import (
-    LoginView, LogoutView, RegisterView, PasswordResetRequestView,
-    PasswordResetConfirmView, AccountDeletionView, ProfileView, get_csrf_token
+    LoginView, TokenLoginView, LogoutView, RegisterView, PasswordResetRequestView,
+    PasswordResetConfirmView, AccountDeletionView, DataExportView, DataExportDownloadView, ProfileView,
+    get_csrf_token
 )
 
 urlpatterns = [
     path('login/', LoginView.as_view(), name='login'),
+    path('token-login/', TokenLoginView.as_view(), name='token_login'),
     path('logout/', LogoutView.as_view(), name='logout'),
     path('register/', RegisterView.as_view(), name='register'),
     path('password-reset-request/', PasswordResetRequestView.as_view(), name='password_reset_request'),
@@ -14,6 +16,8 @@ urlpatterns = [
     path('password-reset/<str:uidb64>/<str:token>/', PasswordResetConfirmView.as_view(),
          name='password_reset'),
     path('delete-account/', AccountDeletionView.as_view(), name='account_deletion'),
+    path('data-export/', DataExportView.as_view(), name='data_export'),
+    path('data-export/<int:export_id>/download/', DataExportDownloadView.as_view(), name='data_export_download'),
     path('profile/', ProfileView.as_view(), name='profile_view'),
     path('get-csrf-token/', get_csrf_token, name='get_csrf_token'),
 ]
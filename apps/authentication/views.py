@@ -4,8 +4,10 @@ import os
 from django.contrib.auth import get_user_model, login, logout
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.tokens import default_token_generator
+from django.db import transaction
 from django.http import JsonResponse
 from django.middleware.csrf import get_token
+from django.urls import reverse
 from django.utils.decorators import method_decorator
 from django.utils.encoding import force_bytes, force_str
 from django.utils.http import urlsafe_base64_encode, urlsafe_base64_decode
@@ -13,11 +15,16 @@ from django.views.decorators.csrf import csrf_exempt
 from rest_framework import status
 from rest_framework.decorators import permission_classes
 from rest_framework.permissions import AllowAny, IsAuthenticated
+from rest_framework.settings import api_settings
 from rest_framework.views import APIView
 
-from utils.api_utils import api_response, StandardizedResponseMixin
-from utils.emails_utils import send_password_reset_email
+from apps.notifications.outbox import queue_password_reset_email
+from apps.subscriptions.tasks import ensure_stripe_customer
+from apps.users.data_export import get_export_storage, request_data_export
+from utils.api_utils import api_response, ranged_file_response, StandardizedResponseMixin
 from utils.gdpr_utils import anonymize_user_data
+from utils.throttling_utils import LoginRateThrottle, PasswordResetRateThrottle
+from .tokens import CachedTokenAuthentication, create_token, revoke_token, revoke_user_tokens
 from .serializers.auth_serializers import UserLoginSerializer, UserRegistrationSerializer, \
     PasswordResetRequestSerializer, PasswordResetConfirmSerializer, AccountDeletionSerializer
 
@@ -30,6 +37,7 @@ FRONTEND_URL = os.environ.get('REACT_APP_YOUR_API_ENDPOINT')
 @method_decorator(csrf_exempt, name='dispatch')
 class LoginView(APIView):
     permission_classes = [AllowAny]
+    throttle_classes = [*api_settings.DEFAULT_THROTTLE_CLASSES, LoginRateThrottle]
 
     @csrf_exempt
     def post(self, request):
@@ -57,10 +65,36 @@ class LoginView(APIView):
         )
 
 
+class TokenLoginView(APIView):
+    """
+    Exchange a username and password for an API token, for clients that cannot
+    use session cookies. The key is only returned here; the server keeps its hash.
+    """
+    permission_classes = [AllowAny]
+    throttle_classes = [*api_settings.DEFAULT_THROTTLE_CLASSES, LoginRateThrottle]
+
+    def post(self, request):
+        serializer = UserLoginSerializer(data=request.data, context={'request': request})
+        if serializer.is_valid():
+            key, _ = create_token(serializer.validated_data['user'], name=request.data.get('name', ''))
+            return api_response(
+                data={'token': key},
+                message="Login successful",
+                status_code=status.HTTP_200_OK
+            )
+        return api_response(
+            errors=serializer.errors,
+            message="Login failed.",
+            status_code=status.HTTP_400_BAD_REQUEST
+        )
+
+
 class LogoutView(APIView):
     permission_classes = [IsAuthenticated]
 
     def post(self, request):
+        if isinstance(request.successful_authenticator, CachedTokenAuthentication):
+            revoke_token(request.auth)
         logout(request)
         return api_response(
             message="Successfully logged out.",
@@ -76,6 +110,8 @@ class RegisterView(APIView):
         if serializer.is_valid():
             user = serializer.save()
             login(request, user)  # This uses session-based login
+            # Create the Stripe customer in the background so checkout never has to.
+            transaction.on_commit(lambda: ensure_stripe_customer.delay(user.pk))
             return api_response(
                 message="User registered successfully.",
                 status_code=status.HTTP_201_CREATED
@@ -89,6 +125,7 @@ class RegisterView(APIView):
 
 class PasswordResetRequestView(StandardizedResponseMixin, APIView):
     permission_classes = [AllowAny]
+    throttle_classes = [*api_settings.DEFAULT_THROTTLE_CLASSES, PasswordResetRateThrottle]
     serializer_class = PasswordResetRequestSerializer
 
     def post(self, request):
@@ -96,16 +133,16 @@ class PasswordResetRequestView(StandardizedResponseMixin, APIView):
         if serializer.is_valid():
             email = serializer.validated_data['email']
             try:
-                user = User.objects.get(email=email)
+                user = User.objects.get_by_email(email)
                 token = default_token_generator.make_token(user)
                 uid = urlsafe_base64_encode(force_bytes(user.pk))
                 reset_url = f"{FRONTEND_URL}/reset-password/{uid}/{token}/"
-                is_email_sent = send_password_reset_email(user, reset_url)
-                if is_email_sent:
-                    return self.standardized_response(
-                        message="If the email exists, a password reset link has been sent.",
-                        status_code=status.HTTP_200_OK
-                    )
+                # Delivered in the background by the email outbox drainer.
+                queue_password_reset_email(user, reset_url)
+                return self.standardized_response(
+                    message="If the email exists, a password reset link has been sent.",
+                    status_code=status.HTTP_200_OK
+                )
             except User.DoesNotExist:
                 logger.warning(f"Password reset attempted for non-existent email: {email}")
                 return self.standardized_response(
@@ -170,6 +207,7 @@ class PasswordResetConfirmView(StandardizedResponseMixin, APIView):
             if default_token_generator.check_token(user, token):
                 user.set_password(password)
                 user.save()
+                revoke_user_tokens(user)
                 logger.info(f"Password reset successful for user: {user.email}")
                 return self.standardized_response(
                     message="Password has been reset successfully.",
@@ -214,7 +252,7 @@ class AccountDeletionView(APIView):
             logger.info(f"Account deletion requested for user {user.id}. Reason: {reason}")
 
             try:
-                # Anonymize user data
+                # Anonymize user data; this also revokes the user's API tokens
                 anonymize_user_data(user)
 
                 # Log out the user
@@ -242,6 +280,65 @@ class AccountDeletionView(APIView):
             )
 
 
+def _data_export_data(export):
+    return {
+        'id': export.id,
+        'status': export.status,
+        'size': export.size,
+        'created_at': export.created_at,
+        'completed_at': export.completed_at,
+        'download_url': reverse('data_export_download', args=[export.id]) if export.status == 'completed' else None,
+    }
+
+
+class DataExportView(APIView):
+    """
+    GDPR data export: POST starts building an archive of the user's data in
+    the background, GET lists the user's exports and their status.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        exports = request.user.data_exports.order_by('-created_at')[:10]
+        return api_response(data=[_data_export_data(export) for export in exports])
+
+    def post(self, request):
+        export, created = request_data_export(request.user)
+        if created:
+            logger.info(f"Data export {export.id} requested for user {request.user.id}")
+        return api_response(
+            data=_data_export_data(export),
+            message="Your data export is being prepared." if created else "Your data export is already being prepared.",
+            status_code=status.HTTP_202_ACCEPTED
+        )
+
+
+class DataExportDownloadView(APIView):
+    """
+    Download a finished data export. Supports range requests, so large
+    archives can be fetched in parts or resumed. An export whose archive has
+    gone missing is marked failed, so a new one can be requested.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, export_id):
+        export = request.user.data_exports.filter(id=export_id, status='completed').first()
+        if export is None:
+            return api_response(message="Export not found.", status_code=status.HTTP_404_NOT_FOUND)
+        storage = get_export_storage()
+        if not storage.exists(export.file_name):
+            logger.warning(f"Archive of data export {export.id} is missing")
+            request.user.data_exports.filter(id=export.id).update(status='failed', last_error='Archive is missing')
+            return api_response(
+                message="This export is no longer available. Please request a new one.",
+                status_code=status.HTTP_410_GONE
+            )
+        return ranged_file_response(
+            request, storage.open(export.file_name, 'rb'), export.size,
+            content_type='application/zip', filename=f'data-export-{export.id}.zip',
+        )
+
+
 def get_csrf_token(request):
     csrf_token = get_token(request)
     return JsonResponse({'csrfToken': csrf_token})
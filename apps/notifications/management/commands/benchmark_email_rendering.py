@@ -0,0 +1,36 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.template.loader import render_to_string
+from django.utils.html import strip_tags
+
+from utils.emails_utils import get_email_template
+
+
+class Command(BaseCommand):
+    help = 'Measures per-message render cost of email templates for bulk sends'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--template', default='password_reset.html', help='Email template to render')
+        parser.add_argument('--count', type=int, default=5000, help='Messages rendered per language')
+
+    def _measure(self, render, count):
+        started = time.perf_counter()
+        for i in range(count):
+            render({'user': {'username': f'user{i}'}, 'reset_url': f'https://example.com/reset/{i}/'})
+        return (time.perf_counter() - started) / count * 1e6
+
+    def handle(self, *args, **options):
+        template_name, count = options['template'], options['count']
+        for language, _ in settings.LANGUAGES:
+            # What send_email used to do for every message.
+            uncached = self._measure(
+                lambda context: strip_tags(render_to_string(template_name, context)), count
+            )
+            template = get_email_template(template_name, language)
+            cached = self._measure(template.render, count)
+            self.stdout.write(
+                f'{language}: render_to_string + strip_tags {uncached:.1f} us/message, '
+                f'compiled template {cached:.1f} us/message ({uncached / cached:.1f}x)'
+            )
@@ -0,0 +1,197 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from django.utils import translation
+
+from utils.emails_utils import BulkEmail, render_email_template, send_bulk_emails
+from utils.logging_utils import get_logger
+from .models import OutboxEmail
+
+logger = get_logger(__name__)
+
+
+def _schedule_drain():
+    from .tasks import drain_email_outbox
+
+    transaction.on_commit(lambda: drain_email_outbox.delay())
+
+
+def queue_email(subject, to, template_name='', context=None, body='', from_email='', language=''):
+    """
+    Write an email to the outbox; it is sent once the current transaction commits.
+
+    :param subject: Email subject
+    :param to: List of recipient addresses
+    :param template_name: HTML template rendered at send time (optional)
+    :param context: JSON-serialisable template context
+    :param body: Plain text body, used when no template is given
+    :param from_email: Sender address, defaults to DEFAULT_FROM_EMAIL
+    :param language: Language to render the template in, defaults to LANGUAGE_CODE
+    :return: The OutboxEmail
+    """
+    email = OutboxEmail.objects.create(
+        subject=subject, to=list(to), template_name=template_name, context=context or {}, body=body,
+        from_email=from_email, language=language,
+    )
+    _schedule_drain()
+    return email
+
+
+def queue_emails(emails):
+    """
+    Write several unsaved OutboxEmail objects with one insert.
+    """
+    if not emails:
+        return []
+    emails = OutboxEmail.objects.bulk_create(emails)
+    _schedule_drain()
+    return emails
+
+
+def queue_password_reset_email(user, reset_url):
+    return queue_email(
+        'Password Reset Request',
+        [user.email],
+        template_name='password_reset.html',
+        context={'user': {'username': user.username}, 'reset_url': reset_url},
+        language=translation.get_language() or '',
+    )
+
+
+def claim_emails(batch_size):
+    """
+    Claim the next batch of due emails.
+
+    Rows are locked with SKIP LOCKED so concurrent drainers never claim the same
+    email. Emails stuck in 'sending' for longer than EMAIL_OUTBOX_CLAIM_TIMEOUT
+    (a drainer died mid-batch) are claimed again. The interrupted send counts
+    as an attempt, so an email that keeps killing its drainer is marked failed
+    after EMAIL_OUTBOX_MAX_ATTEMPTS like any other.
+
+    :param batch_size: Maximum number of emails to claim
+    :return: List of claimed OutboxEmail objects
+    """
+    now = timezone.now()
+    stale_before = now - timezone.timedelta(seconds=settings.EMAIL_OUTBOX_CLAIM_TIMEOUT)
+    claimable = Q(status='pending', next_attempt_at__lte=now) | Q(status='sending', claimed_at__lt=stale_before)
+    with transaction.atomic():
+        emails = list(
+            OutboxEmail.objects.select_for_update(skip_locked=True)
+            .filter(claimable).order_by('next_attempt_at', 'id')[:batch_size]
+        )
+        reclaimed = [email for email in emails if email.status == 'sending']
+        if reclaimed:
+            OutboxEmail.objects.filter(id__in=[email.id for email in reclaimed]).update(attempts=F('attempts') + 1)
+            for email in reclaimed:
+                email.attempts += 1
+            exhausted = {email.id for email in reclaimed if email.attempts >= settings.EMAIL_OUTBOX_MAX_ATTEMPTS}
+            if exhausted:
+                OutboxEmail.objects.filter(id__in=exhausted).update(
+                    status='failed', claimed_at=None, next_attempt_at=now, last_error='Sending was interrupted',
+                )
+                logger.error(f"Marked {len(exhausted)} outbox emails failed after repeated interrupted sends")
+                emails = [email for email in emails if email.id not in exhausted]
+        OutboxEmail.objects.filter(id__in=[email.id for email in emails]).update(status='sending', claimed_at=now)
+    return emails
+
+
+def render_email(email):
+    """
+    :return: Tuple of (text body, HTML body or None)
+    """
+    if email.template_name:
+        return render_email_template(email.template_name, email.context, email.language or settings.LANGUAGE_CODE)
+    return email.body, None
+
+
+def retry_delay(attempts):
+    return min(settings.EMAIL_OUTBOX_RETRY_BACKOFF * 2 ** (attempts - 1), settings.EMAIL_OUTBOX_MAX_BACKOFF)
+
+
+def _record_failure(email, error):
+    attempts = email.attempts + 1
+    status = 'failed' if attempts >= settings.EMAIL_OUTBOX_MAX_ATTEMPTS else 'pending'
+    OutboxEmail.objects.filter(id=email.id).update(
+        status=status,
+        attempts=attempts,
+        last_error=str(error),
+        claimed_at=None,
+        next_attempt_at=timezone.now() + timezone.timedelta(seconds=retry_delay(attempts)),
+    )
+    logger.error(f"Failed to send outbox email {email.id} (attempt {attempts}, now {status}): {str(error)}")
+
+
+def drain_outbox_batch(batch_size=None):
+    """
+    Claim and send one batch of outbox emails.
+
+    The batch goes out through the bulk mailer, paced to the SES sending rate.
+    Failed sends are rescheduled with exponential backoff and marked failed after
+    EMAIL_OUTBOX_MAX_ATTEMPTS attempts.
+
+    :param batch_size: Maximum number of emails to send, defaults to EMAIL_OUTBOX_BATCH_SIZE
+    :return: Tuple of (claimed, failed) counts
+    """
+    emails = claim_emails(batch_size or settings.EMAIL_OUTBOX_BATCH_SIZE)
+    failed = 0
+    rendered = []
+    for email in emails:
+        try:
+            text_content, html_content = render_email(email)
+        except Exception as e:
+            failed += 1
+            _record_failure(email, e)
+            continue
+        rendered.append((email, BulkEmail(email.subject, email.to, text_content, html_content,
+                                          email.from_email or None)))
+
+    results = send_bulk_emails([message for _, message in rendered])
+    for (email, _), result in zip(rendered, results):
+        if result.error is not None:
+            failed += 1
+            _record_failure(email, result.error)
+            continue
+        OutboxEmail.objects.filter(id=email.id).update(
+            status='sent', sent_at=timezone.now(), message_id=result.message_id or '',
+            attempts=email.attempts + 1, last_error='',
+        )
+    if emails:
+        logger.info(f"Sent {len(emails) - failed} of {len(emails)} outbox emails")
+    return len(emails), failed
+
+
+def purge_finished_emails():
+    """
+    Delete sent and failed emails older than EMAIL_OUTBOX_RETENTION_DAYS.
+
+    Sent emails age from when they were sent, failed ones from their last
+    attempt.
+
+    :return: Number of rows deleted
+    """
+    cutoff = timezone.now() - timezone.timedelta(days=settings.EMAIL_OUTBOX_RETENTION_DAYS)
+    deleted, _ = OutboxEmail.objects.filter(
+        Q(status='sent', sent_at__lt=cutoff) | Q(status='failed', next_attempt_at__lt=cutoff)
+    ).delete()
+    return deleted
+
+
+def delete_emails_to(addresses):
+    """
+    Delete every outbox email addressed to one of the given addresses.
+
+    Emails to users are always queued with the user as the only recipient,
+    so a row matches when its recipient list is exactly one of ``addresses``.
+
+    :param addresses: Email addresses whose emails should be removed
+    :return: Number of rows deleted
+    """
+    addresses = [address for address in addresses if address]
+    if not addresses:
+        return 0
+    query = Q()
+    for address in addresses:
+        query |= Q(to=[address])
+    deleted, _ = OutboxEmail.objects.filter(query).delete()
+    return deleted
@@ -0,0 +1,24 @@
+from celery import shared_task
+from django.conf import settings
+from .outbox import drain_outbox_batch, purge_finished_emails
+from utils.logging_utils import get_logger, log_exception, timed_function
+
+logger = get_logger(__name__)
+
+
+@shared_task
+@log_exception(logger)
+@timed_function(logger)
+def drain_email_outbox(batch_size=None):
+    batch_size = batch_size or settings.EMAIL_OUTBOX_BATCH_SIZE
+    claimed, _ = drain_outbox_batch(batch_size)
+
+    # Keep draining while there is a backlog; retries are picked up by the beat schedule.
+    if claimed == batch_size:
+        drain_email_outbox.delay(batch_size)
+
+
+@shared_task
+@log_exception(logger)
+def purge_email_outbox():
+    return purge_finished_emails()
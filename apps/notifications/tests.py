@@ -0,0 +1,194 @@
+import gc
+import threading
+import time
+
+from botocore.exceptions import ClientError, EndpointConnectionError
+from django.contrib.auth import get_user_model
+from django.template.loader import render_to_string
+from django.utils.html import strip_tags
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+from unittest.mock import patch
+from utils import emails_utils
+from utils.emails_utils import (BulkEmail, SESClientCache, TokenBucket, get_email_template, render_email_template,
+                                send_bulk_emails)
+from .models import OutboxEmail
+from .outbox import claim_emails, drain_outbox_batch, purge_finished_emails, queue_email
+
+User = get_user_model()
+
+
+@patch('apps.notifications.tasks.drain_email_outbox.delay')
+class EmailOutboxTestCase(TestCase):
+    def test_password_reset_request_only_writes_to_outbox(self, mock_drain):
+        user = User.objects.create_user(username='testuser', email='test@example.com', password='testpass123')
+        with patch('utils.emails_utils.send_ses_email') as mock_send:
+            with self.captureOnCommitCallbacks(execute=True):
+                response = APIClient().post(reverse('password_reset_request'), {'email': user.email})
+
+        self.assertEqual(response.status_code, 200)
+        mock_send.assert_not_called()
+        mock_drain.assert_called_once()
+        email = OutboxEmail.objects.get()
+        self.assertEqual(email.to, ['test@example.com'])
+        self.assertEqual(email.context['user']['username'], 'testuser')
+
+    @patch('utils.emails_utils.get_max_send_rate', return_value=14.0)
+    @patch('utils.emails_utils.send_ses_email', return_value='msg-1')
+    def test_drain_renders_and_sends_due_emails(self, mock_send, mock_rate, mock_drain):
+        queue_email('Password Reset Request', ['a@example.com'], template_name='password_reset.html',
+                    context={'user': {'username': 'alice'}, 'reset_url': 'http://x/reset'})
+        queue_email('Later', ['b@example.com'], body='Not yet')
+        OutboxEmail.objects.filter(subject='Later').update(next_attempt_at=timezone.now() + timezone.timedelta(hours=1))
+
+        self.assertEqual(drain_outbox_batch(), (1, 0))
+
+        subject, to, text_content, html_content, _ = mock_send.call_args.args
+        self.assertEqual(to, ['a@example.com'])
+        self.assertIn('alice', html_content)
+        self.assertNotIn('<p>', text_content)
+        email = OutboxEmail.objects.get(subject='Password Reset Request')
+        self.assertEqual((email.status, email.message_id), ('sent', 'msg-1'))
+
+    @patch('utils.emails_utils.get_max_send_rate', return_value=14.0)
+    @patch('utils.emails_utils.send_ses_email', side_effect=RuntimeError('throttled'))
+    def test_failed_send_is_retried_with_backoff(self, mock_send, mock_rate, mock_drain):
+        email = queue_email('Invoice', ['a@example.com'], body='Your invoice')
+
+        self.assertEqual(drain_outbox_batch(), (1, 1))
+
+        email.refresh_from_db()
+        self.assertEqual((email.status, email.attempts, email.last_error), ('pending', 1, 'throttled'))
+        self.assertGreater(email.next_attempt_at, timezone.now())
+        self.assertEqual(claim_emails(10), [])
+
+
+    @override_settings(EMAIL_OUTBOX_MAX_ATTEMPTS=2)
+    def test_interrupted_sends_count_as_attempts(self, mock_drain):
+        email = queue_email('Invoice', ['a@example.com'], body='Your invoice')
+        long_ago = timezone.now() - timezone.timedelta(hours=1)
+
+        OutboxEmail.objects.filter(id=email.id).update(status='sending', claimed_at=long_ago)
+        self.assertEqual([claimed.attempts for claimed in claim_emails(10)], [1])
+
+        OutboxEmail.objects.filter(id=email.id).update(claimed_at=long_ago)
+        self.assertEqual(claim_emails(10), [])
+        email.refresh_from_db()
+        self.assertEqual((email.status, email.attempts), ('failed', 2))
+
+    def test_purge_removes_old_sent_and_failed_emails(self, mock_drain):
+        old = timezone.now() - timezone.timedelta(days=30)
+        sent = queue_email('Sent', ['a@example.com'], body='Hi')
+        failed = queue_email('Failed', ['a@example.com'], body='Hi')
+        pending = queue_email('Pending', ['a@example.com'], body='Hi')
+        OutboxEmail.objects.filter(id=sent.id).update(status='sent', sent_at=old)
+        OutboxEmail.objects.filter(id__in=[failed.id, pending.id]).update(next_attempt_at=old)
+        OutboxEmail.objects.filter(id=failed.id).update(status='failed')
+
+        self.assertEqual(purge_finished_emails(), 2)
+        self.assertEqual(list(OutboxEmail.objects.values_list('id', flat=True)), [pending.id])
+
+
+@override_settings(AWS_SES_REGION_NAME='us-east-1')
+class SESClientCacheTestCase(SimpleTestCase):
+    def test_client_is_reused_within_a_thread(self):
+        clients = SESClientCache()
+        client = clients.get_client()
+        self.assertIs(clients.get_client(), client)
+        self.assertEqual(client.meta.config.max_pool_connections, 10)
+        self.assertEqual(clients.stats()['clients_created'], 1)
+        self.assertEqual(clients.stats()['client_reuse_rate'], 0.5)
+
+    def test_each_thread_gets_its_own_client(self):
+        clients = SESClientCache()
+        seen = []
+        thread = threading.Thread(target=lambda: seen.append(clients.get_client()))
+        thread.start()
+        thread.join()
+        self.assertIsNot(clients.get_client(), seen[0])
+        self.assertEqual(clients.stats()['clients_created'], 2)
+
+    def test_clients_of_finished_threads_are_released(self):
+        clients = SESClientCache()
+        thread = threading.Thread(target=clients.get_client)
+        thread.start()
+        thread.join()
+        gc.collect()
+        self.assertEqual(len(clients._clients), 0)
+        self.assertEqual(clients.stats()['clients_created'], 1)
+
+    def test_cache_is_dropped_after_fork(self):
+        clients = SESClientCache()
+        client = clients.get_client()
+        with patch('utils.emails_utils.os.getpid', return_value=clients._pid + 1):
+            self.assertIsNot(clients.get_client(), client)
+
+
+class BulkMailerTestCase(TestCase):
+    def _throttle(self, message='Maximum sending rate exceeded.'):
+        return ClientError({'Error': {'Code': 'Throttling', 'Message': message}}, 'SendEmail')
+
+    def test_token_bucket_paces_to_rate(self):
+        bucket = TokenBucket(rate=50, capacity=1)
+        started = time.monotonic()
+        for _ in range(6):
+            bucket.acquire()
+        self.assertGreaterEqual(time.monotonic() - started, 0.09)
+
+    @patch('utils.emails_utils.time.sleep')
+    @patch('utils.emails_utils.send_ses_email')
+    def test_only_throttled_messages_are_retried(self, mock_send, mock_sleep):
+        outcomes = {'a@example.com': [self._throttle(), 'msg-a'], 'b@example.com': [RuntimeError('bad address')]}
+
+        def send(subject, recipients, *args):
+            outcome = outcomes[recipients[0]].pop(0)
+            if isinstance(outcome, Exception):
+                raise outcome
+            return outcome
+        mock_send.side_effect = send
+
+        results = send_bulk_emails([
+            BulkEmail('Notice', ['a@example.com'], 'Hello'),
+            BulkEmail('Notice', ['b@example.com'], 'Hello'),
+        ], rate=1000)
+
+        self.assertEqual(results[0].message_id, 'msg-a')
+        self.assertEqual(str(results[1].error), 'bad address')
+        self.assertEqual(mock_send.call_count, 3)
+
+    @patch('utils.emails_utils.send_ses_email')
+    def test_daily_quota_is_not_retried(self, mock_send):
+        mock_send.side_effect = self._throttle('Daily message quota exceeded.')
+        results = send_bulk_emails([BulkEmail('Notice', ['a@example.com'], 'Hello')], rate=1000)
+        self.assertIsNotNone(results[0].error)
+        self.assertEqual(mock_send.call_count, 1)
+
+
+    @patch('utils.emails_utils.send_ses_email', return_value='msg-1')
+    def test_bulk_sends_share_one_thread_pool(self, mock_send):
+        send_bulk_emails([BulkEmail('Notice', ['a@example.com'], 'Hello')], rate=1000)
+        executor = emails_utils._get_executor()
+        send_bulk_emails([BulkEmail('Notice', ['b@example.com'], 'Hello')], rate=1000)
+        self.assertIs(emails_utils._get_executor(), executor)
+
+    @override_settings(AWS_SES_DEFAULT_MAX_SEND_RATE=3)
+    @patch('utils.emails_utils.get_ses_client')
+    def test_unreachable_quota_endpoint_uses_default_rate(self, mock_client):
+        mock_client.return_value.get_send_quota.side_effect = EndpointConnectionError(endpoint_url='https://ses')
+        with patch.dict(emails_utils._send_quota, rate=None, fetched_at=0.0):
+            self.assertEqual(emails_utils.get_max_send_rate(), 3.0)
+
+
+class EmailTemplateCacheTestCase(TestCase):
+    context = {'user': {'username': 'alice'}, 'reset_url': 'https://example.com/reset/1/'}
+
+    def test_template_is_compiled_once_per_locale(self):
+        self.assertIs(get_email_template('password_reset.html', 'es'), get_email_template('password_reset.html', 'es'))
+        self.assertIsNot(get_email_template('password_reset.html', 'en'), get_email_template('password_reset.html', 'es'))
+
+    def test_text_skeleton_matches_stripped_html(self):
+        text_content, html_content = render_email_template('password_reset.html', self.context, 'en')
+        self.assertEqual(html_content, render_to_string('password_reset.html', self.context))
+        self.assertEqual(text_content, strip_tags(html_content))
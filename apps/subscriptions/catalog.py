@@ -0,0 +1,120 @@
+import threading
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+
+from utils.logging_utils import get_logger
+from .models import AddOn, SubscriptionPlan
+
+logger = get_logger(__name__)
+
+VERSION_CACHE_KEY = 'subscriptions:catalog-version'
+
+
+class CatalogSnapshot:
+    """
+    Immutable in-process copy of every SubscriptionPlan and AddOn.
+
+    Both tables are tiny and rarely change, so each process keeps the whole
+    catalog in memory, indexed by primary key and by Stripe price ID.
+    """
+
+    def __init__(self, version, plans, add_ons):
+        self.version = version
+        self.plans_by_id = {plan.id: plan for plan in plans}
+        self.plans_by_price_id = {plan.stripe_price_id: plan for plan in plans}
+        self.add_ons_by_id = {add_on.id: add_on for add_on in add_ons}
+        self.add_ons_by_price_id = {add_on.stripe_price_id: add_on for add_on in add_ons}
+
+    @classmethod
+    def load(cls, version):
+        return cls(version, list(SubscriptionPlan.objects.all()), list(AddOn.objects.all()))
+
+
+_snapshot = None
+_lock = threading.Lock()
+
+
+def get_catalog_version():
+    """
+    Return the shared catalog version, initialising it if it is missing.
+
+    :return: The current version, or None if the cache backend does not store values
+    """
+    version = cache.get(VERSION_CACHE_KEY)
+    if version is None:
+        _initialise_version()
+        version = cache.get(VERSION_CACHE_KEY)
+    return version
+
+
+def _initialise_version():
+    # Seed from the clock rather than 1, so a flushed cache can never hand out a
+    # version that an old in-process snapshot still carries.
+    cache.add(VERSION_CACHE_KEY, int(time.time() * 1000), None)
+
+
+def get_catalog():
+    """
+    Return the catalog snapshot, reloading it if another process bumped the version.
+
+    Checking freshness costs one cache read; the database is only queried when
+    the version changed. Readers always see either the old or the new snapshot,
+    never a partially loaded one.
+    """
+    global _snapshot
+    version = get_catalog_version()
+    if version is None:
+        # No shared cache (e.g. DummyCache in development): always read fresh.
+        return CatalogSnapshot.load(version)
+
+    snapshot = _snapshot
+    if snapshot is None or snapshot.version != version:
+        with _lock:
+            if _snapshot is None or _snapshot.version != version:
+                _snapshot = CatalogSnapshot.load(version)
+                logger.info(f"Loaded subscription catalog version {version}")
+            snapshot = _snapshot
+    return snapshot
+
+
+def bump_catalog_version():
+    """
+    Invalidate every process' catalog snapshot once the current transaction commits.
+    """
+    def _bump():
+        try:
+            cache.incr(VERSION_CACHE_KEY)
+        except ValueError:
+            _initialise_version()
+
+    transaction.on_commit(_bump)
+
+
+def get_plan(plan_id):
+    try:
+        return get_catalog().plans_by_id[plan_id]
+    except KeyError:
+        raise SubscriptionPlan.DoesNotExist(f"No SubscriptionPlan with id {plan_id}")
+
+
+def get_plan_by_price_id(stripe_price_id):
+    try:
+        return get_catalog().plans_by_price_id[stripe_price_id]
+    except KeyError:
+        raise SubscriptionPlan.DoesNotExist(f"No SubscriptionPlan with stripe_price_id {stripe_price_id}")
+
+
+def get_add_on(add_on_id):
+    try:
+        return get_catalog().add_ons_by_id[add_on_id]
+    except KeyError:
+        raise AddOn.DoesNotExist(f"No AddOn with id {add_on_id}")
+
+
+def get_add_on_by_price_id(stripe_price_id):
+    try:
+        return get_catalog().add_ons_by_price_id[stripe_price_id]
+    except KeyError:
+        raise AddOn.DoesNotExist(f"No AddOn with stripe_price_id {stripe_price_id}")
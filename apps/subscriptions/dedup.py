@@ -0,0 +1,54 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from utils.logging_utils import get_logger
+from .models import ProcessedStripeEvent
+
+logger = get_logger(__name__)
+
+SEEN_EVENT_CACHE_PREFIX = 'subscriptions:stripe-event'
+
+
+def _seen_event_cache_key(event_id):
+    return f'{SEEN_EVENT_CACHE_PREFIX}:{event_id}'
+
+
+def claim_event_id(event_id):
+    """
+    Record a Stripe event ID as seen, returning False if it was seen before.
+
+    The unique index on ProcessedStripeEvent is the claim: the row commits or
+    rolls back with the caller's transaction, so an event whose processing
+    never committed (an exception, a killed worker) is accepted again on the
+    next delivery. Once the row has committed, the shared cache remembers the
+    ID so repeat deliveries are answered without touching the database. Call
+    this inside transaction.atomic().
+
+    :param event_id: The Stripe event ID
+    :return: True if this is the first delivery of the event
+    """
+    key = _seen_event_cache_key(event_id)
+    if cache.get(key):
+        return False
+    try:
+        with transaction.atomic():
+            ProcessedStripeEvent.objects.create(stripe_event_id=event_id)
+    except IntegrityError:
+        return False
+    retention = settings.STRIPE_EVENT_RETENTION_DAYS * 24 * 60 * 60
+    transaction.on_commit(lambda: cache.set(key, 1, retention))
+    return True
+
+
+def purge_processed_event_ids():
+    """
+    Delete remembered event IDs older than STRIPE_EVENT_RETENTION_DAYS.
+
+    :return: Number of deleted rows
+    """
+    cutoff = timezone.now() - timezone.timedelta(days=settings.STRIPE_EVENT_RETENTION_DAYS)
+    deleted, _ = ProcessedStripeEvent.objects.filter(received_at__lt=cutoff).delete()
+    logger.info(f"Purged {deleted} processed Stripe event IDs older than {cutoff}")
+    return deleted
@@ -0,0 +1,115 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+from utils.cache_utils import LocalTTLCache
+from utils.logging_utils import get_logger
+from .models import Subscription, UserAddOn
+
+logger = get_logger(__name__)
+
+CACHE_KEY_PREFIX = 'subscriptions:entitlements'
+GRACE_PERIOD = timezone.timedelta(days=14)
+
+# Bounded per-process layer in front of the shared cache. Invalidations only
+# clear the local layer of the process that performs them, so other processes
+# may serve a stale snapshot for at most SUBSCRIPTION_ENTITLEMENTS_LOCAL_TTL seconds.
+_local_cache = LocalTTLCache(
+    maxsize=settings.SUBSCRIPTION_ENTITLEMENTS_LOCAL_MAXSIZE,
+    ttl=settings.SUBSCRIPTION_ENTITLEMENTS_LOCAL_TTL,
+)
+
+
+class Entitlements:
+    """
+    Read-only snapshot of what a user is currently entitled to.
+
+    Built from the user's Subscription and UserAddOn rows and cached as a plain
+    dict, so reading it never touches the database on a warm cache.
+    """
+
+    def __init__(self, snapshot):
+        self.status = snapshot['status']
+        self.plan_id = snapshot['plan_id']
+        self.current_period_end = snapshot['current_period_end']
+        self.add_on_ids = snapshot['add_on_ids']
+
+    @classmethod
+    def empty(cls):
+        return cls({'status': None, 'plan_id': None, 'current_period_end': None, 'add_on_ids': []})
+
+    @property
+    def has_subscription(self):
+        return self.status is not None
+
+    @property
+    def expired(self):
+        if not self.has_subscription:
+            return True
+        grace_period = timezone.now() + GRACE_PERIOD
+        return self.status != 'active' and self.current_period_end < grace_period
+
+    def has_add_on(self, add_on_id):
+        return add_on_id in self.add_on_ids
+
+
+def _cache_key(user_id):
+    return f'{CACHE_KEY_PREFIX}:{user_id}'
+
+
+def build_snapshot(user_id):
+    """
+    Build the entitlement snapshot for a user from the database.
+
+    :param user_id: Primary key of the user
+    :return: Dict holding status, plan_id, current_period_end and add_on_ids
+    """
+    subscription = Subscription.objects.filter(user_id=user_id).values(
+        'status', 'plan_id', 'current_period_end'
+    ).first()
+    add_on_ids = list(UserAddOn.objects.filter(user_id=user_id).values_list('add_on_id', flat=True))
+    return {
+        'status': subscription['status'] if subscription else None,
+        'plan_id': subscription['plan_id'] if subscription else None,
+        'current_period_end': subscription['current_period_end'] if subscription else None,
+        'add_on_ids': add_on_ids,
+    }
+
+
+def get_entitlements(user_id):
+    """
+    Return the Entitlements for a user, reading through the local and shared caches.
+
+    :param user_id: Primary key of the user
+    :return: Entitlements instance
+    """
+    key = _cache_key(user_id)
+    snapshot = _local_cache.get(key)
+    if snapshot is None:
+        snapshot = cache.get(key)
+        if snapshot is None:
+            snapshot = build_snapshot(user_id)
+            cache.set(key, snapshot, settings.SUBSCRIPTION_ENTITLEMENTS_CACHE_TIMEOUT)
+        _local_cache.set(key, snapshot)
+    return Entitlements(snapshot)
+
+
+def invalidate_entitlements(user_id):
+    """
+    Drop the cached entitlement snapshot for a user.
+
+    The shared cache entry is removed immediately and again once the current
+    transaction commits, so a concurrent request cannot re-cache the old state.
+
+    :param user_id: Primary key of the user
+    """
+    key = _cache_key(user_id)
+
+    def _invalidate():
+        cache.delete(key)
+        _local_cache.delete(key)
+
+    _invalidate()
+    transaction.on_commit(_invalidate)
+    logger.debug(f"Invalidated entitlements for user {user_id}")
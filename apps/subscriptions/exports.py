@@ -0,0 +1,109 @@
+import csv
+import json
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from .models import Invoice, Payment
+
+# Per export kind: the model, the date field the range filter applies to, and
+# the exported columns. Filters and ordering match the (date, id) and
+# (status, date, id) indexes on each model.
+EXPORTS = {
+    'payments': (Payment, 'created_at', [
+        'id', 'stripe_payment_intent_id', 'user_id', 'amount', 'status', 'created_at',
+    ]),
+    'invoices': (Invoice, 'due_date', [
+        'id', 'stripe_invoice_id', 'user_id', 'amount', 'status', 'due_date', 'pdf_url',
+    ]),
+}
+
+FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+}
+
+
+class Echo:
+    """
+    File-like object whose write() hands the value back, so csv.writer can
+    format one row at a time without buffering.
+    """
+
+    def write(self, value):
+        return value
+
+
+def parse_bound(value):
+    """
+    Parse a date range bound given as YYYY-MM-DD or an ISO 8601 datetime.
+
+    :return: Timezone-aware datetime, or None for an empty value
+    :raises ValueError: If the value is not a valid date or datetime
+    """
+    if not value:
+        return None
+    parsed = parse_datetime(value)
+    if parsed is None:
+        date = parse_date(value)
+        if date is None:
+            raise ValueError(f"Invalid date: {value}")
+        parsed = timezone.datetime.combine(date, timezone.datetime.min.time())
+    return timezone.make_aware(parsed) if timezone.is_naive(parsed) else parsed
+
+
+def export_rows(kind, start=None, end=None, statuses=None, chunk_size=None):
+    """
+    Stream the rows of a billing export as tuples.
+
+    Rows are fetched through a server-side cursor in chunks of ``chunk_size``,
+    so memory use does not depend on the number of rows exported.
+
+    :param kind: 'payments' or 'invoices'
+    :param start: Only include rows on or after this date/datetime
+    :param end: Only include rows before this date/datetime
+    :param statuses: Optional list of statuses to include
+    :param chunk_size: Rows per cursor fetch, defaults to BILLING_EXPORT_CHUNK_SIZE
+    :return: Iterator of value tuples in the order of the export's columns
+    """
+    model, date_field, fields = EXPORTS[kind]
+    queryset = model.objects.all()
+    if start is not None:
+        queryset = queryset.filter(**{f'{date_field}__gte': start})
+    if end is not None:
+        queryset = queryset.filter(**{f'{date_field}__lt': end})
+    if statuses:
+        queryset = queryset.filter(status__in=statuses)
+    return queryset.order_by(date_field, 'id').values_list(*fields).iterator(
+        chunk_size=chunk_size or settings.BILLING_EXPORT_CHUNK_SIZE
+    )
+
+
+def stream_csv(fields, rows):
+    writer = csv.writer(Echo())
+    yield writer.writerow(fields)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def stream_ndjson(fields, rows):
+    for row in rows:
+        yield json.dumps(dict(zip(fields, row)), cls=DjangoJSONEncoder) + '\n'
+
+
+def stream_export(kind, file_format='csv', **filters):
+    """
+    Render a billing export lazily, one line at a time.
+
+    :param kind: 'payments' or 'invoices'
+    :param file_format: 'csv' or 'ndjson'
+    :param filters: Passed on to export_rows
+    :return: Generator of text lines
+    """
+    fields = EXPORTS[kind][2]
+    rows = export_rows(kind, **filters)
+    if file_format == 'ndjson':
+        return stream_ndjson(fields, rows)
+    return stream_csv(fields, rows)
@@ -0,0 +1,258 @@
+import hashlib
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+
+import django
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import transaction
+from django.template.loader import get_template
+from django.urls import reverse
+from django.utils.module_loading import import_string
+
+from utils.logging_utils import get_logger
+from utils.process_utils import can_use_process_pool
+from .models import Invoice
+
+logger = get_logger(__name__)
+
+INVOICE_TEMPLATE = 'invoices/invoice.txt'
+
+# A4 in points, with a plain Helvetica text layout.
+PAGE_WIDTH = 595
+PAGE_HEIGHT = 842
+MARGIN = 56
+FONT_SIZE = 11
+LEADING = 15
+
+
+@lru_cache(maxsize=None)
+def get_invoice_template():
+    """
+    Return the compiled invoice template, parsed once per process.
+    """
+    return get_template(INVOICE_TEMPLATE)
+
+
+@lru_cache(maxsize=None)
+def get_invoice_storage():
+    """
+    Return the storage backend configured by INVOICE_PDF_STORAGE.
+    """
+    return import_string(settings.INVOICE_PDF_STORAGE)(**settings.INVOICE_PDF_STORAGE_OPTIONS)
+
+
+def render_invoice_text(invoice):
+    """
+    Render the text content of an invoice. The user must already be loaded.
+    """
+    return get_invoice_template().render({
+        'invoice': invoice,
+        'user': invoice.user,
+        'issuer_name': settings.INVOICE_ISSUER_NAME,
+        'currency': settings.INVOICE_CURRENCY,
+    })
+
+
+def _pdf_string(line):
+    line = line.encode('latin-1', 'replace').decode('latin-1')
+    return line.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+
+
+def build_pdf(text):
+    """
+    Lay out plain text as a PDF document.
+
+    Pure function of its input, so it can run in a worker process and always
+    produces the same bytes for the same text.
+
+    :param text: Invoice text; one PDF line per text line
+    :return: PDF file content as bytes
+    """
+    lines = text.splitlines() or ['']
+    lines_per_page = (PAGE_HEIGHT - 2 * MARGIN) // LEADING
+    pages = [lines[i:i + lines_per_page] for i in range(0, len(lines), lines_per_page)]
+
+    # Objects 1-3 are the catalog, the page tree and the font; each page then
+    # takes a page object followed by its content stream.
+    page_ids = [4 + 2 * i for i in range(len(pages))]
+    objects = [
+        b'<< /Type /Catalog /Pages 2 0 R >>',
+        b'<< /Type /Pages /Kids [' + b' '.join(b'%d 0 R' % pid for pid in page_ids)
+        + b'] /Count %d >>' % len(pages),
+        b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>',
+    ]
+    for page_id, page_lines in zip(page_ids, pages):
+        commands = [f'BT /F1 {FONT_SIZE} Tf {LEADING} TL {MARGIN} {PAGE_HEIGHT - MARGIN} Td']
+        commands.extend(f'({_pdf_string(line)}) Tj T*' for line in page_lines)
+        commands.append('ET')
+        stream = '\n'.join(commands).encode('latin-1')
+        objects.append(
+            b'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 %d %d] ' % (PAGE_WIDTH, PAGE_HEIGHT)
+            + b'/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>' % (page_id + 1)
+        )
+        objects.append(b'<< /Length %d >>\nstream\n' % len(stream) + stream + b'\nendstream')
+
+    output = bytearray(b'%PDF-1.4\n')
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(output))
+        output += b'%d 0 obj\n' % number + body + b'\nendobj\n'
+    xref_offset = len(output)
+    output += b'xref\n0 %d\n0000000000 65535 f \n' % (len(objects) + 1)
+    output += b''.join(b'%010d 00000 n \n' % offset for offset in offsets)
+    output += b'trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (len(objects) + 1, xref_offset)
+    return bytes(output)
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            # Spawned rather than forked: the parent may be running threads.
+            _executor = ProcessPoolExecutor(
+                max_workers=settings.INVOICE_PDF_WORKERS,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=django.setup,
+            )
+        return _executor
+
+
+def _reset_after_fork():
+    global _executor
+    _executor = None
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def content_hash(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def render_invoice(invoice):
+    """
+    Render an invoice's text and, unless it matches the stored PDF, its PDF.
+
+    :param invoice: Invoice with its user loaded
+    :return: Tuple of (content hash, PDF bytes or None when unchanged)
+    """
+    text = render_invoice_text(invoice)
+    digest = content_hash(text)
+    if invoice.pdf_url and invoice.pdf_hash == digest:
+        return digest, None
+    return digest, build_pdf(text)
+
+
+def render_invoices(invoices):
+    """
+    Render several invoices, spreading the work over the process pool.
+
+    Template rendering, hashing and layout all run in the pool. A single
+    invoice, or a process where can_use_process_pool() says no, renders
+    inline. To use the pool from Celery, route generate_invoice_pdfs to
+    INVOICE_PDF_QUEUE.
+
+    :param invoices: Invoices with their user loaded
+    :return: List of render_invoice() results in the same order
+    """
+    if len(invoices) < 2 or not can_use_process_pool(settings.INVOICE_PDF_WORKERS):
+        return [render_invoice(invoice) for invoice in invoices]
+    return list(_get_executor().map(render_invoice, invoices, chunksize=settings.INVOICE_PDF_CHUNK_SIZE))
+
+
+def invoice_pdf_name(invoice, digest):
+    """
+    Storage name of an invoice's PDF for the given content hash.
+    """
+    return f'invoices/{invoice.user_id}/{invoice.stripe_invoice_id}-{digest[:12]}.pdf'
+
+
+def invoice_pdf_url(invoice, digest):
+    """
+    Absolute link to an invoice's PDF through the authenticated invoice_pdf view.
+
+    The content hash in the query string changes with every new rendering, so
+    clients and caches can tell versions apart.
+    """
+    path = reverse('invoice_pdf', args=[invoice.id])
+    return f"{settings.INVOICE_PDF_BASE_URL.rstrip('/')}{path}?v={digest[:12]}"
+
+
+def delete_invoice_pdfs(invoices):
+    """
+    Delete the stored PDFs of invoices. The invoice rows are left unchanged.
+
+    :param invoices: Invoices with pdf_hash loaded
+    :return: Number of files deleted
+    """
+    storage = get_invoice_storage()
+    deleted = 0
+    for invoice in invoices:
+        if not invoice.pdf_hash:
+            continue
+        name = invoice_pdf_name(invoice, invoice.pdf_hash)
+        if storage.exists(name):
+            storage.delete(name)
+            deleted += 1
+    return deleted
+
+
+def _delete_files(names):
+    storage = get_invoice_storage()
+    for name in names:
+        if storage.exists(name):
+            storage.delete(name)
+
+
+def _save_files(files):
+    storage = get_invoice_storage()
+    for name, content in files:
+        if not storage.exists(name):
+            storage.save(name, ContentFile(content))
+
+
+def render_invoice_pdfs(invoices):
+    """
+    Render and store PDFs for a batch of invoices, skipping unchanged ones.
+
+    The rendered text is hashed before any PDF is built; an invoice whose hash
+    matches its stored pdf_hash already has an up-to-date PDF and is left alone.
+    Rendering runs in the process pool (see render_invoices) and changed
+    invoices are updated with a single bulk_update. The new PDFs are written to
+    the invoice storage, and the previous ones deleted, once the update
+    commits, so a rollback leaves no files behind.
+
+    :param invoices: Invoices with their user loaded (select_related('user'))
+    :return: List of invoices that got a new PDF
+    """
+    pending = [
+        (invoice, digest, pdf)
+        for invoice, (digest, pdf) in zip(invoices, render_invoices(invoices)) if pdf is not None
+    ]
+    if not pending:
+        return []
+
+    superseded = [invoice_pdf_name(invoice, invoice.pdf_hash)
+                  for invoice, digest, _ in pending if invoice.pdf_hash and invoice.pdf_hash != digest]
+    files = []
+    for invoice, digest, pdf in pending:
+        files.append((invoice_pdf_name(invoice, digest), pdf))
+        invoice.pdf_url = invoice_pdf_url(invoice, digest)
+        invoice.pdf_hash = digest
+
+    updated = [invoice for invoice, _, _ in pending]
+    Invoice.objects.bulk_update(updated, ['pdf_url', 'pdf_hash'])
+    transaction.on_commit(lambda: _save_files(files))
+    if superseded:
+        transaction.on_commit(lambda: _delete_files(superseded))
+    logger.info(f"Rendered {len(updated)} invoice PDFs, {len(invoices) - len(updated)} unchanged")
+    return updated
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.subscriptions.exports import EXPORTS, FORMATS, parse_bound, stream_export
+
+
+class Command(BaseCommand):
+    help = 'Streams payment or invoice history as CSV or NDJSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=list(EXPORTS))
+        parser.add_argument('--format', dest='file_format', choices=list(FORMATS), default='csv')
+        parser.add_argument('--start', help='Only include rows on or after this date (YYYY-MM-DD or ISO datetime)')
+        parser.add_argument('--end', help='Only include rows before this date (YYYY-MM-DD or ISO datetime)')
+        parser.add_argument('--status', action='append', help='Only include this status (may be given more than once)')
+        parser.add_argument('--chunk-size', type=int, help='Rows fetched per database round trip')
+        parser.add_argument('--output', help='File to write to (defaults to stdout)')
+
+    def handle(self, *args, **options):
+        try:
+            start = parse_bound(options['start'])
+            end = parse_bound(options['end'])
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        lines = stream_export(options['kind'], options['file_format'], start=start, end=end,
+                              statuses=options['status'], chunk_size=options['chunk_size'])
+        if options['output']:
+            with open(options['output'], 'w', newline='') as output:
+                output.writelines(lines)
+            self.stderr.write(self.style.SUCCESS(f"Exported {options['kind']} to {options['output']}"))
+        else:
+            for line in lines:
+                self.stdout.write(line, ending='')
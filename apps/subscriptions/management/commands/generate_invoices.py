@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from apps.subscriptions.invoice_runs import run_invoices
+from apps.subscriptions.tasks import run_invoice_generation
+
+
+class Command(BaseCommand):
+    help = 'Invoices every active subscription for a billing month, resuming an interrupted run'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--period', help='Billing month as YYYY-MM (defaults to the current month)')
+        parser.add_argument('--chunk-size', type=int, help='Subscriptions invoiced per transaction')
+        parser.add_argument('--async', dest='run_async', action='store_true',
+                            help='Queue the run as a Celery task instead of running it here')
+
+    def handle(self, *args, **options):
+        period = timezone.now().date()
+        if options['period']:
+            try:
+                period = timezone.datetime.strptime(options['period'], '%Y-%m').date()
+            except ValueError:
+                raise CommandError('--period must be given as YYYY-MM')
+
+        if options['run_async']:
+            result = run_invoice_generation.delay(period.isoformat(), options['chunk_size'])
+            self.stdout.write(self.style.SUCCESS(f'Queued invoice run task {result.id}'))
+            return
+
+        run = run_invoices(period, options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Invoice run for {run.period:%Y-%m} {run.status}: {run.invoices_created} invoices, '
+            f'{run.subscriptions_processed} subscriptions'
+        ))
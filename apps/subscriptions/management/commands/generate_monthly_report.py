@@ -1,18 +1,30 @@
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
 from django.utils import timezone
-from apps.subscriptions.models import Subscription, Payment, Invoice
+from apps.subscriptions.rollups import get_monthly_report, rebuild_revenue_rollups
 
 
 class Command(BaseCommand):
     help = 'Generates monthly financial report'
 
+    def add_arguments(self, parser):
+        parser.add_argument('--month', help='Month to report on as YYYY-MM (defaults to the current month)')
+        parser.add_argument('--rebuild', action='store_true',
+                            help='Recompute the revenue rollups from payments and invoices first')
+
     def handle(self, *args, **options):
         now = timezone.now()
-        month_start = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+        if options['month']:
+            try:
+                now = timezone.datetime.strptime(options['month'], '%Y-%m')
+            except ValueError:
+                raise CommandError('--month must be given as YYYY-MM')
 
-        active_subscriptions = Subscription.objects.filter(status='active').count()
-        total_revenue = Payment.objects.filter(created_at__gte=month_start).aggregate(Sum('amount'))['amount__sum'] or 0
-        pending_invoices = Invoice.objects.filter(status='open').count()
+        if options['rebuild']:
+            rows = rebuild_revenue_rollups()
+            self.stdout.write(f'Rebuilt {rows} revenue rollup rows')
 
-        # Generate and save report logic here
-        self.stdout.write(self.style.SUCCESS(f'Monthly report generated for {now.strftime("%B %Y")}'))
\ No newline at end of file
+        report = get_monthly_report(now)
+        self.stdout.write(f"Active subscriptions: {report['active_subscriptions']}")
+        self.stdout.write(f"Revenue: {report['total_revenue']} from {report['payment_count']} payments")
+        self.stdout.write(f"Pending invoices: {report['pending_invoices']}")
+        self.stdout.write(self.style.SUCCESS(f'Monthly report generated for {now.strftime("%B %Y")}'))
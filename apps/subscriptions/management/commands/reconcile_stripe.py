@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+
+from apps.subscriptions.reconciliation import DEFAULT_PAGE_SIZE, RECONCILERS, reconcile_all
+from apps.subscriptions.tasks import reconcile_stripe_data
+
+
+class Command(BaseCommand):
+    help = 'Reconciles local subscriptions, invoices and payments against Stripe'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--only', choices=list(RECONCILERS), action='append',
+                            help='Reconcile only this kind (may be given more than once)')
+        parser.add_argument('--page-size', type=int, default=DEFAULT_PAGE_SIZE,
+                            help='Stripe objects fetched and compared per page (max 100)')
+        parser.add_argument('--dry-run', action='store_true', help='Report differences without writing them')
+        parser.add_argument('--async', dest='run_async', action='store_true',
+                            help='Queue the reconciliation as a Celery task instead of running it here')
+
+    def handle(self, *args, **options):
+        if options['run_async']:
+            result = reconcile_stripe_data.delay(options['page_size'], options['dry_run'], options['only'])
+            self.stdout.write(self.style.SUCCESS(f'Queued Stripe reconciliation task {result.id}'))
+            return
+
+        results = reconcile_all(options['page_size'], options['dry_run'], options['only'])
+        for kind, stats in results.items():
+            self.stdout.write(self.style.SUCCESS(
+                f"{kind}: checked {stats['checked']}, updated {stats['updated']}, "
+                f"created {stats['created']}, unmatched {stats['unmatched']}"
+            ))
@@ -1,19 +1,63 @@
-from django.utils import timezone
+from django.conf import settings
+from django.http import HttpRequest
+from django.utils.functional import SimpleLazyObject
+
+from .entitlements import Entitlements, get_entitlements
 from .models import Subscription
 
+
+def get_request_entitlements(request):
+    if not request.user.is_authenticated:
+        return Entitlements.empty()
+    return get_entitlements(request.user.pk)
+
+
+def get_request_subscription(request):
+    if not request.user.is_authenticated:
+        return None
+    return Subscription.objects.select_related('plan').filter(user=request.user).first()
+
+
+class LazyRequestSubscription:
+    """
+    ``request.subscription``: the user's Subscription (with its plan), or a real
+    None for anonymous users and users without one.
+
+    Loaded on first access and then stored on the request, which takes
+    precedence over this descriptor. Requests SubscriptionMiddleware skipped
+    have no such attribute.
+    """
+
+    def __get__(self, request, owner=None):
+        if request is None:
+            return self
+        if not request.__dict__.get('_lazy_subscription'):
+            raise AttributeError('subscription')
+        subscription = request.__dict__['subscription'] = get_request_subscription(request)
+        return subscription
+
+
+HttpRequest.subscription = LazyRequestSubscription()
+
+
 class SubscriptionMiddleware:
+    """
+    Attach lazy ``request.entitlements`` and ``request.subscription`` attributes.
+
+    Nothing is resolved until a view reads one of them: ``request.entitlements``
+    is served from the entitlement cache, while ``request.subscription`` loads the
+    full Subscription row. Paths starting with one of
+    SUBSCRIPTION_EXEMPT_URL_PREFIXES are passed through untouched.
+    """
+
     def __init__(self, get_response):
         self.get_response = get_response
+        self.exempt_prefixes = tuple(settings.SUBSCRIPTION_EXEMPT_URL_PREFIXES)
 
     def __call__(self, request):
-        if request.user.is_authenticated:
-            try:
-                subscription = Subscription.objects.get(user=request.user)
-                grace_period = timezone.now() + timezone.timedelta(days=14)
-                if subscription.status != 'active' and subscription.current_period_end < grace_period:
-                    request.subscription_expired = True
-            except Subscription.DoesNotExist:
-                request.subscription_expired = True
+        if not request.path_info.startswith(self.exempt_prefixes):
+            request.entitlements = SimpleLazyObject(lambda: get_request_entitlements(request))
+            request._lazy_subscription = True
 
         response = self.get_response(request)
-        return response
\ No newline at end of file
+        return response
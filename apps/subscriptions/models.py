@@ -2,24 +2,42 @@ from django.conf import settings
 from django.db import models
 
 
+class LoadedValuesMixin:
+    """
+    Remembers the field values a row had when it was loaded, so post_save
+    handlers can tell what changed without querying the database again.
+    """
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+
+
 class SubscriptionPlan(models.Model):
     name = models.CharField(max_length=100)
-    stripe_price_id = models.CharField(max_length=100)
+    stripe_price_id = models.CharField(max_length=100, db_index=True)
     user_limit = models.IntegerField()
     price = models.DecimalField(max_digits=10, decimal_places=2)
 
 
-class Subscription(models.Model):
+class Subscription(LoadedValuesMixin, models.Model):
     user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     plan = models.ForeignKey(SubscriptionPlan, on_delete=models.PROTECT)
-    stripe_subscription_id = models.CharField(max_length=100)
+    stripe_subscription_id = models.CharField(max_length=100, db_index=True)
     status = models.CharField(max_length=20)
     current_period_end = models.DateTimeField()
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'id']),
+        ]
+
 
 class AddOn(models.Model):
     name = models.CharField(max_length=100)
-    stripe_price_id = models.CharField(max_length=100)
+    stripe_price_id = models.CharField(max_length=100, db_index=True)
     price = models.DecimalField(max_digits=10, decimal_places=2)
 
 
@@ -29,18 +47,142 @@ class UserAddOn(models.Model):
     stripe_subscription_item_id = models.CharField(max_length=100)
 
 
-class Invoice(models.Model):
+class Invoice(LoadedValuesMixin, models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
-    stripe_invoice_id = models.CharField(max_length=100)
+    stripe_invoice_id = models.CharField(max_length=100, db_index=True)
     amount = models.DecimalField(max_digits=10, decimal_places=2)
     status = models.CharField(max_length=20)
     due_date = models.DateTimeField()
     pdf_url = models.URLField()
+    # SHA-256 of the content the current PDF was rendered from
+    pdf_hash = models.CharField(max_length=64, blank=True)
+    # Plan of the user's subscription when the invoice was created; revenue
+    # rollups are attributed to it, so later plan changes do not move history
+    plan = models.ForeignKey(SubscriptionPlan, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['due_date', 'id']),
+            models.Index(fields=['status', 'due_date', 'id']),
+        ]
 
-class Payment(models.Model):
+
+class Payment(LoadedValuesMixin, models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
-    stripe_payment_intent_id = models.CharField(max_length=100)
+    stripe_payment_intent_id = models.CharField(max_length=100, db_index=True)
     amount = models.DecimalField(max_digits=10, decimal_places=2)
     status = models.CharField(max_length=20)
     created_at = models.DateTimeField(auto_now_add=True)
+    # Plan of the user's subscription when the payment was created (see Invoice.plan)
+    plan = models.ForeignKey(SubscriptionPlan, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['created_at', 'id']),
+            models.Index(fields=['status', 'created_at', 'id']),
+        ]
+
+
+class WebhookEvent(models.Model):
+    """
+    A verified Stripe webhook event waiting to be applied by a Celery worker.
+    """
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('processing', 'Processing'),
+        ('processed', 'Processed'),
+        ('failed', 'Failed'),
+    ]
+
+    stripe_event_id = models.CharField(max_length=100)
+    event_type = models.CharField(max_length=100)
+    stripe_customer_id = models.CharField(max_length=100, blank=True)
+    payload = models.JSONField()
+    stripe_created = models.DateTimeField()
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    received_at = models.DateTimeField(auto_now_add=True)
+    claimed_at = models.DateTimeField(null=True, blank=True)
+    # Set after a failed attempt; the event is not claimed again before then.
+    next_attempt_at = models.DateTimeField(null=True, blank=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'stripe_created', 'id']),
+            models.Index(fields=['stripe_customer_id', 'status']),
+        ]
+
+
+class ProcessedStripeEvent(models.Model):
+    """
+    IDs of Stripe events that have already been accepted, used to drop redelivered events.
+    """
+    stripe_event_id = models.CharField(max_length=100, unique=True)
+    received_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+
+class MonthlyRevenueRollup(models.Model):
+    """
+    Payment and invoice totals per month, plan and status.
+
+    Kept up to date incrementally as payments and invoices are saved, and
+    rebuilt from scratch by ``generate_monthly_report --rebuild``. Payments are
+    bucketed by creation month, invoices by due month, and both are attributed
+    to the plan recorded on them at creation (or no plan).
+    """
+    month = models.DateField()
+    plan = models.ForeignKey(SubscriptionPlan, on_delete=models.CASCADE, null=True, blank=True)
+    status = models.CharField(max_length=20)
+    payment_count = models.IntegerField(default=0)
+    payment_amount = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    invoice_count = models.IntegerField(default=0)
+    invoice_amount = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['month', 'plan', 'status'], name='unique_revenue_rollup'),
+            models.UniqueConstraint(fields=['month', 'status'], condition=models.Q(plan__isnull=True),
+                                    name='unique_revenue_rollup_without_plan'),
+        ]
+
+
+class SubscriptionStatusCount(models.Model):
+    """
+    Number of subscriptions per status.
+
+    Kept up to date incrementally as subscriptions are written, and rebuilt
+    with the revenue rollups, so reports do not count the subscription table.
+    """
+    status = models.CharField(max_length=20, unique=True)
+    count = models.IntegerField(default=0)
+
+
+class InvoiceRun(models.Model):
+    """
+    Checkpoint for the bulk invoice run of one billing period.
+
+    Subscriptions are invoiced in ID order; last_subscription_id records how far
+    the run got, so a crashed run resumes where it stopped. Invoice PDFs are
+    rendered by tasks queued after each chunk commits, and
+    last_dispatched_invoice_id records the last invoice whose render was
+    queued, so a resumed run only re-queues invoices that never were.
+    """
+    STATUS_CHOICES = [
+        ('running', 'Running'),
+        ('completed', 'Completed'),
+        ('failed', 'Failed'),
+    ]
+
+    period = models.DateField(unique=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='running')
+    due_date = models.DateTimeField()
+    last_subscription_id = models.BigIntegerField(default=0)
+    last_dispatched_invoice_id = models.BigIntegerField(default=0)
+    subscriptions_processed = models.PositiveIntegerField(default=0)
+    invoices_created = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    started_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    completed_at = models.DateTimeField(null=True, blank=True)
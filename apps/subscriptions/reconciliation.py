@@ -0,0 +1,246 @@
+from collections import namedtuple
+from decimal import Decimal
+from itertools import islice
+
+import stripe
+from django.contrib.auth import get_user_model
+from django.db import models, transaction
+from django.db.models import Case, Q, Value, When
+from django.utils import timezone
+
+from utils.logging_utils import get_logger
+from . import catalog
+from .entitlements import invalidate_entitlements
+from .models import Invoice, Payment, Subscription, SubscriptionPlan
+from .rollups import attribute_plans, rebuild_revenue_rollups, record_subscription_changes
+
+logger = get_logger(__name__)
+
+User = get_user_model()
+
+DEFAULT_PAGE_SIZE = 100
+
+LIVE_STATUSES = ('active', 'trialing')
+
+
+def chunked(iterable, size):
+    """
+    Yield lists of up to ``size`` items from any iterable without materialising it.
+    """
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _timestamp(value):
+    return timezone.datetime.fromtimestamp(value, tz=timezone.utc) if value else None
+
+
+def _amount(value):
+    return Decimal(value or 0) / 100
+
+
+def _users_by_customer(stripe_objects):
+    customer_ids = {obj.customer for obj in stripe_objects if obj.get('customer')}
+    return dict(
+        User.objects.filter(stripe_customer_id__in=customer_ids).values_list('stripe_customer_id', 'id')
+    )
+
+
+def _subscription_fields(stripe_subscription, users_by_customer):
+    try:
+        plan_id = catalog.get_plan_by_price_id(stripe_subscription['items']['data'][0]['price']['id']).id
+    except (SubscriptionPlan.DoesNotExist, KeyError, IndexError):
+        plan_id = None
+    return {
+        'user_id': users_by_customer.get(stripe_subscription.customer),
+        'plan_id': plan_id,
+        'status': stripe_subscription.status,
+        'current_period_end': _timestamp(stripe_subscription.current_period_end),
+    }
+
+
+def _subscription_rank(fields):
+    # Live subscriptions first, then the one that runs longest.
+    period_end = fields['current_period_end'] or timezone.datetime.min.replace(tzinfo=timezone.utc)
+    return fields['status'] in LIVE_STATUSES, period_end
+
+
+def _invoice_fields(stripe_invoice, users_by_customer):
+    return {
+        'user_id': users_by_customer.get(stripe_invoice.customer),
+        'amount': _amount(stripe_invoice.amount_due),
+        'status': stripe_invoice.status,
+        'due_date': _timestamp(stripe_invoice.due_date or stripe_invoice.created),
+        'pdf_url': stripe_invoice.get('invoice_pdf') or '',
+    }
+
+
+def _payment_fields(stripe_payment_intent, users_by_customer):
+    return {
+        'user_id': users_by_customer.get(stripe_payment_intent.customer),
+        'amount': _amount(stripe_payment_intent.amount),
+        'status': stripe_payment_intent.status,
+        'created_at': _timestamp(stripe_payment_intent.created),
+    }
+
+
+Reconciler = namedtuple('Reconciler', [
+    'model',          # local model
+    'id_field',       # indexed Stripe ID column on the model
+    'resource',       # Stripe API resource to list
+    'list_params',    # extra parameters for the list call
+    'build_fields',   # maps a Stripe object to local field values
+    'update_fields',  # fields kept in sync on existing rows
+    'create_requires',  # fields that must resolve before a missing row is created
+    'user_rank',      # for models with one row per user: ranks Stripe objects, the row keeps the highest
+    'created_field',  # auto_now_add column backdated to Stripe's created time on new rows
+])
+
+RECONCILERS = {
+    'subscriptions': Reconciler(
+        Subscription, 'stripe_subscription_id', stripe.Subscription, {'status': 'all'},
+        _subscription_fields, ['plan_id', 'status', 'current_period_end'], ['user_id', 'plan_id'],
+        _subscription_rank, None,
+    ),
+    'invoices': Reconciler(
+        Invoice, 'stripe_invoice_id', stripe.Invoice, {},
+        _invoice_fields, ['amount', 'status', 'due_date'], ['user_id'],
+        None, None,
+    ),
+    'payments': Reconciler(
+        Payment, 'stripe_payment_intent_id', stripe.PaymentIntent, {},
+        _payment_fields, ['amount', 'status'], ['user_id'],
+        None, 'created_at',
+    ),
+}
+
+
+def _backdate_created(model, id_field, created_field, dated):
+    """
+    Overwrite the auto_now_add column of freshly created rows in one UPDATE.
+
+    :param dated: Dict mapping Stripe IDs to their created datetimes
+    """
+    model.objects.filter(**{f'{id_field}__in': list(dated)}).update(**{created_field: Case(
+        *[When(**{id_field: stripe_id}, then=Value(created)) for stripe_id, created in dated.items()],
+        output_field=models.DateTimeField(),
+    )})
+
+
+def reconcile(kind, page_size=DEFAULT_PAGE_SIZE, dry_run=False):
+    """
+    Stream one Stripe list endpoint and bring the matching local table in line with it.
+
+    Stripe objects are consumed page by page through auto-pagination. For each
+    page the local rows are fetched in one query on the indexed Stripe ID, changed
+    rows are written with bulk_update and missing rows (whose customer maps to a
+    local user) with bulk_create. Only one page is held in memory at a time.
+
+    Subscriptions are one row per user. When a Stripe subscription belongs to a
+    user whose row holds another one, the row is pointed at it only if it ranks
+    higher: active or trialing before any other status, then the later period
+    end. The comparison is against the row itself, so nothing is remembered
+    between pages.
+
+    :param kind: One of 'subscriptions', 'invoices' or 'payments'
+    :param page_size: Number of Stripe objects fetched and compared per page
+    :param dry_run: Count differences without writing them
+    :return: Dict with checked, updated, created and unmatched counts
+    """
+    reconciler = RECONCILERS[kind]
+    model, id_field, update_fields = reconciler.model, reconciler.id_field, reconciler.update_fields
+    user_rank = reconciler.user_rank
+    if user_rank:
+        update_fields = update_fields + [id_field]
+    stripe_objects = reconciler.resource.list(limit=page_size, **reconciler.list_params).auto_paging_iter()
+
+    stats = {'checked': 0, 'updated': 0, 'created': 0, 'unmatched': 0}
+    for page in chunked(stripe_objects, page_size):
+        users_by_customer = _users_by_customer(page)
+        lookup = Q(**{f'{id_field}__in': [obj.id for obj in page]})
+        if user_rank:
+            lookup |= Q(user_id__in=users_by_customer.values())
+        rows = list(model.objects.filter(lookup))
+        local_rows = {getattr(row, id_field): row for row in rows}
+        rows_by_user = {row.user_id: row for row in rows} if user_rank else {}
+        to_update = {}
+        to_create = []
+        for stripe_object in page:
+            values = reconciler.build_fields(stripe_object, users_by_customer)
+            user_id = values['user_id']
+            row = local_rows.get(stripe_object.id)
+            if row is None and user_rank and user_id in rows_by_user:
+                row = rows_by_user[user_id]
+                current = {field: getattr(row, field) for field in update_fields}
+                if user_rank(values) <= user_rank(current):
+                    continue
+                local_rows.pop(getattr(row, id_field), None)
+                local_rows[stripe_object.id] = row
+            if row is None:
+                if any(values[field] is None for field in reconciler.create_requires):
+                    stats['unmatched'] += 1
+                    continue
+                row = model(**{id_field: stripe_object.id}, **values)
+                to_create.append(row)
+                local_rows[stripe_object.id] = row
+                if user_rank:
+                    rows_by_user[user_id] = row
+                continue
+            values[id_field] = stripe_object.id
+            changed = False
+            for field in update_fields:
+                if values[field] is not None and getattr(row, field) != values[field]:
+                    setattr(row, field, values[field])
+                    changed = True
+            if changed and row.pk is not None:
+                to_update[row.pk] = row
+        to_update = list(to_update.values())
+
+        if not dry_run:
+            # Read before bulk_create, which stamps auto_now_add columns with now.
+            created_times = {
+                getattr(row, id_field): getattr(row, reconciler.created_field)
+                for row in to_create if getattr(row, reconciler.created_field)
+            } if reconciler.created_field else {}
+            if model in (Invoice, Payment):
+                attribute_plans(to_create)
+            with transaction.atomic():
+                model.objects.bulk_update(to_update, update_fields)
+                model.objects.bulk_create(to_create)
+                if created_times:
+                    _backdate_created(model, id_field, reconciler.created_field, created_times)
+                if model is Subscription:
+                    # Bulk writes send no post_save to maintain the status counts.
+                    record_subscription_changes(to_update + to_create)
+            if model is Subscription:
+                for row in to_update + to_create:
+                    invalidate_entitlements(row.user_id)
+
+        stats['checked'] += len(page)
+        stats['updated'] += len(to_update)
+        stats['created'] += len(to_create)
+
+    logger.info(f"Reconciled {kind} against Stripe{' (dry run)' if dry_run else ''}: {stats}")
+    return stats
+
+
+def reconcile_all(page_size=DEFAULT_PAGE_SIZE, dry_run=False, kinds=None):
+    """
+    Reconcile subscriptions, invoices and payments in turn.
+
+    Bulk writes bypass the model signals that maintain the revenue rollups, so the
+    rollups are rebuilt when any invoice or payment changed.
+
+    :return: Dict mapping each kind to its stats
+    """
+    results = {kind: reconcile(kind, page_size, dry_run) for kind in (kinds or RECONCILERS)}
+    if not dry_run and any(
+        stats['updated'] or stats['created']
+        for kind, stats in results.items() if kind in ('invoices', 'payments')
+    ):
+        rebuild_revenue_rollups()
+    return results
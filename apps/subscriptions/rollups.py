@@ -0,0 +1,235 @@
+from collections import Counter, defaultdict
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, DateField, F, Sum
+from django.db.models.functions import TruncMonth
+from django.utils import timezone
+
+from utils.logging_utils import get_logger
+from .models import Invoice, MonthlyRevenueRollup, Payment, Subscription, SubscriptionStatusCount
+
+logger = get_logger(__name__)
+
+# Per rollup kind: the model, the date field that picks the month, and the
+# counter columns on MonthlyRevenueRollup.
+ROLLUP_SOURCES = {
+    'payment': (Payment, 'created_at', 'payment_count', 'payment_amount'),
+    'invoice': (Invoice, 'due_date', 'invoice_count', 'invoice_amount'),
+}
+
+
+def month_start(value):
+    """
+    Return the first day of the month a date or datetime falls in.
+    """
+    if isinstance(value, timezone.datetime):
+        value = timezone.localtime(value).date() if timezone.is_aware(value) else value.date()
+    return value.replace(day=1)
+
+
+def _state(values, date_field):
+    """
+    Reduce a row to the (month, plan ID, status, amount) that it contributes to the rollups.
+    """
+    if values.get(date_field) is None or values.get('amount') is None:
+        return None
+    return month_start(values[date_field]), values.get('plan_id'), values['status'], Decimal(str(values['amount']))
+
+
+def attribute_plans(instances):
+    """
+    Set the plan of new payments/invoices to their user's current subscription plan.
+
+    Instances that already have a plan are left alone. Costs one query for all
+    of them.
+
+    :param instances: Unsaved Payments or Invoices
+    """
+    user_ids = {instance.user_id for instance in instances if instance.plan_id is None}
+    if not user_ids:
+        return
+    plan_ids = dict(Subscription.objects.filter(user_id__in=user_ids).values_list('user_id', 'plan_id'))
+    for instance in instances:
+        if instance.plan_id is None:
+            instance.plan_id = plan_ids.get(instance.user_id)
+
+
+def _add(month, plan_id, status, count_field, amount_field, count, amount):
+    lookup = {'month': month, 'plan_id': plan_id, 'status': status}
+    increments = {count_field: F(count_field) + count, amount_field: F(amount_field) + amount}
+    if MonthlyRevenueRollup.objects.filter(**lookup).update(**increments):
+        return
+    try:
+        with transaction.atomic():
+            MonthlyRevenueRollup.objects.create(**lookup, **{count_field: count, amount_field: amount})
+    except IntegrityError:
+        # Another writer created the row first.
+        MonthlyRevenueRollup.objects.filter(**lookup).update(**increments)
+
+
+def record_change(kind, instance, deleted=False):
+    """
+    Move a saved or deleted payment/invoice between rollup rows.
+
+    The row's previous contribution is taken from the values it was loaded with,
+    so an unchanged re-save costs nothing and a status change costs two updates.
+    Rows count towards the plan stored on them at creation.
+
+    :param kind: 'payment' or 'invoice'
+    :param instance: The Payment or Invoice that was saved or deleted
+    :param deleted: True when called for a deletion
+    """
+    _, date_field, count_field, amount_field = ROLLUP_SOURCES[kind]
+    loaded_values = getattr(instance, '_loaded_values', None)
+    old = _state(loaded_values, date_field) if loaded_values else None
+    new = None if deleted else _state(instance.__dict__, date_field)
+    if old == new:
+        return
+
+    with transaction.atomic():
+        if old:
+            month, plan_id, status, amount = old
+            _add(month, plan_id, status, count_field, amount_field, -1, -amount)
+        if new:
+            month, plan_id, status, amount = new
+            _add(month, plan_id, status, count_field, amount_field, 1, amount)
+
+    # Later saves of the same instance are measured against what was just recorded.
+    instance._loaded_values = {date_field: getattr(instance, date_field), 'plan_id': instance.plan_id,
+                               'status': instance.status, 'amount': instance.amount}
+
+
+def record_bulk_created(kind, instances):
+    """
+    Add rows inserted with bulk_create (which sends no signals) to the rollups.
+
+    Rows are grouped first, so each affected rollup row is updated once.
+
+    :param kind: 'payment' or 'invoice'
+    :param instances: The created Payments or Invoices
+    """
+    _, date_field, count_field, amount_field = ROLLUP_SOURCES[kind]
+    groups = defaultdict(lambda: [0, Decimal('0')])
+    for instance in instances:
+        state = _state(instance.__dict__, date_field)
+        if state is None:
+            continue
+        month, plan_id, status, amount = state
+        totals = groups[(month, plan_id, status)]
+        totals[0] += 1
+        totals[1] += amount
+
+    with transaction.atomic():
+        for (month, plan_id, status), (count, amount) in groups.items():
+            _add(month, plan_id, status, count_field, amount_field, count, amount)
+
+
+def _add_status_count(status, delta):
+    if SubscriptionStatusCount.objects.filter(status=status).update(count=F('count') + delta):
+        return
+    try:
+        with transaction.atomic():
+            SubscriptionStatusCount.objects.create(status=status, count=delta)
+    except IntegrityError:
+        # Another writer created the row first.
+        SubscriptionStatusCount.objects.filter(status=status).update(count=F('count') + delta)
+
+
+def record_subscription_changes(subscriptions, deleted=False):
+    """
+    Move saved, bulk-written or deleted subscriptions between status counters.
+
+    Like record_change(), the previous status is taken from the values each
+    subscription was loaded with, and counters are updated once per status.
+
+    :param subscriptions: Subscriptions after they were written or deleted
+    :param deleted: True when called for deletions
+    """
+    deltas = Counter()
+    for subscription in subscriptions:
+        loaded_values = getattr(subscription, '_loaded_values', None) or {}
+        old = loaded_values.get('status')
+        new = None if deleted else subscription.status
+        if old == new:
+            continue
+        if old is not None:
+            deltas[old] -= 1
+        if new is not None:
+            deltas[new] += 1
+        subscription._loaded_values = {**loaded_values, 'status': new}
+
+    with transaction.atomic():
+        for status, delta in deltas.items():
+            if delta:
+                _add_status_count(status, delta)
+
+
+def rebuild_revenue_rollups():
+    """
+    Recompute every MonthlyRevenueRollup row from the payment and invoice tables,
+    and the SubscriptionStatusCount rows from the subscription table.
+
+    Runs one grouped aggregate per source table and replaces the rollup table in a
+    single transaction. Use it after bulk writes that bypass model signals.
+
+    :return: Number of rollup rows written
+    """
+    totals = defaultdict(dict)
+    for model, date_field, count_field, amount_field in ROLLUP_SOURCES.values():
+        grouped = (
+            model.objects
+            .annotate(month=TruncMonth(date_field, output_field=DateField()))
+            .values('month', 'plan', 'status')
+            .annotate(count=Count('id'), amount=Sum('amount'))
+            .order_by()
+        )
+        for row in grouped:
+            key = (row['month'], row['plan'], row['status'])
+            totals[key][count_field] = row['count']
+            totals[key][amount_field] = row['amount']
+
+    rollups = [
+        MonthlyRevenueRollup(month=month, plan_id=plan_id, status=status, **counters)
+        for (month, plan_id, status), counters in totals.items()
+    ]
+    status_counts = [
+        SubscriptionStatusCount(status=row['status'], count=row['count'])
+        for row in Subscription.objects.values('status').annotate(count=Count('id')).order_by()
+    ]
+    with transaction.atomic():
+        MonthlyRevenueRollup.objects.all().delete()
+        MonthlyRevenueRollup.objects.bulk_create(rollups)
+        SubscriptionStatusCount.objects.all().delete()
+        SubscriptionStatusCount.objects.bulk_create(status_counts)
+
+    logger.info(f"Rebuilt {len(rollups)} monthly revenue rollup rows")
+    return len(rollups)
+
+
+def get_monthly_report(month):
+    """
+    Build the monthly financial report from the rollup and status count tables.
+
+    :param month: Any date or datetime within the month to report on
+    :return: Dict with the month's revenue and invoice totals, broken down by plan and status
+    """
+    month = month_start(month)
+    rows = list(MonthlyRevenueRollup.objects.filter(month=month).exclude(payment_count=0, invoice_count=0).values(
+        'plan_id', 'status', 'payment_count', 'payment_amount', 'invoice_count', 'invoice_amount'
+    ))
+    pending_invoices = MonthlyRevenueRollup.objects.filter(status='open').aggregate(
+        total=Sum('invoice_count')
+    )['total'] or 0
+    active_subscriptions = SubscriptionStatusCount.objects.filter(status='active').values_list(
+        'count', flat=True
+    ).first() or 0
+    return {
+        'month': month.isoformat(),
+        'active_subscriptions': active_subscriptions,
+        'total_revenue': sum((row['payment_amount'] for row in rows), Decimal('0')),
+        'payment_count': sum(row['payment_count'] for row in rows),
+        'invoiced_amount': sum((row['invoice_amount'] for row in rows), Decimal('0')),
+        'pending_invoices': pending_invoices,
+        'breakdown': rows,
+    }
@@ -1,20 +1,67 @@
 import stripe
+from asgiref.sync import sync_to_async
 from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.utils import timezone
+from apps.notifications.models import OutboxEmail
+from apps.notifications.outbox import queue_emails
+from .dedup import claim_event_id
+from .entitlements import invalidate_entitlements
+from .invoice_pdf import render_invoice_pdfs
 from .models import Subscription, UserAddOn, Invoice, Payment
+from .rollups import record_subscription_changes
+from .stripe_client import configure_stripe, get_async_client
 from utils.logging_utils import get_logger, log_exception, timed_function, sanitize_log_data
 
 logger = get_logger(__name__)
 
-stripe.api_key = settings.STRIPE_SECRET_KEY
+configure_stripe()
+
+User = get_user_model()
+
 
 class StripeService:
+    @staticmethod
+    @log_exception(logger)
+    def get_or_create_customer(user):
+        """
+        Return the Stripe customer ID stored on the user, creating the customer once if needed.
+
+        The customer is created with an idempotency key derived from the user ID,
+        so concurrent callers (even in different processes) get the same Stripe
+        customer back. The user row is only locked afterwards, to store the ID,
+        so no lock is held across the Stripe call; a caller that loses the race
+        returns the ID the winner stored.
+
+        :param user: The User to get the Stripe customer for
+        :return: The Stripe customer ID
+        """
+        if user.stripe_customer_id:
+            return user.stripe_customer_id
+
+        stripe_customer = stripe.Customer.create(
+            email=user.email,
+            metadata={'user_id': user.pk},
+            idempotency_key=f'customer-create-{user.pk}',
+        )
+        with transaction.atomic():
+            locked_user = User.objects.select_for_update().only('id', 'stripe_customer_id').get(pk=user.pk)
+            if not locked_user.stripe_customer_id:
+                locked_user.stripe_customer_id = stripe_customer.id
+                locked_user.save(update_fields=['stripe_customer_id'])
+                logger.info(f"Stripe customer created for user {user.id}")
+
+        user.stripe_customer_id = locked_user.stripe_customer_id
+        return user.stripe_customer_id
+
     @staticmethod
     @log_exception(logger)
     @timed_function(logger)
     def create_checkout_session(user, plan):
         try:
             session = stripe.checkout.Session.create(
-                customer_email=user.email,
+                customer=StripeService.get_or_create_customer(user),
                 payment_method_types=['card', 'apple_pay', 'google_pay'],
                 line_items=[{
                     'price': plan.stripe_price_id,
@@ -35,9 +82,8 @@ class StripeService:
     @timed_function(logger)
     def create_subscription(user, plan):
         try:
-            stripe_customer = stripe.Customer.create(email=user.email)
             stripe_subscription = stripe.Subscription.create(
-                customer=stripe_customer.id,
+                customer=StripeService.get_or_create_customer(user),
                 items=[{'price': plan.stripe_price_id}],
             )
             subscription = Subscription.objects.create(
@@ -45,7 +91,9 @@ class StripeService:
                 plan=plan,
                 stripe_subscription_id=stripe_subscription.id,
                 status=stripe_subscription.status,
-                current_period_end=timezone.datetime.fromtimestamp(stripe_subscription.current_period_end),
+                current_period_end=timezone.datetime.fromtimestamp(
+                    stripe_subscription.current_period_end, tz=timezone.utc
+                ),
             )
             logger.info(f"Subscription created for user {user.id}")
             return subscription
@@ -63,7 +111,7 @@ class StripeService:
                 subscription=subscription.stripe_subscription_id,
                 price=add_on.stripe_price_id,
             )
-            UserAddOn.objects.create(
+            user_addon = UserAddOn.objects.create(
                 user=user,
                 add_on=add_on,
                 stripe_subscription_item_id=stripe_subscription_item.id,
@@ -78,33 +126,77 @@ class StripeService:
     @log_exception(logger)
     @timed_function(logger)
     def generate_invoice_pdf(invoice_id):
-        invoice = Invoice.objects.get(id=invoice_id)
-        # Implement custom PDF generation logic here
-        pdf_url = "https://example.com/invoices/123.pdf"  # Replace with actual URL
-        invoice.pdf_url = pdf_url
-        invoice.save()
-
-        # Send email with PDF link
-        send_mail(
-            'Your invoice is ready',
-            f'You can download your invoice here: {pdf_url}',
-            'from@example.com',
-            [invoice.user.email],
-            fail_silently=False,
-        )
+        """
+        Render the PDF for an invoice and queue an email to the customer with a link to it.
+
+        Nothing is rendered or sent if the stored PDF is already up to date.
+
+        :param invoice_id: ID of the Invoice
+        :return: The PDF URL
+        """
+        invoice = Invoice.objects.select_related('user').get(id=invoice_id)
+        with transaction.atomic():
+            StripeService.notify_invoices_ready(render_invoice_pdfs([invoice]))
+        return invoice.pdf_url
+
     @staticmethod
-    def process_webhook(payload, sig_header):
+    @log_exception(logger)
+    @timed_function(logger)
+    def generate_invoice_pdfs(invoice_ids):
+        """
+        Render PDFs for a batch of invoices and queue an email to each customer whose PDF changed.
+
+        The invoices and their users are loaded in one query.
+
+        :param invoice_ids: IDs of the Invoices
+        :return: Number of PDFs rendered
+        """
+        invoices = list(Invoice.objects.select_related('user').filter(id__in=invoice_ids))
+        with transaction.atomic():
+            rendered = render_invoice_pdfs(invoices)
+            StripeService.notify_invoices_ready(rendered)
+        return len(rendered)
+
+    @staticmethod
+    def notify_invoices_ready(invoices):
+        """
+        Queue an email to each invoice's user with a link to its PDF.
+        """
+        queue_emails([
+            OutboxEmail(
+                subject='Your invoice is ready',
+                to=[invoice.user.email],
+                body=f'You can download your invoice here: {invoice.pdf_url}',
+            )
+            for invoice in invoices
+        ])
+
+    @staticmethod
+    def construct_webhook_event(payload, sig_header):
+        """
+        Verify the signature of a Stripe webhook and parse it into an Event.
+
+        :param payload: Raw request body
+        :param sig_header: Value of the Stripe-Signature header
+        :return: The Stripe Event, or None if the payload or signature is invalid
+        """
         try:
-            event = stripe.Webhook.construct_event(
+            return stripe.Webhook.construct_event(
                 payload, sig_header, settings.STRIPE_WEBHOOK_SECRET
             )
         except ValueError as e:
             logger.error(f"Invalid payload in Stripe webhook: {str(e)}")
-            return False
         except stripe.error.SignatureVerificationError as e:
             logger.error(f"Invalid signature in Stripe webhook: {str(e)}")
-            return False
+        return None
+
+    @staticmethod
+    def handle_webhook_event(event):
+        """
+        Apply a verified Stripe Event to the local database.
 
+        :param event: The Stripe Event
+        """
         logger.info(f"Processing Stripe webhook event: {event.type}")
 
         if event.type == 'invoice.paid':
@@ -114,7 +206,145 @@ class StripeService:
             # Handle failed payment
             pass
         elif event.type == 'customer.subscription.updated':
-            # Handle subscription updates
-            pass
+            StripeService.apply_subscription_updates([event])
+
+    @staticmethod
+    def process_webhook(payload, sig_header):
+        """
+        Verify a Stripe webhook and apply it inline, ignoring redelivered events.
+
+        :param payload: Raw request body
+        :param sig_header: Value of the Stripe-Signature header
+        :return: True if the event was accepted, False if verification failed
+        """
+        event = StripeService.construct_webhook_event(payload, sig_header)
+        if event is None:
+            return False
+
+        with transaction.atomic():
+            if not claim_event_id(event.id):
+                logger.info(f"Ignoring duplicate Stripe webhook event {event.id}")
+                return True
+            StripeService.handle_webhook_event(event)
+        return True
+
+    @staticmethod
+    def apply_subscription_updates(events):
+        """
+        Apply a batch of customer.subscription.updated events with a single bulk write.
+
+        Events are grouped by Stripe subscription ID and only the newest state (by
+        event ``created``) is written, so bursts of updates to one subscription do
+        not turn into one UPDATE each.
+
+        :param events: Iterable of Stripe Events carrying subscription objects
+        :return: Number of local Subscription rows updated
+        """
+        latest = {}
+        for event in events:
+            stripe_subscription = event.data.object
+            current = latest.get(stripe_subscription.id)
+            if current is None or event.created >= current[0]:
+                latest[stripe_subscription.id] = (event.created, stripe_subscription)
+
+        subscriptions = list(Subscription.objects.filter(stripe_subscription_id__in=latest.keys()))
+        for subscription in subscriptions:
+            _, stripe_subscription = latest[subscription.stripe_subscription_id]
+            subscription.status = stripe_subscription.status
+            subscription.current_period_end = timezone.datetime.fromtimestamp(
+                stripe_subscription.current_period_end, tz=timezone.utc
+            )
+        Subscription.objects.bulk_update(subscriptions, ['status', 'current_period_end'])
+
+        # bulk_update() bypasses post_save, so drop the cached snapshots and
+        # update the status counts explicitly.
+        for subscription in subscriptions:
+            invalidate_entitlements(subscription.user_id)
+        record_subscription_changes(subscriptions)
+
+        logger.info(f"Applied {len(latest)} coalesced subscription updates to {len(subscriptions)} rows")
+        return len(subscriptions)
+
 
-        return True
\ No newline at end of file
+class AsyncStripeService:
+    """
+    Non-blocking counterparts of the StripeService checkout flows, for ASGI deployments.
+
+    Stripe calls go through the shared AsyncStripeClient, so a worker process can
+    keep many checkouts in flight at once. ORM access is delegated to
+    sync_to_async, since the ORM has no async API.
+    """
+
+    @staticmethod
+    async def get_or_create_customer(user):
+        if user.stripe_customer_id:
+            return user.stripe_customer_id
+        # Happens at most once per user; reuse the synchronous implementation.
+        return await sync_to_async(StripeService.get_or_create_customer)(user)
+
+    @staticmethod
+    @log_exception(logger)
+    @timed_function(logger)
+    async def create_checkout_session(user, plan):
+        try:
+            session = await get_async_client().request('post', '/v1/checkout/sessions', {
+                'customer': await AsyncStripeService.get_or_create_customer(user),
+                'payment_method_types': ['card', 'apple_pay', 'google_pay'],
+                'line_items': [{
+                    'price': plan.stripe_price_id,
+                    'quantity': 1,
+                }],
+                'mode': 'subscription',
+                'success_url': settings.STRIPE_SUCCESS_URL,
+                'cancel_url': settings.STRIPE_CANCEL_URL,
+            })
+            logger.info(f"Checkout session created for user {user.id}")
+            return session.id
+        except stripe.error.StripeError as e:
+            logger.error(f"Stripe API error in create_checkout_session: {str(e)}")
+            raise
+
+    @staticmethod
+    @log_exception(logger)
+    @timed_function(logger)
+    async def create_subscription(user, plan):
+        try:
+            stripe_subscription = await get_async_client().request('post', '/v1/subscriptions', {
+                'customer': await AsyncStripeService.get_or_create_customer(user),
+                'items': [{'price': plan.stripe_price_id}],
+            })
+            subscription = await sync_to_async(Subscription.objects.create)(
+                user=user,
+                plan=plan,
+                stripe_subscription_id=stripe_subscription.id,
+                status=stripe_subscription.status,
+                current_period_end=timezone.datetime.fromtimestamp(
+                    stripe_subscription.current_period_end, tz=timezone.utc
+                ),
+            )
+            logger.info(f"Subscription created for user {user.id}")
+            return subscription
+        except stripe.error.StripeError as e:
+            logger.error(f"Stripe API error in create_subscription: {str(e)}")
+            raise
+
+    @staticmethod
+    @log_exception(logger)
+    @timed_function(logger)
+    async def add_addon(user, add_on):
+        try:
+            subscription = await sync_to_async(Subscription.objects.get)(user=user)
+            stripe_subscription_item = await get_async_client().request('post', '/v1/subscription_items', {
+                'subscription': subscription.stripe_subscription_id,
+                'price': add_on.stripe_price_id,
+            })
+            user_addon = await sync_to_async(UserAddOn.objects.create)(
+                user=user,
+                add_on=add_on,
+                stripe_subscription_item_id=stripe_subscription_item.id,
+            )
+            logger.info(f"Add-on {add_on.id} added for user {user.id}")
+            return user_addon
+        except stripe.error.StripeError as e:
+            logger.error(f"Stripe API error in add_addon: {str(e)}")
+            raise
@@ -0,0 +1,60 @@
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from .catalog import bump_catalog_version
+from .entitlements import invalidate_entitlements
+from .models import AddOn, Invoice, Payment, Subscription, SubscriptionPlan, UserAddOn
+from .rollups import attribute_plans, record_change, record_subscription_changes
+
+
+@receiver(post_save, sender=Subscription)
+@receiver(post_delete, sender=Subscription)
+@receiver(post_save, sender=UserAddOn)
+@receiver(post_delete, sender=UserAddOn)
+def invalidate_user_entitlements(sender, instance, **kwargs):
+    invalidate_entitlements(instance.user_id)
+
+
+@receiver(post_save, sender=Subscription)
+def update_subscription_counts(sender, instance, **kwargs):
+    record_subscription_changes([instance])
+
+
+@receiver(post_delete, sender=Subscription)
+def remove_subscription_from_counts(sender, instance, **kwargs):
+    record_subscription_changes([instance], deleted=True)
+
+
+@receiver(post_save, sender=SubscriptionPlan)
+@receiver(post_delete, sender=SubscriptionPlan)
+@receiver(post_save, sender=AddOn)
+@receiver(post_delete, sender=AddOn)
+def invalidate_catalog(sender, instance, **kwargs):
+    bump_catalog_version()
+
+
+@receiver(pre_save, sender=Payment)
+@receiver(pre_save, sender=Invoice)
+def attribute_new_row_to_plan(sender, instance, **kwargs):
+    if instance._state.adding:
+        attribute_plans([instance])
+
+
+@receiver(post_save, sender=Payment)
+def update_payment_rollups(sender, instance, **kwargs):
+    record_change('payment', instance)
+
+
+@receiver(post_delete, sender=Payment)
+def remove_payment_from_rollups(sender, instance, **kwargs):
+    record_change('payment', instance, deleted=True)
+
+
+@receiver(post_save, sender=Invoice)
+def update_invoice_rollups(sender, instance, **kwargs):
+    record_change('invoice', instance)
+
+
+@receiver(post_delete, sender=Invoice)
+def remove_invoice_from_rollups(sender, instance, **kwargs):
+    record_change('invoice', instance, deleted=True)
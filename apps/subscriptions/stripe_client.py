@@ -0,0 +1,225 @@
+import asyncio
+import os
+import threading
+import uuid
+import weakref
+from urllib.parse import urlencode
+
+import httpx
+import requests
+import stripe
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from stripe.api_requestor import APIRequestor, _api_encode
+from stripe.http_client import RequestsClient
+
+from utils.logging_utils import get_logger
+
+logger = get_logger(__name__)
+
+
+class PooledRequestsClient(RequestsClient):
+    """
+    Stripe HTTP client backed by one keep-alive connection pool per process.
+
+    The stock client opens a new requests.Session per thread with library
+    defaults. This client shares a single session across all threads of the
+    process, so gthread workers and Celery threads reuse warm TLS connections.
+    The pool is capped at ``pool_maxsize`` connections, and every call uses
+    explicit connect/read timeouts. After a fork the session is rebuilt, so
+    prefork children never share sockets with their parent.
+    """
+
+    def __init__(self, pool_maxsize, connect_timeout, read_timeout, stats_log_interval=0, **kwargs):
+        self.pool_maxsize = pool_maxsize
+        self.stats_log_interval = stats_log_interval
+        self._stats_lock = threading.Lock()
+        self.request_count = 0
+        super().__init__(timeout=(connect_timeout, read_timeout), session=self._build_session(), **kwargs)
+
+    def _build_session(self):
+        session = requests.Session()
+        self._adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_maxsize)
+        session.mount('https://', self._adapter)
+        return session
+
+    def reset(self):
+        """
+        Drop every pooled connection and start over with a fresh session.
+        """
+        self._session = self._build_session()
+        self._thread_local = threading.local()
+        with self._stats_lock:
+            self.request_count = 0
+
+    def request(self, method, url, headers, post_data=None):
+        result = super().request(method, url, headers, post_data=post_data)
+        with self._stats_lock:
+            self.request_count += 1
+            should_log = self.stats_log_interval and self.request_count % self.stats_log_interval == 0
+        if should_log:
+            logger.info(f"Stripe HTTP pool stats: {self.pool_stats()}")
+        return result
+
+    def pool_stats(self):
+        """
+        Report connection reuse for this process.
+
+        :return: Dict with requests sent, connections opened, idle pooled
+                 connections and the resulting reuse rate
+        """
+        connections_opened = 0
+        pooled_requests = 0
+        idle_connections = 0
+        for key in self._adapter.poolmanager.pools.keys():
+            pool = self._adapter.poolmanager.pools[key]
+            connections_opened += pool.num_connections
+            pooled_requests += pool.num_requests
+            if pool.pool is not None:
+                # The queue is pre-filled with None placeholders for never-opened slots.
+                idle_connections += sum(1 for conn in list(pool.pool.queue) if conn is not None)
+        reuse_rate = 1 - connections_opened / pooled_requests if pooled_requests else 0.0
+        return {
+            'requests': self.request_count,
+            'connections_opened': connections_opened,
+            'idle_connections': idle_connections,
+            'pool_maxsize': self.pool_maxsize,
+            'reuse_rate': round(reuse_rate, 4),
+        }
+
+
+class AsyncStripeClient:
+    """
+    Minimal non-blocking Stripe API client built on httpx.AsyncClient.
+
+    The Stripe SDK used here is synchronous, so ASGI views go through this client
+    instead. Requests are encoded exactly like the SDK does, and responses and
+    errors come back as the same StripeObject and stripe.error types, so callers
+    handle both paths the same way.
+
+    An httpx.AsyncClient can only be used on the event loop it was created on,
+    so one client (and its connection pool) is kept per loop, and dropped with
+    its loop. Call aclose() on a loop that is shutting down (e.g. from an ASGI
+    lifespan handler) to close its connections cleanly.
+    """
+
+    def __init__(self, pool_maxsize, connect_timeout, read_timeout, max_retries=0):
+        self.limits = httpx.Limits(max_connections=pool_maxsize, max_keepalive_connections=pool_maxsize)
+        self.timeout = httpx.Timeout(read_timeout, connect=connect_timeout)
+        self.max_retries = max_retries
+        self._clients = weakref.WeakKeyDictionary()
+
+    def _get_client(self):
+        loop = asyncio.get_running_loop()
+        client = self._clients.get(loop)
+        if client is None or client.is_closed:
+            client = httpx.AsyncClient(base_url=stripe.api_base, limits=self.limits, timeout=self.timeout)
+            self._clients[loop] = client
+        return client
+
+    async def aclose(self):
+        """
+        Close the running loop's client and its connections.
+        """
+        client = self._clients.pop(asyncio.get_running_loop(), None)
+        if client is not None:
+            await client.aclose()
+
+    async def request(self, method, path, params=None, idempotency_key=None):
+        """
+        Send a request to the Stripe API.
+
+        :param method: 'get' or 'post'
+        :param path: API path, e.g. '/v1/customers'
+        :param params: Request parameters, encoded like the Stripe SDK does
+        :param idempotency_key: Optional idempotency key for POST requests
+        :return: The response as a StripeObject
+        :raises stripe.error.StripeError: On API or connection errors
+        """
+        headers = {'Authorization': f'Bearer {stripe.api_key}'}
+        if stripe.api_version:
+            headers['Stripe-Version'] = stripe.api_version
+        encoded = urlencode(list(_api_encode(params or {})))
+        if method == 'post':
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+            # Always send a key so that retried POSTs are safe.
+            headers['Idempotency-Key'] = idempotency_key or str(uuid.uuid4())
+            request_kwargs = {'content': encoded}
+        else:
+            path = f'{path}?{encoded}' if encoded else path
+            request_kwargs = {}
+
+        client = self._get_client()
+        for attempt in range(self.max_retries + 1):
+            try:
+                response = await client.request(method.upper(), path, headers=headers, **request_kwargs)
+                break
+            except httpx.TransportError as e:
+                if attempt == self.max_retries:
+                    raise stripe.error.APIConnectionError(f"Error communicating with Stripe: {str(e)}")
+
+        try:
+            body = response.json()
+        except ValueError:
+            body = None
+        if not 200 <= response.status_code < 300:
+            APIRequestor().handle_error_response(response.text, response.status_code, body, response.headers)
+        return stripe.util.convert_to_stripe_object(body, stripe.api_key)
+
+
+_client = None
+_async_client = None
+
+
+def get_http_client():
+    """
+    Return the process-wide Stripe HTTP client, creating it on first use.
+    """
+    global _client
+    if _client is None:
+        _client = PooledRequestsClient(
+            pool_maxsize=settings.STRIPE_HTTP_POOL_MAXSIZE,
+            connect_timeout=settings.STRIPE_CONNECT_TIMEOUT,
+            read_timeout=settings.STRIPE_READ_TIMEOUT,
+            stats_log_interval=settings.STRIPE_HTTP_STATS_LOG_INTERVAL,
+        )
+    return _client
+
+
+def get_async_client():
+    """
+    Return the process-wide AsyncStripeClient, creating it on first use.
+    """
+    global _async_client
+    if _async_client is None:
+        _async_client = AsyncStripeClient(
+            pool_maxsize=settings.STRIPE_HTTP_POOL_MAXSIZE,
+            connect_timeout=settings.STRIPE_CONNECT_TIMEOUT,
+            read_timeout=settings.STRIPE_READ_TIMEOUT,
+            max_retries=settings.STRIPE_MAX_NETWORK_RETRIES,
+        )
+    return _async_client
+
+
+def get_pool_stats():
+    return get_http_client().pool_stats()
+
+
+def configure_stripe():
+    """
+    Point the Stripe SDK at the configured API key and the pooled HTTP client.
+    """
+    stripe.api_key = settings.STRIPE_SECRET_KEY
+    stripe.max_network_retries = settings.STRIPE_MAX_NETWORK_RETRIES
+    stripe.default_http_client = get_http_client()
+
+
+def _reset_after_fork():
+    global _async_client
+    if _client is not None:
+        _client.reset()
+    _async_client = None
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
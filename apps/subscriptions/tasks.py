@@ -1,6 +1,12 @@
 from celery import shared_task
-from django.core.mail import send_mail
-from .models import Invoice
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.utils import timezone
+from .dedup import purge_processed_event_ids
+from .invoice_runs import run_invoices
+from .reconciliation import DEFAULT_PAGE_SIZE, reconcile_all
+from .services import StripeService
+from .webhooks import process_webhook_event_batch, purge_processed_webhook_events
 from utils.logging_utils import get_logger, log_exception, timed_function
 
 logger = get_logger(__name__)
@@ -10,24 +16,67 @@ logger = get_logger(__name__)
 @log_exception(logger)
 @timed_function(logger)
 def generate_invoice_pdf(invoice_id):
-    invoice = Invoice.objects.get(id=invoice_id)
-    # Implement custom PDF generation logic here
-    pdf_url = "https://example.com/invoices/123.pdf"  # Replace with actual URL
-    invoice.pdf_url = pdf_url
-    invoice.save()
+    pdf_url = StripeService.generate_invoice_pdf(invoice_id)
+    logger.info(f"Invoice PDF for invoice {invoice_id} is at {pdf_url}")
+    return pdf_url
 
-    logger.info(f"Generated PDF invoice for invoice {invoice_id}")
+# Call this task as:
+# generate_invoice_pdf.delay(invoice.id)
 
-    # Send email with PDF link
-    send_mail(
-        'Your invoice is ready',
-        f'You can download your invoice here: {pdf_url}',
-        'from@example.com',
-        [invoice.user.email],
-        fail_silently=False,
-    )
 
-    logger.info(f"Sent invoice email for invoice {invoice_id}")
+@shared_task
+@log_exception(logger)
+def generate_invoice_pdfs(invoice_ids):
+    return StripeService.generate_invoice_pdfs(invoice_ids)
 
-# Call this task as:
-# generate_invoice_pdf.delay(invoice.id)
\ No newline at end of file
+
+@shared_task
+@log_exception(logger)
+@timed_function(logger)
+def run_invoice_generation(period=None, chunk_size=None):
+    """
+    :param period: ISO date within the billing month, defaults to the current month
+    """
+    period = timezone.datetime.fromisoformat(period).date() if period else timezone.now()
+    run = run_invoices(period, chunk_size)
+    return {'period': run.period.isoformat(), 'status': run.status, 'invoices_created': run.invoices_created}
+
+
+@shared_task
+@log_exception(logger)
+@timed_function(logger)
+def process_webhook_events(batch_size=None):
+    batch_size = batch_size or settings.STRIPE_WEBHOOK_BATCH_SIZE
+    claimed, failed = process_webhook_event_batch(batch_size)
+
+    # Keep draining while there is a backlog, and come back later for failed events.
+    if claimed == batch_size:
+        process_webhook_events.delay(batch_size)
+    elif failed:
+        process_webhook_events.apply_async(args=[batch_size], countdown=settings.STRIPE_WEBHOOK_RETRY_DELAY)
+
+
+@shared_task
+@log_exception(logger)
+def purge_stripe_event_ids():
+    return purge_processed_event_ids()
+
+
+@shared_task
+@log_exception(logger)
+def purge_webhook_events():
+    return purge_processed_webhook_events()
+
+
+@shared_task
+@log_exception(logger)
+def ensure_stripe_customer(user_id):
+    user = get_user_model().objects.get(id=user_id)
+    return StripeService.get_or_create_customer(user)
+
+
+@shared_task
+@log_exception(logger)
+@timed_function(logger)
+def reconcile_stripe_data(page_size=None, dry_run=False, kinds=None):
+    return reconcile_all(page_size or DEFAULT_PAGE_SIZE, dry_run, kinds)
@@ -1,8 +1,34 @@
-from django.test import TestCase
+import asyncio
+import hashlib
+import hmac
+import json
+import shutil
+import tempfile
+import time
+from decimal import Decimal
+
+import stripe
+from django.conf import settings
+from django.test import RequestFactory, TestCase, override_settings
+from django.urls import reverse
 from django.contrib.auth import get_user_model
-from .models import SubscriptionPlan, Subscription
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from apps.notifications.models import OutboxEmail
+from . import catalog, entitlements, invoice_pdf, stripe_client
+from .dedup import claim_event_id
+from .middleware import SubscriptionMiddleware
+from .reconciliation import reconcile
+from .rollups import get_monthly_report, rebuild_revenue_rollups
+from .invoice_runs import run_invoices
+from .models import (AddOn, Invoice, InvoiceRun, MonthlyRevenueRollup, Payment, SubscriptionPlan, Subscription,
+                     SubscriptionStatusCount, WebhookEvent)
 from .services import StripeService
-from unittest.mock import patch
+from .webhooks import claim_webhook_events, process_webhook_event_batch, purge_processed_webhook_events
+from unittest.mock import AsyncMock, patch
 
 User = get_user_model()
 
@@ -13,8 +39,10 @@ class SubscriptionTestCase(TestCase):
         self.plan = SubscriptionPlan.objects.create(name='Basic', stripe_price_id='price_123', user_limit=10,
                                                     price=9.99)
 
+    @patch('stripe.Customer.create')
     @patch('stripe.Subscription.create')
-    def test_create_subscription(self, mock_stripe_sub_create):
+    def test_create_subscription(self, mock_stripe_sub_create, mock_customer_create):
+        mock_customer_create.return_value = type('obj', (object,), {'id': 'cus_123'})
         mock_stripe_sub_create.return_value = type('obj', (object,), {
             'id': 'sub_123',
             'status': 'active',
@@ -26,4 +54,753 @@ class SubscriptionTestCase(TestCase):
 
         self.assertEqual(subscription.stripe_subscription_id, 'sub_123')
         self.assertEqual(subscription.status, 'active')
-        self.assertEqual(subscription.plan, self.plan)
\ No newline at end of file
+        self.assertEqual(subscription.plan, self.plan)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.stripe_customer_id, 'cus_123')
+
+    @override_settings(STRIPE_SUCCESS_URL='https://example.com/success', STRIPE_CANCEL_URL='https://example.com/cancel')
+    @patch('stripe.Customer.create')
+    @patch('stripe.checkout.Session.create')
+    def test_checkout_reuses_stored_customer(self, mock_session_create, mock_customer_create):
+        mock_session_create.return_value = type('obj', (object,), {'id': 'cs_123'})
+        self.user.stripe_customer_id = 'cus_existing'
+        self.user.save()
+
+        StripeService.create_checkout_session(self.user, self.plan)
+
+        mock_customer_create.assert_not_called()
+        self.assertEqual(mock_session_create.call_args.kwargs['customer'], 'cus_existing')
+
+    @patch('stripe.Customer.create')
+    def test_customer_created_by_a_concurrent_caller_wins(self, mock_customer_create):
+        def create(**kwargs):
+            # Another request stores its customer while this one waits on Stripe.
+            User.objects.filter(pk=self.user.pk).update(stripe_customer_id='cus_first')
+            return type('obj', (object,), {'id': 'cus_second'})
+        mock_customer_create.side_effect = create
+
+        self.assertEqual(StripeService.get_or_create_customer(self.user), 'cus_first')
+        self.assertEqual(mock_customer_create.call_args.kwargs['idempotency_key'], f'customer-create-{self.user.pk}')
+
+
+class EntitlementsCacheTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        entitlements._local_cache.clear()
+        self.user = User.objects.create_user(username='cacheuser', email='cache@example.com', password='testpass123')
+        self.plan = SubscriptionPlan.objects.create(name='Basic', stripe_price_id='price_123', user_limit=10,
+                                                    price=9.99)
+        self.subscription = Subscription.objects.create(
+            user=self.user,
+            plan=self.plan,
+            stripe_subscription_id='sub_123',
+            status='active',
+            current_period_end=timezone.now() + timezone.timedelta(days=30),
+        )
+
+    def test_warm_cache_does_no_queries(self):
+        entitlements.get_entitlements(self.user.pk)
+        with self.assertNumQueries(0):
+            snapshot = entitlements.get_entitlements(self.user.pk)
+        self.assertEqual(snapshot.plan_id, self.plan.id)
+        self.assertFalse(snapshot.expired)
+
+    def test_save_invalidates_snapshot(self):
+        entitlements.get_entitlements(self.user.pk)
+        self.subscription.status = 'canceled'
+        self.subscription.current_period_end = timezone.now()
+        self.subscription.save()
+        self.assertTrue(entitlements.get_entitlements(self.user.pk).expired)
+
+    def test_missing_subscription_is_expired(self):
+        self.subscription.delete()
+        self.assertTrue(entitlements.get_entitlements(self.user.pk).expired)
+
+
+class SubscriptionMiddlewareTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        entitlements._local_cache.clear()
+        self.factory = RequestFactory()
+        self.middleware = SubscriptionMiddleware(lambda request: request)
+        self.user = User.objects.create_user(username='lazyuser', email='lazy@example.com', password='testpass123')
+
+    def test_exempt_path_is_untouched(self):
+        request = self.factory.get('/api/login/')
+        request.user = self.user
+        with self.assertNumQueries(0):
+            self.middleware(request)
+        self.assertFalse(hasattr(request, 'entitlements'))
+        self.assertFalse(hasattr(request, 'subscription'))
+
+    def test_attributes_resolve_lazily(self):
+        request = self.factory.get('/api/subscribe/price_123/')
+        request.user = self.user
+        with self.assertNumQueries(0):
+            self.middleware(request)
+        self.assertTrue(request.entitlements.expired)
+
+    def test_subscription_is_none_without_one(self):
+        request = self.factory.get('/api/subscribe/price_123/')
+        request.user = self.user
+        self.middleware(request)
+        with self.assertNumQueries(1):
+            self.assertIsNone(request.subscription)
+            self.assertIsNone(request.subscription)
+
+        request = self.factory.get('/api/subscribe/price_123/')
+        request.user = AnonymousUser()
+        self.middleware(request)
+        with self.assertNumQueries(0):
+            self.assertIsNone(request.subscription)
+
+    def test_subscription_is_loaded_once(self):
+        plan = SubscriptionPlan.objects.create(name='Basic', stripe_price_id='price_123', user_limit=10, price=9.99)
+        subscription = Subscription.objects.create(user=self.user, plan=plan, stripe_subscription_id='sub_123',
+                                                   status='active', current_period_end=timezone.now())
+        request = self.factory.get('/api/subscribe/price_123/')
+        request.user = self.user
+        self.middleware(request)
+        with self.assertNumQueries(1):
+            self.assertEqual(request.subscription, subscription)
+            self.assertEqual(request.subscription.plan, plan)
+
+
+class WebhookQueueTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='hookuser', email='hook@example.com', password='testpass123')
+        self.plan = SubscriptionPlan.objects.create(name='Basic', stripe_price_id='price_123', user_limit=10,
+                                                    price=9.99)
+        self.subscription = Subscription.objects.create(
+            user=self.user,
+            plan=self.plan,
+            stripe_subscription_id='sub_123',
+            status='active',
+            current_period_end=timezone.now(),
+        )
+
+    def _queue_event(self, event_id, created, status, customer='cus_123'):
+        return WebhookEvent.objects.create(
+            stripe_event_id=event_id,
+            event_type='customer.subscription.updated',
+            stripe_customer_id=customer,
+            stripe_created=timezone.datetime.fromtimestamp(created, tz=timezone.utc),
+            payload={
+                'id': event_id,
+                'object': 'event',
+                'type': 'customer.subscription.updated',
+                'created': created,
+                'data': {'object': {
+                    'id': 'sub_123', 'object': 'subscription', 'customer': customer,
+                    'status': status, 'current_period_end': created + 86400,
+                }},
+            },
+        )
+
+    def test_batch_applies_events_in_order(self):
+        self._queue_event('evt_2', 1700000100, 'canceled')
+        self._queue_event('evt_1', 1700000000, 'past_due')
+
+        claimed, failed = process_webhook_event_batch(10)
+
+        self.assertEqual((claimed, failed), (2, 0))
+        self.subscription.refresh_from_db()
+        self.assertEqual(self.subscription.status, 'canceled')
+        self.assertFalse(WebhookEvent.objects.exclude(status='processed').exists())
+
+    def test_event_held_by_another_worker_blocks_customer(self):
+        first = self._queue_event('evt_1', 1700000000, 'past_due')
+        WebhookEvent.objects.filter(id=first.id).update(status='processing', claimed_at=timezone.now())
+        self._queue_event('evt_2', 1700000100, 'canceled')
+        self._queue_event('evt_3', 1700000200, 'active', customer='cus_other')
+
+        claimed = claim_webhook_events(10)
+
+        self.assertEqual([event.stripe_event_id for event in claimed], ['evt_3'])
+
+    def test_subscription_updates_are_coalesced(self):
+        events = [
+            stripe.Event.construct_from(self._queue_event(event_id, created, status).payload, 'sk_test')
+            for event_id, created, status in [
+                ('evt_1', 1700000000, 'past_due'),
+                ('evt_3', 1700000200, 'canceled'),
+                ('evt_2', 1700000100, 'active'),
+            ]
+        ]
+
+        SubscriptionStatusCount.objects.create(status='canceled')
+        # One SELECT for the affected rows, one bulk UPDATE, and one UPDATE per
+        # status count inside a savepoint.
+        with self.assertNumQueries(6):
+            updated = StripeService.apply_subscription_updates(events)
+
+        self.assertEqual(updated, 1)
+        self.subscription.refresh_from_db()
+        self.assertEqual(self.subscription.status, 'canceled')
+
+    @patch('apps.subscriptions.services.StripeService.handle_webhook_event', side_effect=RuntimeError('boom'))
+    def test_failure_releases_later_events_of_customer(self, mock_handle):
+        first = self._queue_event('evt_1', 1700000000, 'past_due')
+        WebhookEvent.objects.filter(id=first.id).update(event_type='invoice.payment_failed')
+        later = self._queue_event('evt_2', 1700000100, 'canceled')
+
+        claimed, failed = process_webhook_event_batch(10)
+
+        self.assertEqual((claimed, failed), (2, 1))
+        self.assertEqual(mock_handle.call_count, 1)
+        later.refresh_from_db()
+        self.assertEqual((later.status, later.attempts), ('pending', 0))
+
+    @patch('apps.subscriptions.services.StripeService.handle_webhook_event', side_effect=RuntimeError('boom'))
+    def test_failed_event_waits_for_retry_delay(self, mock_handle):
+        first = self._queue_event('evt_1', 1700000000, 'past_due')
+        WebhookEvent.objects.filter(id=first.id).update(event_type='invoice.payment_failed')
+        self._queue_event('evt_2', 1700000100, 'canceled')
+        process_webhook_event_batch(10)
+
+        # Neither the failed event nor the customer's later one is claimed before the retry time.
+        self.assertEqual(claim_webhook_events(10), [])
+
+        WebhookEvent.objects.filter(id=first.id).update(next_attempt_at=timezone.now())
+        self.assertEqual([event.stripe_event_id for event in claim_webhook_events(10)], ['evt_1', 'evt_2'])
+
+    def test_purge_keeps_recent_and_failed_events(self):
+        old = timezone.now() - timezone.timedelta(days=settings.STRIPE_WEBHOOK_RETENTION_DAYS + 1)
+        purged = self._queue_event('evt_1', 1700000000, 'past_due')
+        failed = self._queue_event('evt_2', 1700000100, 'canceled')
+        recent = self._queue_event('evt_3', 1700000200, 'active')
+        WebhookEvent.objects.filter(id=purged.id).update(status='processed', processed_at=old)
+        WebhookEvent.objects.filter(id=failed.id).update(status='failed', processed_at=old)
+        WebhookEvent.objects.filter(id=recent.id).update(status='processed', processed_at=timezone.now())
+
+        self.assertEqual(purge_processed_webhook_events(), 1)
+        self.assertEqual(set(WebhookEvent.objects.values_list('id', flat=True)), {failed.id, recent.id})
+
+    def test_bad_payload_does_not_fail_coalesced_run(self):
+        other = User.objects.create_user(username='other', email='other@example.com', password='testpass123')
+        Subscription.objects.create(user=other, plan=self.plan, stripe_subscription_id='sub_other',
+                                    status='active', current_period_end=timezone.now())
+        bad = self._queue_event('evt_1', 1700000000, 'past_due', customer='cus_other')
+        bad.payload['data']['object'].update(id='sub_other', current_period_end='garbage')
+        bad.save(update_fields=['payload'])
+        self._queue_event('evt_2', 1700000100, 'canceled')
+
+        claimed, failed = process_webhook_event_batch(10)
+
+        self.assertEqual((claimed, failed), (2, 1))
+        self.subscription.refresh_from_db()
+        self.assertEqual(self.subscription.status, 'canceled')
+        bad.refresh_from_db()
+        self.assertEqual((bad.status, bad.attempts), ('pending', 1))
+
+    def test_coalesced_updates_keep_their_place_in_sequence(self):
+        self._queue_event('evt_1', 1700000000, 'past_due')
+        other = self._queue_event('evt_2', 1700000100, 'active')
+        WebhookEvent.objects.filter(id=other.id).update(event_type='invoice.payment_failed')
+        self._queue_event('evt_3', 1700000200, 'canceled')
+        statuses_seen = []
+
+        def handle(event):
+            statuses_seen.append(Subscription.objects.get(id=self.subscription.id).status)
+
+        with patch('apps.subscriptions.services.StripeService.handle_webhook_event', side_effect=handle):
+            claimed, failed = process_webhook_event_batch(10)
+
+        self.assertEqual((claimed, failed), (3, 0))
+        self.assertEqual(statuses_seen, ['past_due'])
+        self.subscription.refresh_from_db()
+        self.assertEqual(self.subscription.status, 'canceled')
+
+    def _post_signed(self, event_id):
+        payload = json.dumps({
+            'id': event_id, 'object': 'event', 'type': 'invoice.paid', 'created': 1700000000,
+            'data': {'object': {'id': 'in_123', 'object': 'invoice', 'customer': 'cus_123'}},
+        })
+        timestamp = int(time.time())
+        signature = hmac.new(b'whsec_test', f'{timestamp}.{payload}'.encode(), hashlib.sha256).hexdigest()
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(
+                reverse('webhook'), data=payload, content_type='application/json',
+                HTTP_STRIPE_SIGNATURE=f't={timestamp},v1={signature}',
+            )
+
+    @override_settings(STRIPE_WEBHOOK_MODE='queue', STRIPE_WEBHOOK_SECRET='whsec_test')
+    @patch('apps.subscriptions.tasks.process_webhook_events.delay')
+    def test_queue_mode_stores_event_and_acknowledges(self, mock_delay):
+        response = self._post_signed('evt_1')
+
+        self.assertEqual(response.status_code, 200)
+        event = WebhookEvent.objects.get(stripe_event_id='evt_1')
+        self.assertEqual((event.status, event.stripe_customer_id), ('pending', 'cus_123'))
+        mock_delay.assert_called_once()
+
+    @override_settings(STRIPE_WEBHOOK_MODE='queue', STRIPE_WEBHOOK_SECRET='whsec_test')
+    @patch('apps.subscriptions.tasks.process_webhook_events.delay')
+    def test_redelivered_event_is_ignored(self, mock_delay):
+        self._post_signed('evt_1')
+        response = self._post_signed('evt_1')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(WebhookEvent.objects.filter(stripe_event_id='evt_1').count(), 1)
+        mock_delay.assert_called_once()
+
+    def test_claim_event_id_falls_back_to_database(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertTrue(claim_event_id('evt_1'))
+        cache.clear()
+        self.assertFalse(claim_event_id('evt_1'))
+
+    def test_rolled_back_claim_is_accepted_again(self):
+        with self.assertRaises(RuntimeError):
+            with transaction.atomic():
+                self.assertTrue(claim_event_id('evt_1'))
+                raise RuntimeError('worker died')
+        self.assertTrue(claim_event_id('evt_1'))
+
+
+class StripeTransportTestCase(TestCase):
+    def test_sdk_uses_pooled_client(self):
+        client = stripe_client.get_http_client()
+        self.assertIs(stripe.default_http_client, client)
+        self.assertEqual(client._timeout, (settings.STRIPE_CONNECT_TIMEOUT, settings.STRIPE_READ_TIMEOUT))
+
+    def test_reset_builds_fresh_session(self):
+        client = stripe_client.get_http_client()
+        session = client._session
+        client.reset()
+        self.assertIsNot(client._session, session)
+        self.assertEqual(client.pool_stats()['requests'], 0)
+
+    def test_async_client_is_kept_per_event_loop(self):
+        client = stripe_client.AsyncStripeClient(pool_maxsize=2, connect_timeout=1, read_timeout=1)
+
+        async def get_twice():
+            first = client._get_client()
+            self.assertIs(client._get_client(), first)
+            await client.aclose()
+            self.assertTrue(first.is_closed)
+            return first
+
+        first = asyncio.run(get_twice())
+        self.assertIsNot(asyncio.run(get_twice()), first)
+
+
+class AsyncCheckoutTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='asyncuser', email='async@example.com', password='testpass123',
+                                             stripe_customer_id='cus_123')
+        self.plan = SubscriptionPlan.objects.create(name='Basic', stripe_price_id='price_123', user_limit=10,
+                                                    price=9.99)
+
+    @override_settings(STRIPE_SUCCESS_URL='https://example.com/success', STRIPE_CANCEL_URL='https://example.com/cancel')
+    @patch('apps.subscriptions.services.get_async_client')
+    def test_async_subscribe_view(self, mock_get_client):
+        mock_get_client.return_value.request = AsyncMock(
+            return_value=stripe.util.convert_to_stripe_object({'id': 'cs_123', 'object': 'checkout.session'})
+        )
+        self.client.force_login(self.user)
+
+        response = self.client.post(reverse('subscribe_async', args=['price_123']))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['data']['checkout_session_id'], 'cs_123')
+        method, path, params = mock_get_client.return_value.request.call_args.args
+        self.assertEqual((method, path, params['customer']), ('post', '/v1/checkout/sessions', 'cus_123'))
+
+    def test_async_subscribe_view_requires_login(self):
+        response = self.client.post(reverse('subscribe_async', args=['price_123']))
+        self.assertEqual(response.status_code, 401)
+
+    def test_async_view_rejects_other_methods(self):
+        response = self.client.get(reverse('subscribe_async', args=['price_123']))
+        self.assertEqual(response.status_code, 405)
+
+    def test_async_view_answers_options(self):
+        response = self.client.options(reverse('subscribe_async', args=['price_123']))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('POST', response['Allow'])
+
+
+class CatalogTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.plan = SubscriptionPlan.objects.create(name='Basic', stripe_price_id='price_123', user_limit=10,
+                                                    price=9.99)
+        self.add_on = AddOn.objects.create(name='Extra seats', stripe_price_id='price_addon', price=4.99)
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_warm_lookups_do_no_queries(self):
+        catalog.get_catalog()
+        with self.assertNumQueries(0):
+            self.assertEqual(catalog.get_plan_by_price_id('price_123').id, self.plan.id)
+            self.assertEqual(catalog.get_add_on(self.add_on.id).stripe_price_id, 'price_addon')
+
+    def test_unknown_price_id_raises_does_not_exist(self):
+        with self.assertRaises(SubscriptionPlan.DoesNotExist):
+            catalog.get_plan_by_price_id('price_missing')
+
+    def test_save_reloads_catalog(self):
+        catalog.get_catalog()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.plan.name = 'Pro'
+            self.plan.save()
+        self.assertEqual(catalog.get_plan(self.plan.id).name, 'Pro')
+
+
+class ReconciliationTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='testuser', email='test@example.com', password='testpass123',
+                                             stripe_customer_id='cus_123')
+        self.plan = SubscriptionPlan.objects.create(name='Basic', stripe_price_id='price_123', user_limit=10,
+                                                    price=9.99)
+        self.subscription = Subscription.objects.create(user=self.user, plan=self.plan,
+                                                        stripe_subscription_id='sub_123', status='active',
+                                                        current_period_end=timezone.now())
+
+    def _stripe_subscription(self, sub_id, customer, status, current_period_end=1609459200):
+        return stripe.Subscription.construct_from({
+            'id': sub_id,
+            'customer': customer,
+            'status': status,
+            'current_period_end': current_period_end,
+            'items': {'data': [{'price': {'id': 'price_123'}}]},
+        }, 'sk_test')
+
+    @patch('stripe.Subscription.list')
+    def test_reconcile_updates_changed_rows_in_pages(self, mock_list):
+        mock_list.return_value.auto_paging_iter.return_value = iter([
+            self._stripe_subscription('sub_123', 'cus_123', 'canceled'),
+            self._stripe_subscription('sub_unknown', 'cus_unknown', 'active'),
+        ])
+
+        stats = reconcile('subscriptions', page_size=1)
+
+        self.assertEqual(stats, {'checked': 2, 'updated': 1, 'created': 0, 'unmatched': 1})
+        self.assertEqual(mock_list.call_args.kwargs['status'], 'all')
+        self.subscription.refresh_from_db()
+        self.assertEqual(self.subscription.status, 'canceled')
+
+    @patch('stripe.Subscription.list')
+    def test_dry_run_writes_nothing(self, mock_list):
+        mock_list.return_value.auto_paging_iter.return_value = iter([
+            self._stripe_subscription('sub_123', 'cus_123', 'canceled'),
+        ])
+
+        stats = reconcile('subscriptions', dry_run=True)
+
+        self.assertEqual(stats['updated'], 1)
+        self.subscription.refresh_from_db()
+        self.assertEqual(self.subscription.status, 'active')
+
+    @patch('stripe.Subscription.list')
+    def test_user_keeps_newest_subscription(self, mock_list):
+        other = User.objects.create_user(username='other', email='other@example.com', password='testpass123',
+                                         stripe_customer_id='cus_456')
+        renews = int(time.time()) + 30 * 86400
+        # Stripe lists newest first.
+        mock_list.return_value.auto_paging_iter.return_value = iter([
+            self._stripe_subscription('sub_new', 'cus_123', 'active', renews),
+            self._stripe_subscription('sub_123', 'cus_123', 'canceled'),
+            self._stripe_subscription('sub_456', 'cus_456', 'active'),
+            self._stripe_subscription('sub_old', 'cus_456', 'canceled'),
+        ])
+
+        stats = reconcile('subscriptions', page_size=3)
+
+        self.assertEqual(stats, {'checked': 4, 'updated': 1, 'created': 1, 'unmatched': 0})
+        self.subscription.refresh_from_db()
+        self.assertEqual(self.subscription.stripe_subscription_id, 'sub_new')
+        self.assertEqual(self.subscription.status, 'active')
+        self.assertEqual(Subscription.objects.get(user=other).stripe_subscription_id, 'sub_456')
+
+    @patch('stripe.Subscription.list')
+    def test_user_keeps_active_subscription_over_newer_canceled_one(self, mock_list):
+        self.subscription.delete()
+        renews = int(time.time()) + 30 * 86400
+        mock_list.return_value.auto_paging_iter.return_value = iter([
+            self._stripe_subscription('sub_incomplete', 'cus_123', 'incomplete', renews + 86400),
+            self._stripe_subscription('sub_canceled', 'cus_123', 'canceled', renews),
+            self._stripe_subscription('sub_active', 'cus_123', 'active', renews),
+            self._stripe_subscription('sub_older', 'cus_123', 'trialing', renews - 86400),
+        ])
+
+        stats = reconcile('subscriptions', page_size=1)
+
+        self.assertEqual(stats, {'checked': 4, 'updated': 1, 'created': 1, 'unmatched': 0})
+        subscription = Subscription.objects.get(user=self.user)
+        self.assertEqual((subscription.stripe_subscription_id, subscription.status), ('sub_active', 'active'))
+
+    @patch('stripe.PaymentIntent.list')
+    def test_created_payments_keep_stripe_created_time(self, mock_list):
+        mock_list.return_value.auto_paging_iter.return_value = iter([
+            stripe.PaymentIntent.construct_from({
+                'id': 'pi_1', 'customer': 'cus_123', 'amount': 999, 'status': 'succeeded', 'created': 1609459200,
+            }, 'sk_test'),
+        ])
+
+        stats = reconcile('payments')
+
+        self.assertEqual(stats['created'], 1)
+        payment = Payment.objects.get(stripe_payment_intent_id='pi_1')
+        self.assertEqual(payment.created_at, timezone.datetime.fromtimestamp(1609459200, tz=timezone.utc))
+
+
+class RevenueRollupTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', email='test@example.com', password='testpass123')
+        self.plan = SubscriptionPlan.objects.create(name='Basic', stripe_price_id='price_123', user_limit=10,
+                                                    price=9.99)
+        Subscription.objects.create(user=self.user, plan=self.plan, stripe_subscription_id='sub_123',
+                                    status='active', current_period_end=timezone.now())
+
+    def _rollups(self):
+        # Rows emptied by status changes are kept until the next rebuild.
+        return sorted(MonthlyRevenueRollup.objects.exclude(payment_count=0, invoice_count=0).values_list(
+            'month', 'plan_id', 'status', 'payment_count', 'payment_amount', 'invoice_count', 'invoice_amount'
+        ))
+
+    def test_writes_update_rollups_incrementally(self):
+        Payment.objects.create(user=self.user, stripe_payment_intent_id='pi_1', amount='10.00', status='succeeded')
+        Payment.objects.create(user=self.user, stripe_payment_intent_id='pi_2', amount='5.50', status='succeeded')
+        invoice = Invoice.objects.create(user=self.user, stripe_invoice_id='in_1', amount='10.00', status='open',
+                                         due_date=timezone.now(), pdf_url='')
+
+        report = get_monthly_report(timezone.now())
+        self.assertEqual(report['total_revenue'], Decimal('15.50'))
+        self.assertEqual(report['payment_count'], 2)
+        self.assertEqual(report['pending_invoices'], 1)
+        self.assertEqual(report['active_subscriptions'], 1)
+
+        invoice = Invoice.objects.get(id=invoice.id)
+        invoice.status = 'paid'
+        invoice.save()
+        self.assertEqual(get_monthly_report(timezone.now())['pending_invoices'], 0)
+
+        incremental = self._rollups()
+        rebuild_revenue_rollups()
+        self.assertEqual(self._rollups(), incremental)
+
+    def test_plan_change_does_not_move_past_revenue(self):
+        payment = Payment.objects.create(user=self.user, stripe_payment_intent_id='pi_1', amount='10.00',
+                                         status='pending')
+        self.assertEqual(payment.plan_id, self.plan.id)
+        premium = SubscriptionPlan.objects.create(name='Premium', stripe_price_id='price_456', user_limit=50,
+                                                  price=29.99)
+        Subscription.objects.filter(user=self.user).update(plan=premium)
+
+        payment = Payment.objects.get(id=payment.id)
+        payment.status = 'succeeded'
+        payment.save()
+
+        self.assertEqual([row[1:4] for row in self._rollups()], [(self.plan.id, 'succeeded', 1)])
+        incremental = self._rollups()
+        rebuild_revenue_rollups()
+        self.assertEqual(self._rollups(), incremental)
+
+    def test_active_subscriptions_are_counted_without_scanning_subscriptions(self):
+        other = User.objects.create_user(username='other', email='other@example.com', password='testpass123')
+        subscription = Subscription.objects.create(user=other, plan=self.plan, stripe_subscription_id='sub_456',
+                                                   status='trialing', current_period_end=timezone.now())
+        self.assertEqual(get_monthly_report(timezone.now())['active_subscriptions'], 1)
+
+        subscription = Subscription.objects.get(id=subscription.id)
+        subscription.status = 'active'
+        subscription.save()
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(get_monthly_report(timezone.now())['active_subscriptions'], 2)
+        self.assertFalse([query for query in queries if f'"{Subscription._meta.db_table}"' in query['sql']])
+
+        event = stripe.Event.construct_from({
+            'id': 'evt_1', 'object': 'event', 'type': 'customer.subscription.updated', 'created': 1700000000,
+            'data': {'object': {'id': 'sub_456', 'object': 'subscription', 'status': 'canceled',
+                                'current_period_end': 1700086400}},
+        }, 'sk_test')
+        StripeService.apply_subscription_updates([event])
+        self.assertEqual(get_monthly_report(timezone.now())['active_subscriptions'], 1)
+
+        Subscription.objects.get(user=self.user).delete()
+        self.assertEqual(get_monthly_report(timezone.now())['active_subscriptions'], 0)
+
+        incremental = sorted(SubscriptionStatusCount.objects.exclude(count=0).values_list('status', 'count'))
+        rebuild_revenue_rollups()
+        self.assertEqual(sorted(SubscriptionStatusCount.objects.values_list('status', 'count')), incremental)
+
+    def test_unchanged_save_does_not_touch_rollups(self):
+        payment = Payment.objects.create(user=self.user, stripe_payment_intent_id='pi_1', amount='10.00',
+                                         status='succeeded')
+        payment = Payment.objects.get(id=payment.id)
+        with self.assertNumQueries(1):
+            payment.save()
+
+    def test_report_endpoint_is_admin_only(self):
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get(reverse('revenue_report')).status_code, 403)
+
+        self.user.is_staff = True
+        self.user.save()
+        response = self.client.get(reverse('revenue_report'), {'month': '2024-01'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['data']['month'], '2024-01-01')
+
+
+class BillingExportTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', email='test@example.com', password='testpass123',
+                                             is_staff=True)
+        Payment.objects.create(user=self.user, stripe_payment_intent_id='pi_1', amount='10.00', status='succeeded')
+        Payment.objects.create(user=self.user, stripe_payment_intent_id='pi_2', amount='5.50', status='failed')
+        self.client.force_login(self.user)
+
+    def test_csv_export_streams_filtered_rows(self):
+        response = self.client.get(reverse('billing_export', args=['payments']), {'status': 'succeeded'})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0], 'id,stripe_payment_intent_id,user_id,amount,status,created_at')
+        self.assertEqual(len(lines), 2)
+        self.assertIn('pi_1', lines[1])
+
+    def test_ndjson_export_applies_date_range(self):
+        tomorrow = (timezone.now() + timezone.timedelta(days=1)).date().isoformat()
+        response = self.client.get(reverse('billing_export', args=['payments']),
+                                   {'output': 'ndjson', 'end': tomorrow})
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual([row['stripe_payment_intent_id'] for row in rows], ['pi_1', 'pi_2'])
+
+        response = self.client.get(reverse('billing_export', args=['payments']),
+                                   {'output': 'ndjson', 'start': tomorrow})
+        self.assertEqual(b''.join(response.streaming_content), b'')
+
+    def test_export_requires_staff(self):
+        self.user.is_staff = False
+        self.user.save()
+        response = self.client.get(reverse('billing_export', args=['payments']))
+        self.assertEqual(response.status_code, 403)
+
+
+class InvoicePdfTestCase(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        settings_override = override_settings(INVOICE_PDF_STORAGE_OPTIONS={'location': self.media_root})
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        invoice_pdf.get_invoice_storage.cache_clear()
+        self.addCleanup(invoice_pdf.get_invoice_storage.cache_clear)
+
+        self.user = User.objects.create_user(username='testuser', email='test@example.com', password='testpass123')
+        self.invoice = Invoice.objects.create(user=self.user, stripe_invoice_id='in_1', amount='10.00',
+                                              status='open', due_date=timezone.now(), pdf_url='')
+
+    def test_build_pdf_produces_a_pdf_document(self):
+        pdf = invoice_pdf.build_pdf('INVOICE in_1\nAmount (due): 10.00')
+        self.assertTrue(pdf.startswith(b'%PDF-1.4'))
+        self.assertIn(b'(Amount \\(due\\): 10.00) Tj', pdf)
+        self.assertTrue(pdf.rstrip().endswith(b'%%EOF'))
+
+    @patch('apps.notifications.tasks.drain_email_outbox.delay')
+    def test_unchanged_invoice_is_not_rendered_again(self, mock_drain):
+        pdf_url = StripeService.generate_invoice_pdf(self.invoice.id)
+        self.invoice.refresh_from_db()
+        self.assertEqual(self.invoice.pdf_url, pdf_url)
+        self.assertEqual(len(self.invoice.pdf_hash), 64)
+        self.assertEqual(OutboxEmail.objects.filter(to=['test@example.com']).count(), 1)
+
+        self.assertEqual(StripeService.generate_invoice_pdf(self.invoice.id), pdf_url)
+        self.assertEqual(OutboxEmail.objects.count(), 1)
+
+        old_name = invoice_pdf.invoice_pdf_name(self.invoice, self.invoice.pdf_hash)
+        Invoice.objects.filter(id=self.invoice.id).update(status='paid')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertNotEqual(StripeService.generate_invoice_pdf(self.invoice.id), pdf_url)
+        self.assertEqual(OutboxEmail.objects.count(), 2)
+        self.assertFalse(invoice_pdf.get_invoice_storage().exists(old_name))
+
+    @patch('apps.notifications.tasks.drain_email_outbox.delay')
+    def test_pdf_is_only_served_to_its_owner(self, mock_drain):
+        with self.captureOnCommitCallbacks(execute=True):
+            pdf_url = StripeService.generate_invoice_pdf(self.invoice.id)
+        self.assertTrue(pdf_url.startswith(f"{settings.INVOICE_PDF_BASE_URL}{reverse('invoice_pdf', args=[self.invoice.id])}"))
+
+        self.client.force_login(User.objects.create_user(username='other', email='other@example.com',
+                                                         password='testpass123'))
+        self.assertEqual(self.client.get(reverse('invoice_pdf', args=[self.invoice.id])).status_code, 404)
+
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('invoice_pdf', args=[self.invoice.id]))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        self.assertTrue(b''.join(response.streaming_content).startswith(b'%PDF-1.4'))
+
+    @override_settings(INVOICE_PDF_WORKERS=2)
+    def test_bulk_rendering_uses_process_pool(self):
+        invoices = [self.invoice] + [
+            Invoice.objects.create(user=self.user, stripe_invoice_id=f'in_{i}', amount='10.00', status='open',
+                                   due_date=timezone.now(), pdf_url='')
+            for i in range(2, 5)
+        ]
+        self.assertEqual(invoice_pdf.render_invoices(invoices),
+                         [invoice_pdf.render_invoice(invoice) for invoice in invoices])
+
+    @patch('apps.notifications.tasks.drain_email_outbox.delay')
+    def test_pdf_is_not_stored_when_the_transaction_rolls_back(self, mock_drain):
+        with self.assertRaises(RuntimeError):
+            with transaction.atomic():
+                StripeService.generate_invoice_pdf(self.invoice.id)
+                raise RuntimeError('boom')
+        self.assertEqual(invoice_pdf.get_invoice_storage().listdir('')[0], [])
+
+
+@patch('apps.subscriptions.invoice_runs.group')
+class InvoiceRunTestCase(TestCase):
+    def setUp(self):
+        self.plan = SubscriptionPlan.objects.create(name='Basic', stripe_price_id='price_123', user_limit=10,
+                                                    price=9.99)
+        for i, status in enumerate(['active', 'active', 'canceled', 'active']):
+            user = User.objects.create_user(username=f'user{i}', email=f'user{i}@example.com', password='testpass123')
+            Subscription.objects.create(user=user, plan=self.plan, stripe_subscription_id=f'sub_{i}', status=status,
+                                        current_period_end=timezone.now())
+
+    def test_run_invoices_active_subscriptions_in_chunks(self, mock_group):
+        run = run_invoices(timezone.now(), chunk_size=2)
+
+        self.assertEqual(run.status, 'completed')
+        self.assertEqual(run.invoices_created, 3)
+        self.assertEqual(Invoice.objects.filter(status='open').count(), 3)
+        self.assertEqual(mock_group.call_count, 2)
+        self.assertEqual(get_monthly_report(run.due_date)['pending_invoices'], 3)
+
+        run_invoices(timezone.now(), chunk_size=2)
+        self.assertEqual(Invoice.objects.count(), 3)
+
+    def test_crashed_run_resumes_from_checkpoint(self, mock_group):
+        with patch('apps.subscriptions.invoice_runs.record_bulk_created', side_effect=[None, RuntimeError('boom')]):
+            with self.assertRaises(RuntimeError):
+                run_invoices(timezone.now(), chunk_size=2)
+        run = InvoiceRun.objects.get()
+        self.assertEqual(run.status, 'failed')
+        self.assertEqual(run.invoices_created, 2)
+        self.assertEqual(run.last_dispatched_invoice_id, Invoice.objects.latest('id').id)
+
+        run = run_invoices(timezone.now(), chunk_size=2)
+        self.assertEqual(run.status, 'completed')
+        self.assertEqual(Invoice.objects.count(), 3)
+        self.assertEqual(len(set(Invoice.objects.values_list('stripe_invoice_id', flat=True))), 3)
+        # The first chunk's renders were queued before the crash and are not queued again.
+        self.assertEqual(mock_group.call_count, 2)
+
+    def test_resume_dispatches_renders_lost_in_a_crash(self, mock_group):
+        with patch('apps.subscriptions.invoice_runs.record_bulk_created', side_effect=[None, RuntimeError('boom')]):
+            with self.assertRaises(RuntimeError):
+                run_invoices(timezone.now(), chunk_size=2)
+        # As if the worker died after committing the first chunk but before queueing its renders.
+        InvoiceRun.objects.update(last_dispatched_invoice_id=0)
+        mock_group.reset_mock()
+
+        run_invoices(timezone.now(), chunk_size=2)
+        # One group for the first chunk's invoices, one for the last chunk.
+        self.assertEqual(mock_group.call_count, 2)
@@ -1,10 +1,17 @@
 from django.urls import path
-from .views import SubscribeView, AddAddonView, WebhookView
+from .views import SubscribeView, AddAddonView, WebhookView, AsyncSubscribeView, AsyncAddAddonView, \
+    RevenueReportView, BillingExportView, InvoicePdfView
 
 # app_name = 'subscriptions'
 
 urlpatterns = [
     path('subscribe/<str:stripe_price_id>/', SubscribeView.as_view(), name='subscribe'),
     path('add-addon/<int:addon_id>/', AddAddonView.as_view(), name='add_addon'),
+    # Non-blocking variants for ASGI deployments
+    path('async/subscribe/<str:stripe_price_id>/', AsyncSubscribeView.as_view(), name='subscribe_async'),
+    path('async/add-addon/<int:addon_id>/', AsyncAddAddonView.as_view(), name='add_addon_async'),
     path('webhook/', WebhookView.as_view(), name='webhook'),
+    path('reports/revenue/', RevenueReportView.as_view(), name='revenue_report'),
+    path('exports/<str:kind>/', BillingExportView.as_view(), name='billing_export'),
+    path('invoices/<int:invoice_id>/pdf/', InvoicePdfView.as_view(), name='invoice_pdf'),
 ]
\ No newline at end of file
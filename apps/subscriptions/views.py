@@ -1,12 +1,27 @@
+import asyncio
+from functools import update_wrapper
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
 from django.contrib.auth.mixins import LoginRequiredMixin
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.utils import timezone
+from django.utils.decorators import classonlymethod
 from django.views import View
+from rest_framework import status
 from rest_framework.authentication import SessionAuthentication, TokenAuthentication, BasicAuthentication
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
+from rest_framework.views import APIView
 
-from utils.api_utils import api_response
+from utils.api_utils import api_response, ranged_file_response
 from utils.logging_utils import get_logger, RequestLogger
-from .models import SubscriptionPlan, AddOn
-from .services import StripeService
+from . import catalog
+from .exports import EXPORTS, FORMATS, parse_bound, stream_export
+from .invoice_pdf import get_invoice_storage, invoice_pdf_name
+from .models import Invoice
+from .rollups import get_monthly_report
+from .services import AsyncStripeService, StripeService
+from .webhooks import enqueue_webhook
 
 logger = get_logger(__name__)
 request_logger = RequestLogger(logger)
@@ -37,7 +52,7 @@ class SubscribeView(LoginRequiredMixin, View):
         print("setting subscription plan")
         request_logger.log_request(request)
         print("got the user")
-        plan = SubscriptionPlan.objects.get(stripe_price_id=stripe_price_id)
+        plan = catalog.get_plan_by_price_id(stripe_price_id)
         print("Got the plan: {}".format(plan))
         checkout_session_id = StripeService.create_checkout_session(request.user, plan)
         print("checkout session id: {}".format(checkout_session_id))
@@ -46,6 +61,72 @@ class SubscribeView(LoginRequiredMixin, View):
         return response
 
 
+class AsyncView(View):
+    """
+    Base class for views whose handlers are coroutines.
+
+    Django 3.2 only runs a view directly on the event loop when the callable
+    returned by as_view() is a coroutine function, so wrap it in one. Handlers
+    Django provides itself (405, OPTIONS) stay synchronous and their responses
+    are returned as they are.
+    """
+
+    @classonlymethod
+    def as_view(cls, **initkwargs):
+        view = super().as_view(**initkwargs)
+
+        async def async_view(request, *args, **kwargs):
+            response = view(request, *args, **kwargs)
+            if asyncio.iscoroutine(response):
+                response = await response
+            return response
+
+        return update_wrapper(async_view, view)
+
+    @staticmethod
+    async def get_authenticated_user(request):
+        """
+        Resolve request.user off the event loop, returning None for anonymous users.
+        """
+        def resolve():
+            return request.user if request.user.is_authenticated else None
+
+        return await sync_to_async(resolve)()
+
+    @staticmethod
+    def unauthorized_response():
+        return JsonResponse(
+            {"status": "error", "message": "Authentication credentials were not provided."},
+            status=401
+        )
+
+
+class AsyncSubscribeView(AsyncView):
+    """
+    Non-blocking variant of SubscribeView for ASGI deployments.
+
+    The Stripe round trip is awaited instead of holding a worker thread, so one
+    process can serve many concurrent checkouts.
+
+    URL Parameters:
+    - stripe_price_id: The Stripe price ID of the SubscriptionPlan to subscribe to.
+
+    Returns:
+    - JSON response containing the Stripe checkout session ID.
+    """
+
+    async def post(self, request, stripe_price_id):
+        request_logger.log_request(request)
+        user = await self.get_authenticated_user(request)
+        if user is None:
+            return self.unauthorized_response()
+        plan = await sync_to_async(catalog.get_plan_by_price_id)(stripe_price_id)
+        checkout_session_id = await AsyncStripeService.create_checkout_session(user, plan)
+        response = JsonResponse({"status": "success", "data": {'checkout_session_id': checkout_session_id}})
+        request_logger.log_response(response, request)
+        return response
+
+
 class AddAddonView(LoginRequiredMixin, View):
     """
     View for adding an add-on to a user's existing subscription.
@@ -65,13 +146,36 @@ class AddAddonView(LoginRequiredMixin, View):
 
     def post(self, request, addon_id):
         request_logger.log_request(request)
-        addon = AddOn.objects.get(id=addon_id)
+        addon = catalog.get_add_on(addon_id)
         StripeService.add_addon(request.user, addon)
         response = api_response(message="Add-on successfully added to your subscription.")
         request_logger.log_response(response, request)
         return response
 
 
+class AsyncAddAddonView(AsyncView):
+    """
+    Non-blocking variant of AddAddonView for ASGI deployments.
+
+    URL Parameters:
+    - addon_id: The ID of the AddOn to be added to the subscription.
+
+    Returns:
+    - JSON response confirming the successful addition of the add-on.
+    """
+
+    async def post(self, request, addon_id):
+        request_logger.log_request(request)
+        user = await self.get_authenticated_user(request)
+        if user is None:
+            return self.unauthorized_response()
+        addon = await sync_to_async(catalog.get_add_on)(addon_id)
+        await AsyncStripeService.add_addon(user, addon)
+        response = JsonResponse({"status": "success", "message": "Add-on successfully added to your subscription."})
+        request_logger.log_response(response, request)
+        return response
+
+
  # @method_decorator(csrf_exempt, name='dispatch')
 class WebhookView(View):
     """
@@ -86,6 +190,8 @@ class WebhookView(View):
 
     Note:
     This view does not require authentication as it's accessed by Stripe's servers.
+    With STRIPE_WEBHOOK_MODE set to 'queue' the event is only verified and stored,
+    and is applied later by the process_webhook_events Celery task.
 
     Returns:
     - HTTP response with status 200 if the webhook was processed successfully,
@@ -96,7 +202,102 @@ class WebhookView(View):
         request_logger.log_request(request)
         payload = request.body
         sig_header = request.META['HTTP_STRIPE_SIGNATURE']
-        success = StripeService.process_webhook(payload, sig_header)
-        response = api_response(status=200 if success else 400)
+        if settings.STRIPE_WEBHOOK_MODE == 'queue':
+            success = enqueue_webhook(payload, sig_header)
+        else:
+            success = StripeService.process_webhook(payload, sig_header)
+        response = HttpResponse(status=200 if success else 400)
         request_logger.log_response(response, request)
         return response
+
+
+class RevenueReportView(APIView):
+    """
+    Monthly revenue report for staff dashboards.
+
+    Reads the precomputed MonthlyRevenueRollup rows, so the cost does not grow
+    with payment history.
+
+    Query Parameters:
+    - month: Month to report on as YYYY-MM. Defaults to the current month.
+
+    Returns:
+    - JSON response with revenue, invoice and active subscription figures.
+    """
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        month = timezone.now()
+        if request.query_params.get('month'):
+            try:
+                month = timezone.datetime.strptime(request.query_params['month'], '%Y-%m')
+            except ValueError:
+                return api_response(errors={'month': 'Expected YYYY-MM'}, status_code=status.HTTP_400_BAD_REQUEST)
+        return api_response(data=get_monthly_report(month))
+
+
+class BillingExportView(APIView):
+    """
+    Streams the full payment or invoice history for finance.
+
+    Rows are read through a server-side cursor and written to the response as
+    they arrive, so the first byte is sent immediately and memory stays flat
+    regardless of the number of rows.
+
+    URL Parameters:
+    - kind: 'payments' or 'invoices'.
+
+    Query Parameters:
+    - output: 'csv' (default) or 'ndjson'.
+    - start / end: Optional date range (YYYY-MM-DD or ISO datetime, end exclusive).
+    - status: Optional comma-separated list of statuses.
+    """
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, kind):
+        if kind not in EXPORTS:
+            return api_response(errors={'kind': f'Expected one of {", ".join(EXPORTS)}'},
+                                status_code=status.HTTP_404_NOT_FOUND)
+        file_format = request.query_params.get('output', 'csv')
+        if file_format not in FORMATS:
+            return api_response(errors={'output': f'Expected one of {", ".join(FORMATS)}'},
+                                status_code=status.HTTP_400_BAD_REQUEST)
+        try:
+            start = parse_bound(request.query_params.get('start'))
+            end = parse_bound(request.query_params.get('end'))
+        except ValueError as e:
+            return api_response(errors={'date': str(e)}, status_code=status.HTTP_400_BAD_REQUEST)
+        statuses = [value for value in request.query_params.get('status', '').split(',') if value]
+
+        response = StreamingHttpResponse(
+            stream_export(kind, file_format, start=start, end=end, statuses=statuses),
+            content_type=FORMATS[file_format],
+        )
+        response['Content-Disposition'] = f'attachment; filename="{kind}.{file_format}"'
+        return response
+
+
+class InvoicePdfView(APIView):
+    """
+    Download the PDF of one of the user's invoices.
+
+    PDFs live in private storage and are only served here, to the invoice's
+    owner or staff.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, invoice_id):
+        invoices = Invoice.objects.exclude(pdf_hash='')
+        if not request.user.is_staff:
+            invoices = invoices.filter(user=request.user)
+        invoice = invoices.filter(id=invoice_id).first()
+        if invoice is None:
+            return api_response(message="Invoice not found.", status_code=status.HTTP_404_NOT_FOUND)
+        storage = get_invoice_storage()
+        name = invoice_pdf_name(invoice, invoice.pdf_hash)
+        if not storage.exists(name):
+            return api_response(message="Invoice not found.", status_code=status.HTTP_404_NOT_FOUND)
+        return ranged_file_response(
+            request, storage.open(name, 'rb'), storage.size(name),
+            content_type='application/pdf', filename=f'invoice-{invoice.stripe_invoice_id}.pdf',
+        )
@@ -0,0 +1,278 @@
+import stripe
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from utils.logging_utils import get_logger
+from .dedup import claim_event_id
+from .models import WebhookEvent
+from .services import StripeService
+
+logger = get_logger(__name__)
+
+UNFINISHED_STATUSES = ['pending', 'processing']
+COALESCED_EVENT_TYPES = {'customer.subscription.updated'}
+
+
+def get_event_customer_id(event):
+    """
+    Return the Stripe customer ID an event belongs to, or '' if it has none.
+
+    :param event: The Stripe Event
+    """
+    data_object = event['data']['object']
+    if data_object.get('object') == 'customer':
+        return data_object.get('id') or ''
+    return data_object.get('customer') or ''
+
+
+def enqueue_webhook(payload, sig_header):
+    """
+    Verify a Stripe webhook and durably store it for asynchronous processing.
+
+    The event is written to the WebhookEvent table and a worker is scheduled once
+    the row is committed, so the request can be acknowledged immediately.
+
+    :param payload: Raw request body
+    :param sig_header: Value of the Stripe-Signature header
+    :return: True if the event was accepted, False if verification failed
+    """
+    from .tasks import process_webhook_events
+
+    event = StripeService.construct_webhook_event(payload, sig_header)
+    if event is None:
+        return False
+
+    with transaction.atomic():
+        if not claim_event_id(event.id):
+            logger.info(f"Ignoring duplicate Stripe webhook event {event.id}")
+            return True
+        WebhookEvent.objects.create(
+            stripe_event_id=event.id,
+            event_type=event.type,
+            stripe_customer_id=get_event_customer_id(event),
+            payload=event.to_dict_recursive(),
+            stripe_created=timezone.datetime.fromtimestamp(event.created, tz=timezone.utc),
+        )
+        transaction.on_commit(lambda: process_webhook_events.delay())
+
+    logger.info(f"Queued Stripe webhook event {event.id} ({event.type})")
+    return True
+
+
+def claim_webhook_events(batch_size):
+    """
+    Claim the next batch of queued events, preserving per-customer order.
+
+    Candidates are locked with SKIP LOCKED so concurrent workers never claim the
+    same row. A candidate is only kept if no older unfinished event for the same
+    customer is held elsewhere (locked by, or already claimed by, another worker).
+    Events stuck in 'processing' for longer than STRIPE_WEBHOOK_CLAIM_TIMEOUT are
+    treated as abandoned and claimed again. Failed events wait until their
+    next_attempt_at, and hold back their customer's later events meanwhile.
+
+    :param batch_size: Maximum number of events to claim
+    :return: List of claimed WebhookEvent objects, oldest first
+    """
+    now = timezone.now()
+    stale_before = now - timezone.timedelta(seconds=settings.STRIPE_WEBHOOK_CLAIM_TIMEOUT)
+    claimable = (
+        Q(status='pending') & (Q(next_attempt_at__isnull=True) | Q(next_attempt_at__lte=now))
+        | Q(status='processing', claimed_at__lt=stale_before)
+    )
+
+    with transaction.atomic():
+        candidates = list(
+            WebhookEvent.objects.select_for_update(skip_locked=True)
+            .filter(claimable)
+            .order_by('stripe_created', 'id')[:batch_size]
+        )
+        if not candidates:
+            return []
+
+        newest_per_customer = {}
+        for event in candidates:
+            newest_per_customer[event.stripe_customer_id] = (event.stripe_created, event.id)
+
+        older_than_newest = Q()
+        for customer_id, (created, pk) in newest_per_customer.items():
+            older_than_newest |= Q(stripe_customer_id=customer_id) & (
+                Q(stripe_created__lt=created) | Q(stripe_created=created, id__lt=pk)
+            )
+
+        blockers = {}
+        held_elsewhere = (
+            WebhookEvent.objects.filter(older_than_newest, status__in=UNFINISHED_STATUSES)
+            .exclude(id__in=[event.id for event in candidates])
+            .values_list('stripe_customer_id', 'stripe_created', 'id')
+        )
+        for customer_id, created, pk in held_elsewhere:
+            if customer_id not in blockers or (created, pk) < blockers[customer_id]:
+                blockers[customer_id] = (created, pk)
+
+        claimed = [
+            event for event in candidates
+            if event.stripe_customer_id not in blockers
+            or (event.stripe_created, event.id) < blockers[event.stripe_customer_id]
+        ]
+        WebhookEvent.objects.filter(id__in=[event.id for event in claimed]).update(
+            status='processing', claimed_at=now
+        )
+
+    return claimed
+
+
+def _mark_processed(webhook_event_ids):
+    WebhookEvent.objects.filter(id__in=webhook_event_ids).update(
+        status='processed', processed_at=timezone.now(), last_error=''
+    )
+
+
+def _apply_event(webhook_event):
+    event = stripe.Event.construct_from(webhook_event.payload, stripe.api_key)
+    with transaction.atomic():
+        StripeService.handle_webhook_event(event)
+        _mark_processed([webhook_event.id])
+
+
+def _apply_coalesced_events(webhook_events):
+    events = [stripe.Event.construct_from(webhook_event.payload, stripe.api_key) for webhook_event in webhook_events]
+    with transaction.atomic():
+        StripeService.apply_subscription_updates(events)
+        _mark_processed([webhook_event.id for webhook_event in webhook_events])
+
+
+def _record_failure(webhook_event, error):
+    attempts = webhook_event.attempts + 1
+    status = 'failed' if attempts >= settings.STRIPE_WEBHOOK_MAX_ATTEMPTS else 'pending'
+    next_attempt_at = timezone.now() + timezone.timedelta(seconds=settings.STRIPE_WEBHOOK_RETRY_DELAY)
+    WebhookEvent.objects.filter(id=webhook_event.id).update(
+        status=status, attempts=attempts, last_error=str(error), claimed_at=None, next_attempt_at=next_attempt_at
+    )
+    logger.error(
+        f"Failed to process Stripe webhook event {webhook_event.stripe_event_id} "
+        f"(attempt {attempts}, now {status}): {str(error)}"
+    )
+
+
+def _apply_events_one_by_one(webhook_events, blocked_customers):
+    """
+    Apply events in order, each in its own transaction.
+
+    A failed event blocks its customer: the customer's later events are
+    released untouched so they are retried after it.
+
+    :param webhook_events: WebhookEvent objects, oldest first
+    :param blocked_customers: Set of customer IDs with a failed event, updated in place
+    :return: Tuple of (failed count, IDs of released events)
+    """
+    failed = 0
+    released_ids = []
+    for webhook_event in webhook_events:
+        if webhook_event.stripe_customer_id in blocked_customers:
+            released_ids.append(webhook_event.id)
+            continue
+        try:
+            _apply_event(webhook_event)
+        except Exception as e:
+            failed += 1
+            blocked_customers.add(webhook_event.stripe_customer_id)
+            _record_failure(webhook_event, e)
+    return failed, released_ids
+
+
+def _apply_coalesced_run(webhook_events, blocked_customers):
+    """
+    Apply a run of coalescable events with one bulk write.
+
+    If the bulk write fails, for instance on one malformed payload, the run is
+    applied one event at a time instead, so only the bad event and its
+    customer's later events are held back.
+
+    :return: Tuple of (failed count, IDs of released events)
+    """
+    released_ids = [
+        webhook_event.id for webhook_event in webhook_events
+        if webhook_event.stripe_customer_id in blocked_customers
+    ]
+    webhook_events = [
+        webhook_event for webhook_event in webhook_events
+        if webhook_event.stripe_customer_id not in blocked_customers
+    ]
+    if not webhook_events:
+        return 0, released_ids
+    try:
+        _apply_coalesced_events(webhook_events)
+    except Exception as e:
+        logger.warning(
+            f"Bulk apply of {len(webhook_events)} coalesced webhook events failed, "
+            f"applying them one by one: {str(e)}"
+        )
+        failed, more_released_ids = _apply_events_one_by_one(webhook_events, blocked_customers)
+        return failed, released_ids + more_released_ids
+    return 0, released_ids
+
+
+def process_webhook_event_batch(batch_size=None):
+    """
+    Claim and apply one batch of queued webhook events.
+
+    Events are applied oldest first. When an event fails, the remaining events of
+    the same customer in this batch are released untouched so they are retried
+    after it, keeping per-customer order intact.
+
+    Consecutive events of the types in COALESCED_EVENT_TYPES are collected and
+    applied together, so several updates to the same subscription cost one
+    write. The collected run is applied before any other event of one of its
+    customers, so coalescing never reorders a customer's events.
+
+    :param batch_size: Maximum number of events to process, defaults to STRIPE_WEBHOOK_BATCH_SIZE
+    :return: Tuple of (claimed, failed) event counts
+    """
+    batch_size = batch_size or settings.STRIPE_WEBHOOK_BATCH_SIZE
+    events = claim_webhook_events(batch_size)
+    blocked_customers = set()
+    released_ids = []
+    coalesced = []
+    coalesced_customers = set()
+    failed = 0
+
+    for webhook_event in events:
+        if webhook_event.event_type in COALESCED_EVENT_TYPES:
+            coalesced.append(webhook_event)
+            coalesced_customers.add(webhook_event.stripe_customer_id)
+            continue
+        if webhook_event.stripe_customer_id in coalesced_customers:
+            run_failed, run_released_ids = _apply_coalesced_run(coalesced, blocked_customers)
+            failed += run_failed
+            released_ids.extend(run_released_ids)
+            coalesced = []
+            coalesced_customers = set()
+        event_failed, event_released_ids = _apply_events_one_by_one([webhook_event], blocked_customers)
+        failed += event_failed
+        released_ids.extend(event_released_ids)
+
+    run_failed, run_released_ids = _apply_coalesced_run(coalesced, blocked_customers)
+    failed += run_failed
+    released_ids.extend(run_released_ids)
+
+    if released_ids:
+        WebhookEvent.objects.filter(id__in=released_ids).update(status='pending', claimed_at=None)
+
+    logger.info(f"Processed {len(events) - failed - len(released_ids)} of {len(events)} claimed webhook events")
+    return len(events), failed
+
+
+def purge_processed_webhook_events():
+    """
+    Delete processed events older than STRIPE_WEBHOOK_RETENTION_DAYS.
+
+    Failed events are kept for inspection.
+
+    :return: Number of deleted rows
+    """
+    cutoff = timezone.now() - timezone.timedelta(days=settings.STRIPE_WEBHOOK_RETENTION_DAYS)
+    deleted, _ = WebhookEvent.objects.filter(status='processed', processed_at__lt=cutoff).delete()
+    logger.info(f"Purged {deleted} processed Stripe webhook events older than {cutoff}")
+    return deleted
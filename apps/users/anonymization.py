@@ -0,0 +1,183 @@
+import time
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from apps.authentication.tokens import revoke_tokens_for_users
+from apps.notifications.outbox import delete_emails_to
+from apps.subscriptions.invoice_pdf import delete_invoice_pdfs
+from apps.subscriptions.models import Invoice
+from utils.gdpr_utils import ANONYMIZED_FIELDS, anonymize_user_fields
+from utils.logging_utils import get_logger
+from .data_export import delete_export_files
+from .models import AnonymizationJob, CustomUser, DataExport
+
+logger = get_logger(__name__)
+
+
+def anonymize_users(users):
+    """
+    Anonymise a batch of users and scrub their related records.
+
+    - The users' personal fields are rewritten with one bulk_update of
+      ANONYMIZED_FIELDS, which also unlinks their Stripe customer.
+    - Outbox emails to the users, whose recipient and context hold their
+      address and name, are deleted whatever their status.
+    - Invoice PDFs, which print the user's name and email, are deleted once
+      the transaction commits, and pdf_url/pdf_hash are cleared. The invoice
+      rows themselves are kept for accounting.
+    - Payments hold no personal data beyond the link to the (now anonymous)
+      user and are kept as they are.
+    - Data export archives are deleted, files after the transaction commits.
+    - API tokens are revoked and the users dropped from the auth caches, since
+      bulk_update sends no post_save.
+
+    :param users: CustomUser instances
+    :return: Number of users anonymised
+    """
+    if not users:
+        return 0
+    date_deleted = timezone.now()
+    emails = [user.email for user in users]
+    for user in users:
+        anonymize_user_fields(user, date_deleted)
+    user_ids = [user.pk for user in users]
+    invoices = list(
+        Invoice.objects.filter(user_id__in=user_ids).exclude(pdf_url='', pdf_hash='')
+        .only('id', 'user_id', 'stripe_invoice_id', 'pdf_hash')
+    )
+    export_files = list(
+        DataExport.objects.filter(user_id__in=user_ids).exclude(file_name='').values_list('file_name', flat=True)
+    )
+
+    with transaction.atomic():
+        CustomUser.objects.bulk_update(users, ANONYMIZED_FIELDS)
+        if invoices:
+            Invoice.objects.filter(id__in=[invoice.id for invoice in invoices]).update(pdf_url='', pdf_hash='')
+            transaction.on_commit(lambda: delete_invoice_pdfs(invoices))
+        DataExport.objects.filter(user_id__in=user_ids).delete()
+        if export_files:
+            transaction.on_commit(lambda: delete_export_files(export_files))
+        delete_emails_to(emails)
+        revoke_tokens_for_users(user_ids)
+    return len(users)
+
+
+def create_anonymization_job(user_ids=None, inactive_before=None, reason=''):
+    """
+    Create a job for anonymising a list of users or every inactive user.
+
+    :param user_ids: IDs of the users to anonymise
+    :param inactive_before: Anonymise non-staff users who have not logged in
+        (or, if they never did, signed up) since this datetime
+    :param reason: Free-form note, e.g. the request or policy it fulfils
+    :return: The AnonymizationJob
+    :raises ValueError: Unless exactly one of user_ids and inactive_before is given
+    """
+    if bool(user_ids) == bool(inactive_before):
+        raise ValueError("Give either user_ids or inactive_before")
+    job = AnonymizationJob(
+        user_ids=sorted(set(user_ids or [])), inactive_before=inactive_before, reason=reason,
+    )
+    job.total_users = job_users(job).count()
+    job.save()
+    logger.info(f"Created anonymization job {job.id} for {job.total_users} users")
+    return job
+
+
+def job_users(job):
+    """
+    Return the users a job still has to anonymise, in ID order.
+    """
+    users = CustomUser.objects.filter(date_deleted__isnull=True)
+    if job.inactive_before:
+        users = users.filter(is_staff=False, is_superuser=False).filter(
+            Q(last_login__lt=job.inactive_before)
+            | Q(last_login__isnull=True, date_joined__lt=job.inactive_before)
+        )
+    else:
+        users = users.filter(id__in=job.user_ids)
+    return users.order_by('id')
+
+
+def _anonymize_next_chunk(job_id, chunk_size):
+    """
+    Anonymise the next chunk of a job's users and advance its checkpoint.
+
+    The job row is locked for the duration, and the users and the checkpoint
+    are committed together.
+
+    :return: Number of users anonymised, or None when the job is done
+    """
+    with transaction.atomic():
+        job = AnonymizationJob.objects.select_for_update().get(id=job_id)
+        if job.status == 'completed':
+            return None
+
+        if job.inactive_before:
+            users = list(job_users(job).filter(id__gt=job.last_user_id)[:chunk_size])
+            last_user_id = users[-1].id if users else None
+        else:
+            # Walk the stored ID list instead of sending all of it with every query.
+            chunk_ids = [user_id for user_id in job.user_ids if user_id > job.last_user_id][:chunk_size]
+            users = list(CustomUser.objects.filter(id__in=chunk_ids, date_deleted__isnull=True).order_by('id'))
+            last_user_id = chunk_ids[-1] if chunk_ids else None
+
+        if last_user_id is None:
+            job.status = 'completed'
+            job.completed_at = timezone.now()
+            job.save(update_fields=['status', 'completed_at', 'updated_at'])
+            return None
+
+        anonymize_users(users)
+        job.last_user_id = last_user_id
+        job.users_anonymized += len(users)
+        job.status = 'running'
+        job.last_error = ''
+        job.save(update_fields=['last_user_id', 'users_anonymized', 'status', 'last_error', 'updated_at'])
+    return len(users)
+
+
+def run_anonymization_job(job_id, chunk_size=None, progress=None):
+    """
+    Run an anonymisation job to completion, resuming from its checkpoint.
+
+    Users are selected in keyset-ordered chunks of ``chunk_size``, each
+    anonymised in its own transaction. Calling this again for an interrupted
+    job carries on after the last committed chunk; a completed job is a no-op.
+
+    :param job_id: ID of the AnonymizationJob
+    :param chunk_size: Users per transaction, defaults to GDPR_ANONYMIZATION_CHUNK_SIZE
+    :param progress: Optional callable receiving the job after every chunk
+    :return: The AnonymizationJob
+    """
+    chunk_size = chunk_size or settings.GDPR_ANONYMIZATION_CHUNK_SIZE
+    started = time.monotonic()
+    processed = 0
+    try:
+        while True:
+            result = _anonymize_next_chunk(job_id, chunk_size)
+            if result is None:
+                break
+            processed += result
+
+            job = AnonymizationJob.objects.get(id=job_id)
+            elapsed = time.monotonic() - started
+            logger.info(
+                f"Anonymization job {job_id}: {job.users_anonymized}/{job.total_users} users "
+                f"({processed / elapsed if elapsed else 0:.0f} users/s)"
+            )
+            if progress:
+                progress(job)
+    except Exception as e:
+        AnonymizationJob.objects.filter(id=job_id).update(status='failed', last_error=str(e))
+        raise
+
+    job = AnonymizationJob.objects.get(id=job_id)
+    logger.info(
+        f"Anonymization job {job_id} {job.status}: {job.users_anonymized} users in total, "
+        f"{processed} in this pass ({time.monotonic() - started:.1f}s)"
+    )
+    return job
@@ -0,0 +1,185 @@
+import os
+import zipfile
+from functools import lru_cache
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from apps.subscriptions.exports import stream_ndjson
+from apps.subscriptions.models import Invoice, Payment, Subscription, UserAddOn
+from utils.logging_utils import get_logger
+from .models import CustomUser, DataExport
+
+logger = get_logger(__name__)
+
+# Per archive member: the queryset of the user's rows and the exported columns.
+# Every column a user can see about themselves, but no secrets (password hash)
+# and no internal bookkeeping (PDF content hashes).
+EXPORT_SECTIONS = [
+    ('profile.ndjson', lambda user_id: CustomUser.objects.filter(id=user_id), [
+        'id', 'username', 'email', 'first_name', 'last_name', 'date_joined', 'last_login',
+        'account_type', 'role', 'add_on_1', 'add_on_2', 'stripe_customer_id',
+    ]),
+    ('subscriptions.ndjson', lambda user_id: Subscription.objects.filter(user_id=user_id), [
+        'id', 'plan__name', 'plan__price', 'stripe_subscription_id', 'status', 'current_period_end',
+    ]),
+    ('add_ons.ndjson', lambda user_id: UserAddOn.objects.filter(user_id=user_id), [
+        'id', 'add_on__name', 'add_on__price', 'stripe_subscription_item_id',
+    ]),
+    ('invoices.ndjson', lambda user_id: Invoice.objects.filter(user_id=user_id), [
+        'id', 'stripe_invoice_id', 'amount', 'status', 'due_date', 'pdf_url',
+    ]),
+    ('payments.ndjson', lambda user_id: Payment.objects.filter(user_id=user_id), [
+        'id', 'stripe_payment_intent_id', 'amount', 'status', 'created_at',
+    ]),
+]
+
+
+@lru_cache(maxsize=None)
+def get_export_storage():
+    """
+    Return the storage backend configured by GDPR_EXPORT_STORAGE.
+    """
+    return import_string(settings.GDPR_EXPORT_STORAGE)(**settings.GDPR_EXPORT_STORAGE_OPTIONS)
+
+
+def write_export_archive(user_id, fileobj, chunk_size=None):
+    """
+    Write a user's data to ``fileobj`` as a ZIP with one NDJSON file per section.
+
+    Rows are read through server-side cursors and each line is compressed as
+    soon as it is produced, so memory use does not depend on how much data
+    the user has.
+
+    :param user_id: ID of the user to export
+    :param fileobj: Binary file to write the archive to; it need not be seekable
+    :param chunk_size: Rows per cursor fetch, defaults to GDPR_EXPORT_CHUNK_SIZE
+    :return: Dict mapping each archive member to its number of rows
+    """
+    chunk_size = chunk_size or settings.GDPR_EXPORT_CHUNK_SIZE
+    counts = {}
+    with zipfile.ZipFile(fileobj, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        for name, queryset, fields in EXPORT_SECTIONS:
+            rows = queryset(user_id).order_by('id').values_list(*fields).iterator(chunk_size=chunk_size)
+            counts[name] = 0
+            with archive.open(name, 'w', force_zip64=True) as member:
+                for line in stream_ndjson(fields, rows):
+                    member.write(line.encode('utf-8'))
+                    counts[name] += 1
+    return counts
+
+
+def _open_for_writing(storage, name):
+    """
+    Open a new file on the storage for writing, creating its directory on
+    storages that keep files on local disk.
+    """
+    try:
+        path = storage.path(name)
+    except NotImplementedError:
+        pass
+    else:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    return storage.open(name, 'wb')
+
+
+def build_data_export(export_id):
+    """
+    Build the archive of a DataExport and store it.
+
+    The archive is compressed straight into a file opened on the storage, so
+    it is neither held in memory nor staged on local disk first.
+
+    :param export_id: ID of the DataExport
+    :return: The DataExport
+    """
+    with transaction.atomic():
+        export = DataExport.objects.select_for_update().get(id=export_id)
+        if export.status != 'pending':
+            return export
+        export.status = 'running'
+        export.started_at = timezone.now()
+        export.save(update_fields=['status', 'started_at'])
+
+    storage = get_export_storage()
+    name = storage.get_available_name(
+        f'data-exports/{export.user_id}/export-{export.id}-{timezone.now():%Y%m%d%H%M%S}.zip'
+    )
+    try:
+        with _open_for_writing(storage, name) as archive_file:
+            counts = write_export_archive(export.user_id, archive_file)
+        export.file_name = name
+        export.size = storage.size(name)
+    except Exception as e:
+        delete_export_files([name])
+        DataExport.objects.filter(id=export.id).update(status='failed', last_error=str(e))
+        raise
+
+    export.status = 'completed'
+    export.completed_at = timezone.now()
+    export.save(update_fields=['status', 'file_name', 'size', 'completed_at'])
+    logger.info(f"Built data export {export.id} for user {export.user_id} ({export.size} bytes, {counts})")
+    return export
+
+
+def fail_stale_exports(exports):
+    """
+    Mark exports that have been pending or running for longer than
+    GDPR_EXPORT_TIMEOUT as failed.
+
+    :param exports: DataExport queryset to check
+    :return: Number of exports marked failed
+    """
+    cutoff = timezone.now() - timezone.timedelta(seconds=settings.GDPR_EXPORT_TIMEOUT)
+    return exports.filter(
+        Q(status='pending', created_at__lt=cutoff) | Q(status='running', started_at__lt=cutoff)
+    ).update(status='failed', last_error='Timed out')
+
+
+def request_data_export(user):
+    """
+    Return the user's export that is still being built, or start a new one.
+
+    Exports stuck past GDPR_EXPORT_TIMEOUT are marked failed first, so a lost
+    build does not block new requests.
+
+    :return: Tuple of (DataExport, created)
+    """
+    from .tasks import build_user_data_export
+
+    fail_stale_exports(user.data_exports.all())
+    export = user.data_exports.filter(status__in=['pending', 'running']).first()
+    if export:
+        return export, False
+    export = DataExport.objects.create(user=user)
+    transaction.on_commit(lambda: build_user_data_export.delay(export.id))
+    return export, True
+
+
+def delete_export_files(file_names):
+    storage = get_export_storage()
+    for file_name in file_names:
+        if storage.exists(file_name):
+            storage.delete(file_name)
+
+
+def purge_data_exports():
+    """
+    Delete exports older than GDPR_EXPORT_RETENTION_DAYS, including their files,
+    and mark stale builds failed.
+
+    :return: Number of exports deleted
+    """
+    stale = fail_stale_exports(DataExport.objects.all())
+    if stale:
+        logger.warning(f"Marked {stale} stale data exports as failed")
+    cutoff = timezone.now() - timezone.timedelta(days=settings.GDPR_EXPORT_RETENTION_DAYS)
+    expired = list(DataExport.objects.filter(created_at__lt=cutoff))
+    delete_export_files([export.file_name for export in expired if export.file_name])
+    DataExport.objects.filter(id__in=[export.id for export in expired]).delete()
+    if expired:
+        logger.info(f"Purged {len(expired)} expired data exports")
+    return len(expired)
@@ -0,0 +1,116 @@
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.db import transaction
+
+from utils.logging_utils import get_logger
+from utils.process_utils import can_use_process_pool
+
+logger = get_logger(__name__)
+
+User = get_user_model()
+
+IMPORT_FIELDS = ('username', 'email', 'first_name', 'last_name', 'password')
+
+
+def hash_passwords(passwords, executor=None, chunksize=1):
+    """
+    Hash raw passwords, spreading the work over a process pool when one is given.
+
+    Password hashing is deliberately slow and CPU bound, so it dominates the
+    cost of creating users; running it in several processes is what makes bulk
+    imports fast. Empty passwords become unusable passwords.
+
+    :param passwords: List of raw passwords
+    :param executor: Optional ProcessPoolExecutor
+    :param chunksize: Passwords sent to a worker at a time
+    :return: List of encoded passwords in the same order
+    """
+    passwords = [password or None for password in passwords]
+    if executor is None or len(passwords) < 2:
+        return [make_password(password) for password in passwords]
+    return list(executor.map(make_password, passwords, chunksize=chunksize))
+
+
+def _create_chunk(rows, executor, chunksize):
+    for row in rows:
+        row['email'] = User.objects.normalize_email(row.get('email'))
+    taken_usernames = set(User.objects.filter(
+        username__in=[row['username'] for row in rows]
+    ).values_list('username', flat=True))
+    taken_emails = set(User.objects.filter(
+        email__in=[row['email'] for row in rows if row['email']]
+    ).values_list('email', flat=True))
+    new_rows = []
+    for row in rows:
+        if row['username'] in taken_usernames or row['email'] in taken_emails:
+            continue
+        taken_usernames.add(row['username'])
+        if row['email']:
+            taken_emails.add(row['email'])
+        new_rows.append(row)
+    if not new_rows:
+        return 0
+
+    hashed = hash_passwords([row.get('password') for row in new_rows], executor, chunksize)
+    users = [
+        User(
+            username=row['username'],
+            email=row['email'],
+            first_name=row.get('first_name') or '',
+            last_name=row.get('last_name') or '',
+            password=password,
+        )
+        for row, password in zip(new_rows, hashed)
+    ]
+    with transaction.atomic():
+        User.objects.bulk_create(users)
+    return len(users)
+
+
+def import_users(rows, batch_size=None, workers=None):
+    """
+    Create users from an iterable of dicts keyed by IMPORT_FIELDS.
+
+    Rows are processed in batches: rows whose username or normalised email is
+    already taken are skipped, the remaining passwords are hashed in a process
+    pool, and the users are inserted with one bulk_create per batch. bulk_create sends no signals, and
+    unlike registration no Stripe customer is created up front.
+
+    :param rows: Iterable of dicts with at least a 'username'
+    :param batch_size: Users inserted per transaction, defaults to USER_IMPORT_BATCH_SIZE
+    :param workers: Hashing processes, defaults to USER_IMPORT_HASH_WORKERS (1 hashes inline)
+    :return: Tuple of (users created, rows skipped)
+    """
+    batch_size = batch_size or settings.USER_IMPORT_BATCH_SIZE
+    workers = workers or settings.USER_IMPORT_HASH_WORKERS
+    executor = None
+    chunksize = max(1, batch_size // (workers * 4))
+    if can_use_process_pool(workers):
+        executor = ProcessPoolExecutor(max_workers=workers, initializer=django.setup)
+
+    started = time.monotonic()
+    created = total = 0
+    batch = []
+    try:
+        for row in rows:
+            batch.append(row)
+            if len(batch) == batch_size:
+                created += _create_chunk(batch, executor, chunksize)
+                total += len(batch)
+                batch = []
+                elapsed = time.monotonic() - started
+                logger.info(f"Imported {created} of {total} users ({created / elapsed if elapsed else 0:.0f} users/s)")
+        if batch:
+            created += _create_chunk(batch, executor, chunksize)
+            total += len(batch)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    logger.info(f"User import finished: {created} created, {total - created} skipped in {time.monotonic() - started:.1f}s")
+    return created, total - created
@@ -0,0 +1,63 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from apps.users.anonymization import create_anonymization_job, run_anonymization_job
+from apps.users.tasks import anonymize_users_job
+
+
+class Command(BaseCommand):
+    help = 'Anonymises personal data of many accounts at once (GDPR), resuming an interrupted job'
+
+    def add_arguments(self, parser):
+        target = parser.add_mutually_exclusive_group(required=True)
+        target.add_argument('--ids-file', help='File with one user ID per line')
+        target.add_argument('--inactive-before', help='Anonymise non-staff users inactive since YYYY-MM-DD')
+        target.add_argument('--resume', type=int, metavar='JOB_ID', help='Resume an existing job')
+        parser.add_argument('--reason', default='', help='Note stored on the job')
+        parser.add_argument('--chunk-size', type=int, help='Users anonymised per transaction')
+        parser.add_argument('--async', dest='run_async', action='store_true',
+                            help='Queue the job as a Celery task instead of running it here')
+
+    def handle(self, *args, **options):
+        if options['resume']:
+            job_id = options['resume']
+        else:
+            try:
+                job = create_anonymization_job(
+                    user_ids=self._read_ids(options['ids_file']) if options['ids_file'] else None,
+                    inactive_before=self._parse_date(options['inactive_before']),
+                    reason=options['reason'],
+                )
+            except ValueError as e:
+                raise CommandError(str(e))
+            job_id = job.id
+            self.stdout.write(f'Created anonymization job {job_id} for {job.total_users} users')
+
+        if options['run_async']:
+            result = anonymize_users_job.delay(job_id, options['chunk_size'])
+            self.stdout.write(self.style.SUCCESS(f'Queued anonymization job {job_id} as task {result.id}'))
+            return
+
+        job = run_anonymization_job(
+            job_id, options['chunk_size'],
+            progress=lambda job: self.stdout.write(f'{job.users_anonymized}/{job.total_users} users anonymised'),
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f'Anonymization job {job.id} {job.status}: {job.users_anonymized} users'
+        ))
+
+    def _read_ids(self, path):
+        try:
+            with open(path) as ids_file:
+                return [int(line) for line in ids_file if line.strip()]
+        except (OSError, ValueError) as e:
+            raise CommandError(f'Could not read user IDs: {e}')
+
+    def _parse_date(self, value):
+        if not value:
+            return None
+        date = parse_date(value)
+        if date is None:
+            raise CommandError('--inactive-before must be given as YYYY-MM-DD')
+        return timezone.make_aware(timezone.datetime.combine(date, timezone.datetime.min.time()))
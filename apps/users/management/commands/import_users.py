@@ -0,0 +1,28 @@
+import csv
+
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.users.imports import IMPORT_FIELDS, import_users
+
+
+class Command(BaseCommand):
+    help = 'Bulk-create users from a CSV file with a header row'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help=f'CSV file with the columns {", ".join(IMPORT_FIELDS)}')
+        parser.add_argument('--batch-size', type=int, help='Users inserted per transaction')
+        parser.add_argument('--workers', type=int, help='Password hashing processes')
+
+    def handle(self, *args, **options):
+        try:
+            csv_file = open(options['path'], newline='', encoding='utf-8')
+        except OSError as e:
+            raise CommandError(str(e))
+
+        with csv_file:
+            reader = csv.DictReader(csv_file)
+            if 'username' not in (reader.fieldnames or []):
+                raise CommandError('The CSV file must have a username column')
+            created, skipped = import_users(reader, batch_size=options['batch_size'], workers=options['workers'])
+
+        self.stdout.write(self.style.SUCCESS(f'Created {created} users, skipped {skipped} whose username or email was taken'))
@@ -1,5 +1,24 @@
-from django.contrib.auth.models import AbstractUser
+from django.contrib.auth.models import AbstractUser, UserManager
 from django.db import models
+from django.db.models import Q
+
+
+class CustomUserManager(UserManager):
+    @classmethod
+    def normalize_email(cls, email):
+        """
+        Emails are stored trimmed and lowercased, so lookups are exact matches on
+        the unique email index rather than case-insensitive scans.
+        """
+        return (email or '').strip().lower()
+
+    def get_by_email(self, email):
+        """
+        Return the user with this email, in any case.
+
+        :raises DoesNotExist: If no user has the email
+        """
+        return self.get(email=self.normalize_email(email))
 
 
 class CustomUser(AbstractUser):
@@ -17,6 +36,78 @@ class CustomUser(AbstractUser):
     role = models.CharField(max_length=10, choices=ROLE_CHOICES, default='USER')
     add_on_1 = models.BooleanField(default=False)
     add_on_2 = models.BooleanField(default=False)
+    stripe_customer_id = models.CharField(max_length=100, null=True, blank=True, unique=True)
+    # Set when the account's personal data has been anonymised (utils.gdpr_utils).
+    date_deleted = models.DateTimeField(null=True, blank=True)
+
+    objects = CustomUserManager()
+
+    class Meta(AbstractUser.Meta):
+        constraints = [
+            # Blank emails are allowed more than once.
+            models.UniqueConstraint(fields=['email'], condition=~Q(email=''), name='users_customuser_email_unique'),
+        ]
+
+    def save(self, *args, **kwargs):
+        self.email = type(self).objects.normalize_email(self.email)
+        super().save(*args, **kwargs)
 
     def __str__(self):
-        return self.username
\ No newline at end of file
+        return self.username
+
+
+class AnonymizationJob(models.Model):
+    """
+    Checkpoint for a bulk GDPR anonymisation of many accounts.
+
+    The job covers the users listed in user_ids and/or the users whose last
+    login (or, if they never logged in, sign-up) is before inactive_before.
+    Users are processed in ID order; last_user_id records how far the job got,
+    so an interrupted job resumes where it stopped.
+    """
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('running', 'Running'),
+        ('completed', 'Completed'),
+        ('failed', 'Failed'),
+    ]
+
+    user_ids = models.JSONField(default=list, blank=True)
+    inactive_before = models.DateTimeField(null=True, blank=True)
+    reason = models.CharField(max_length=255, blank=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    last_user_id = models.BigIntegerField(default=0)
+    total_users = models.PositiveIntegerField(default=0)
+    users_anonymized = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    completed_at = models.DateTimeField(null=True, blank=True)
+
+
+class DataExport(models.Model):
+    """
+    A GDPR data export of one user's account, built in the background as a ZIP
+    of NDJSON files and kept in the GDPR_EXPORT_STORAGE storage.
+    """
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('running', 'Running'),
+        ('completed', 'Completed'),
+        ('failed', 'Failed'),
+    ]
+
+    user = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='data_exports')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    # Name of the archive in the export storage
+    file_name = models.CharField(max_length=255, blank=True)
+    size = models.BigIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    completed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'created_at']),
+        ]
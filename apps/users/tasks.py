@@ -0,0 +1,33 @@
+from celery import shared_task
+from .anonymization import run_anonymization_job
+from .data_export import build_data_export, purge_data_exports
+from utils.logging_utils import get_logger, log_exception, timed_function
+
+logger = get_logger(__name__)
+
+
+@shared_task(bind=True)
+@log_exception(logger)
+@timed_function(logger)
+def anonymize_users_job(self, job_id, chunk_size=None):
+    def report(job):
+        # Visible through AsyncResult(task_id).info while the job runs.
+        if self.request.id:
+            self.update_state(state='PROGRESS', meta={
+                'job_id': job.id, 'total': job.total_users, 'anonymized': job.users_anonymized,
+            })
+
+    job = run_anonymization_job(job_id, chunk_size, progress=report)
+    return {'job_id': job.id, 'status': job.status, 'anonymized': job.users_anonymized}
+
+
+@shared_task
+@log_exception(logger)
+def build_user_data_export(export_id):
+    return build_data_export(export_id).status
+
+
+@shared_task
+@log_exception(logger)
+def purge_expired_data_exports():
+    return purge_data_exports()
@@ -1,3 +1,294 @@
-from django.test import TestCase
+import csv
+import json
+import tempfile
+import zipfile
+from io import StringIO
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.db import IntegrityError
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.test import APIClient
+from unittest.mock import patch
+
+from apps.authentication.models import AuthToken
+from apps.authentication.tokens import create_token
+from apps.notifications.models import OutboxEmail
+from apps.subscriptions.models import Invoice, Payment
+from utils.gdpr_utils import anonymize_user_data
+from .anonymization import anonymize_users, create_anonymization_job, run_anonymization_job
+from .data_export import EXPORT_SECTIONS, build_data_export, get_export_storage, request_data_export
+from .imports import import_users
+from .models import DataExport
+from .tasks import anonymize_users_job, build_user_data_export
+
+User = get_user_model()
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class ImportUsersTestCase(TestCase):
+    def _rows(self, count):
+        return [
+            {'username': f'user{i}', 'email': f'user{i}@example.com', 'first_name': 'First',
+             'last_name': 'Last', 'password': f'secret-{i}'}
+            for i in range(count)
+        ]
+
+    def test_users_are_created_with_hashed_passwords(self):
+        created, skipped = import_users(self._rows(5), batch_size=2, workers=1)
+        self.assertEqual((created, skipped), (5, 0))
+        user = User.objects.get(username='user3')
+        self.assertEqual(user.email, 'user3@example.com')
+        self.assertTrue(user.check_password('secret-3'))
+
+    def test_passwords_are_hashed_in_a_process_pool(self):
+        created, _ = import_users(self._rows(8), batch_size=4, workers=2)
+        self.assertEqual(created, 8)
+        self.assertTrue(User.objects.get(username='user7').check_password('secret-7'))
+
+    def test_existing_and_duplicate_usernames_are_skipped(self):
+        User.objects.create(username='user0')
+        rows = self._rows(3) + [{'username': 'user1', 'password': 'other'}]
+        created, skipped = import_users(rows, batch_size=10, workers=1)
+        self.assertEqual((created, skipped), (2, 2))
+        self.assertTrue(User.objects.get(username='user1').check_password('secret-1'))
+
+    def test_taken_emails_are_skipped_in_any_case(self):
+        User.objects.create(username='existing', email='user0@example.com')
+        rows = self._rows(2) + [{'username': 'other', 'email': 'USER1@example.com'}]
+        rows[0]['email'] = 'User0@Example.com'
+        created, skipped = import_users(rows, workers=1)
+        self.assertEqual((created, skipped), (1, 2))
+        self.assertEqual(User.objects.get(username='user1').email, 'user1@example.com')
+
+    def test_blank_password_is_unusable(self):
+        import_users([{'username': 'nopass', 'password': ''}], workers=1)
+        self.assertFalse(User.objects.get(username='nopass').has_usable_password())
+
+    def test_command_reads_csv(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', newline='', delete=False) as csv_file:
+            writer = csv.DictWriter(csv_file, fieldnames=['username', 'email', 'first_name', 'last_name', 'password'])
+            writer.writeheader()
+            writer.writerows(self._rows(3))
+        call_command('import_users', csv_file.name, '--workers', '1', stdout=StringIO())
+        self.assertEqual(User.objects.count(), 3)
+
+
+class EmailLookupTestCase(TestCase):
+    def test_email_is_stored_lowercase(self):
+        user = User.objects.create(username='mixed', email=' Mixed.Case@Example.COM ')
+        user.refresh_from_db()
+        self.assertEqual(user.email, 'mixed.case@example.com')
+
+    def test_get_by_email_ignores_case(self):
+        user = User.objects.create_user(username='lookup', email='lookup@example.com')
+        with self.assertNumQueries(1):
+            self.assertEqual(User.objects.get_by_email('LookUp@Example.com'), user)
+
+    def test_email_is_unique_but_blank_is_not(self):
+        User.objects.create(username='first', email='same@example.com')
+        User.objects.create(username='blank1')
+        User.objects.create(username='blank2')
+        with self.assertRaises(IntegrityError):
+            User.objects.create(username='second', email='SAME@example.com')
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class AnonymizationTestCase(TestCase):
+    def setUp(self):
+        self.users = [
+            User.objects.create_user(username=f'person{i}', email=f'person{i}@example.com', password='secret',
+                                     first_name='Real', last_name='Name')
+            for i in range(5)
+        ]
+
+    def test_personal_fields_are_rewritten(self):
+        anonymize_user_data(self.users[0])
+        user = User.objects.get(pk=self.users[0].pk)
+        self.assertTrue(user.username.startswith('deleted_user_'))
+        self.assertNotIn('person0', user.email)
+        self.assertEqual((user.first_name, user.last_name, user.is_active), ('Deleted', 'User', False))
+        self.assertFalse(user.has_usable_password())
+        self.assertIsNotNone(user.date_deleted)
+
+    def test_outbox_emails_and_stripe_customer_are_removed(self):
+        user = self.users[0]
+        User.objects.filter(pk=user.pk).update(stripe_customer_id='cus_1')
+        user.refresh_from_db()
+        for recipient in self.users[:2]:
+            OutboxEmail.objects.create(subject='Welcome', to=[recipient.email], status='sent',
+                                       context={'user': {'username': recipient.username}})
+        anonymize_users([user])
+        self.assertEqual(list(OutboxEmail.objects.values_list('to', flat=True)), [['person1@example.com']])
+        user.refresh_from_db()
+        self.assertIsNone(user.stripe_customer_id)
+
+    def test_invoice_pdfs_and_tokens_are_removed(self):
+        user = self.users[0]
+        create_token(user)
+        invoice = Invoice.objects.create(user=user, stripe_invoice_id='in_1', amount=10, status='paid',
+                                         due_date=timezone.now(), pdf_url='https://files/in_1.pdf', pdf_hash='ab' * 32)
+        with patch('apps.users.anonymization.delete_invoice_pdfs') as delete_pdfs, \
+                self.captureOnCommitCallbacks(execute=True):
+            anonymize_users([user])
+        invoice.refresh_from_db()
+        self.assertEqual((invoice.pdf_url, invoice.pdf_hash, invoice.amount), ('', '', 10))
+        self.assertEqual([pdf.id for pdf in delete_pdfs.call_args[0][0]], [invoice.id])
+        self.assertFalse(AuthToken.objects.filter(user=user).exists())
+
+    def test_job_runs_in_chunks_and_resumes(self):
+        job = create_anonymization_job(user_ids=[user.pk for user in self.users[:4]])
+        self.assertEqual(job.total_users, 4)
+
+        with patch('apps.users.anonymization.anonymize_users', side_effect=[2, RuntimeError('interrupted')]):
+            with self.assertRaises(RuntimeError):
+                run_anonymization_job(job.id, chunk_size=2)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.users_anonymized, job.last_user_id), ('failed', 2, self.users[1].pk))
+
+        progress = []
+        job = run_anonymization_job(job.id, chunk_size=2, progress=lambda job: progress.append(job.users_anonymized))
+        self.assertEqual((job.status, job.users_anonymized, progress), ('completed', 4, [4]))
+        self.assertTrue(User.objects.get(pk=self.users[3].pk).date_deleted)
+        self.assertFalse(User.objects.get(pk=self.users[4].pk).date_deleted)
+
+    def test_inactive_job_skips_recent_and_staff_users(self):
+        cutoff = timezone.now() - timezone.timedelta(days=365)
+        User.objects.filter(pk__in=[user.pk for user in self.users[:3]]).update(
+            last_login=cutoff - timezone.timedelta(days=1))
+        User.objects.filter(pk=self.users[2].pk).update(is_staff=True)
+        User.objects.filter(pk=self.users[3].pk).update(last_login=timezone.now())
+
+        job = create_anonymization_job(inactive_before=cutoff)
+        anonymize_users_job(job.id, 1)
+        anonymized = set(User.objects.filter(date_deleted__isnull=False).values_list('pk', flat=True))
+        self.assertEqual(anonymized, {self.users[0].pk, self.users[1].pk})
+
+    def test_job_needs_exactly_one_target(self):
+        with self.assertRaises(ValueError):
+            create_anonymization_job()
+
+
+class DataExportTestCase(TestCase):
+    def setUp(self):
+        self.storage_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.storage_dir.cleanup)
+        settings_override = override_settings(GDPR_EXPORT_STORAGE_OPTIONS={'location': self.storage_dir.name})
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        get_export_storage.cache_clear()
+        self.addCleanup(get_export_storage.cache_clear)
+
+        self.user = User.objects.create_user(username='exporter', email='exporter@example.com', password='secret')
+        for i in range(3):
+            Payment.objects.create(user=self.user, stripe_payment_intent_id=f'pi_{i}', amount=i, status='succeeded')
+        Payment.objects.create(user=User.objects.create_user(username='other'), stripe_payment_intent_id='pi_x',
+                               amount=1, status='succeeded')
+
+    def _read_archive(self, export):
+        with get_export_storage().open(export.file_name, 'rb') as archive_file:
+            with zipfile.ZipFile(archive_file) as archive:
+                return {
+                    name: [json.loads(line) for line in archive.read(name).decode().splitlines()]
+                    for name in archive.namelist()
+                }
+
+    def test_archive_holds_one_ndjson_file_per_section(self):
+        export = DataExport.objects.create(user=self.user)
+        export = build_data_export(export.id)
+        self.assertEqual(export.status, 'completed')
+        self.assertEqual(export.size, get_export_storage().size(export.file_name))
+
+        sections = self._read_archive(export)
+        self.assertEqual(set(sections), {name for name, _, _ in EXPORT_SECTIONS})
+        self.assertEqual(sections['profile.ndjson'][0]['email'], 'exporter@example.com')
+        self.assertNotIn('password', sections['profile.ndjson'][0])
+        self.assertEqual([row['stripe_payment_intent_id'] for row in sections['payments.ndjson']],
+                         ['pi_0', 'pi_1', 'pi_2'])
+        self.assertEqual(sections['invoices.ndjson'], [])
+
+    def test_pending_export_is_reused(self):
+        with patch('apps.users.tasks.build_user_data_export.delay') as delay, \
+                self.captureOnCommitCallbacks(execute=True):
+            first, created = request_data_export(self.user)
+            second, created_again = request_data_export(self.user)
+        self.assertEqual((first, created, created_again), (second, True, False))
+        delay.assert_called_once_with(first.id)
+
+    def test_stale_export_can_be_requested_again(self):
+        stale = DataExport.objects.create(user=self.user, status='running',
+                                          started_at=timezone.now() - timezone.timedelta(hours=2))
+        with patch('apps.users.tasks.build_user_data_export.delay'), self.captureOnCommitCallbacks(execute=True):
+            export, created = request_data_export(self.user)
+        self.assertTrue(created)
+        self.assertNotEqual(export, stale)
+        stale.refresh_from_db()
+        self.assertEqual((stale.status, stale.last_error), ('failed', 'Timed out'))
+
+    def test_anonymisation_deletes_exports(self):
+        export = build_data_export(DataExport.objects.create(user=self.user).id)
+        with self.captureOnCommitCallbacks(execute=True):
+            anonymize_users([self.user])
+        self.assertFalse(DataExport.objects.exists())
+        self.assertFalse(get_export_storage().exists(export.file_name))
+
+
+class DataExportViewTestCase(TestCase):
+    def setUp(self):
+        storage_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(storage_dir.cleanup)
+        settings_override = override_settings(GDPR_EXPORT_STORAGE_OPTIONS={'location': storage_dir.name})
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        get_export_storage.cache_clear()
+        self.addCleanup(get_export_storage.cache_clear)
+
+        self.user = User.objects.create_user(username='exporter', email='exporter@example.com', password='secret')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def _build_export(self):
+        with patch('apps.users.tasks.build_user_data_export.delay', side_effect=build_user_data_export):
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.client.post(reverse('data_export'))
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        return self.client.get(reverse('data_export')).json()['data'][0]
+
+    def _content(self, response):
+        return b''.join(response.streaming_content)
+
+    def test_export_is_downloaded_whole_or_in_ranges(self):
+        export = self._build_export()
+        self.assertEqual(export['status'], 'completed')
+
+        response = self.client.get(export['download_url'])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        archive = self._content(response)
+        self.assertEqual(len(archive), export['size'])
+
+        response = self.client.get(export['download_url'], HTTP_RANGE='bytes=10-')
+        self.assertEqual(response.status_code, status.HTTP_206_PARTIAL_CONTENT)
+        self.assertEqual(response['Content-Range'], f'bytes 10-{len(archive) - 1}/{len(archive)}')
+        self.assertEqual(self._content(response), archive[10:])
+
+        response = self.client.get(export['download_url'], HTTP_RANGE=f'bytes={len(archive)}-')
+        self.assertEqual(response.status_code, status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+
+    def test_other_users_cannot_download(self):
+        export = self._build_export()
+        self.client.force_authenticate(User.objects.create_user(username='other', email='other@example.com'))
+        self.assertEqual(self.client.get(export['download_url']).status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_missing_archive_is_gone_and_can_be_requested_again(self):
+        export = self._build_export()
+        get_export_storage().delete(DataExport.objects.get(id=export['id']).file_name)
+
+        response = self.client.get(export['download_url'])
+
+        self.assertEqual(response.status_code, status.HTTP_410_GONE)
+        self.assertEqual(DataExport.objects.get(id=export['id']).status, 'failed')
+        self.assertEqual(self._build_export()['status'], 'completed')
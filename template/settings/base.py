@@ -1,6 +1,7 @@
 # base.py
 import os
 from pathlib import Path
+from django.core.exceptions import ImproperlyConfigured
 from django.utils.translation import gettext_lazy as _
 from dotenv import load_dotenv
 
@@ -36,6 +37,7 @@ INSTALLED_APPS = [
     'apps.users',
     'apps.authentication',
     'apps.subscriptions',
+    'apps.notifications',
 ]
 
 MIDDLEWARE = [
@@ -46,6 +48,7 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     # 'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'apps.subscriptions.middleware.SubscriptionMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -112,7 +115,7 @@ REST_FRAMEWORK = {
     ],
     'DEFAULT_AUTHENTICATION_CLASSES': [
         'rest_framework.authentication.SessionAuthentication',
-        # 'rest_framework.authentication.TokenAuthentication',
+        'apps.authentication.tokens.CachedTokenAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
@@ -121,12 +124,15 @@ REST_FRAMEWORK = {
     'PAGE_SIZE': 10,
     'DEFAULT_FILTER_BACKENDS': ['django_filters.rest_framework.DjangoFilterBackend'],
     'DEFAULT_THROTTLE_CLASSES': [
-        'rest_framework.throttling.AnonRateThrottle',
-        'rest_framework.throttling.UserRateThrottle'
+        'utils.throttling_utils.AnonSlidingWindowRateThrottle',
+        'utils.throttling_utils.UserSlidingWindowRateThrottle'
     ],
     'DEFAULT_THROTTLE_RATES': {
         'anon': '100/day',
-        'user': '1000/day'
+        'user': '1000/day',
+        # Per client IP, on the login and password reset views only
+        'login': '10/min',
+        'password_reset': '5/hour',
     }
 }
 
@@ -143,6 +149,34 @@ LOCALE_PATHS = [
 # Celery Configuration
 CELERY_BROKER_URL = os.environ.get('CELERY_BROKER_URL', 'redis://localhost:6379')
 CELERY_RESULT_BACKEND = os.environ.get('CELERY_RESULT_BACKEND', 'redis://localhost:6379')
+CELERY_BEAT_SCHEDULE = {
+    # Retries and anything whose on-commit trigger was lost
+    'drain-email-outbox': {
+        'task': 'apps.notifications.tasks.drain_email_outbox',
+        'schedule': 60.0,
+    },
+    'purge-email-outbox': {
+        'task': 'apps.notifications.tasks.purge_email_outbox',
+        'schedule': 24 * 60 * 60.0,
+    },
+    # Picks up events held back behind another worker's claim and stale claims
+    'process-webhook-events': {
+        'task': 'apps.subscriptions.tasks.process_webhook_events',
+        'schedule': 60.0,
+    },
+    'purge-stripe-event-ids': {
+        'task': 'apps.subscriptions.tasks.purge_stripe_event_ids',
+        'schedule': 24 * 60 * 60.0,
+    },
+    'purge-webhook-events': {
+        'task': 'apps.subscriptions.tasks.purge_webhook_events',
+        'schedule': 24 * 60 * 60.0,
+    },
+    'purge-data-exports': {
+        'task': 'apps.users.tasks.purge_expired_data_exports',
+        'schedule': 24 * 60 * 60.0,
+    },
+}
 
 # Cache Configuration
 CACHES = {
@@ -155,6 +189,25 @@ CACHES = {
     }
 }
 
+# Subscription entitlements cache
+SUBSCRIPTION_ENTITLEMENTS_CACHE_TIMEOUT = int(os.environ.get('SUBSCRIPTION_ENTITLEMENTS_CACHE_TIMEOUT', 300))
+SUBSCRIPTION_ENTITLEMENTS_LOCAL_TTL = int(os.environ.get('SUBSCRIPTION_ENTITLEMENTS_LOCAL_TTL', 5))
+SUBSCRIPTION_ENTITLEMENTS_LOCAL_MAXSIZE = int(os.environ.get('SUBSCRIPTION_ENTITLEMENTS_LOCAL_MAXSIZE', 4096))
+
+# Paths that never need subscription state; SubscriptionMiddleware skips them entirely.
+SUBSCRIPTION_EXEMPT_URL_PREFIXES = [
+    '/admin/',
+    '/static/',
+    '/media/',
+    '/swagger/',
+    '/api/login/',
+    '/api/logout/',
+    '/api/register/',
+    '/api/get-csrf-token/',
+    '/api/password-reset',
+    '/api/webhook/',
+]
+
 # Social Authentication
 AUTHENTICATION_BACKENDS = (
     # TODO: remove this for testing, will add this back
@@ -220,6 +273,123 @@ STRIPE_SECRET_KEY = os.getenv('STRIPE_SECRET_KEY')
 STRIPE_PUBLISHABLE_KEY = os.getenv('STRIPE_PUBLISHABLE_KEY')
 STRIPE_WEBHOOK_SECRET = os.getenv('STRIPE_WEBHOOK_SECRET')
 
+# Stripe HTTP transport: one bounded keep-alive pool per process
+STRIPE_HTTP_POOL_MAXSIZE = int(os.getenv('STRIPE_HTTP_POOL_MAXSIZE', 10))
+STRIPE_CONNECT_TIMEOUT = float(os.getenv('STRIPE_CONNECT_TIMEOUT', 5))
+STRIPE_READ_TIMEOUT = float(os.getenv('STRIPE_READ_TIMEOUT', 30))
+STRIPE_MAX_NETWORK_RETRIES = int(os.getenv('STRIPE_MAX_NETWORK_RETRIES', 2))
+# Log pool metrics every N Stripe requests (0 disables)
+STRIPE_HTTP_STATS_LOG_INTERVAL = int(os.getenv('STRIPE_HTTP_STATS_LOG_INTERVAL', 1000))
+
+# 'inline' applies webhook events inside the request, 'queue' stores them and
+# acknowledges immediately, leaving the work to the process_webhook_events task.
+STRIPE_WEBHOOK_MODE = os.getenv('STRIPE_WEBHOOK_MODE', 'inline')
+if STRIPE_WEBHOOK_MODE not in ('inline', 'queue'):
+    raise ImproperlyConfigured(f"STRIPE_WEBHOOK_MODE must be inline or queue, not {STRIPE_WEBHOOK_MODE!r}")
+STRIPE_WEBHOOK_BATCH_SIZE = int(os.getenv('STRIPE_WEBHOOK_BATCH_SIZE', 100))
+STRIPE_WEBHOOK_MAX_ATTEMPTS = int(os.getenv('STRIPE_WEBHOOK_MAX_ATTEMPTS', 5))
+# Seconds before a failed event is claimed again
+STRIPE_WEBHOOK_RETRY_DELAY = int(os.getenv('STRIPE_WEBHOOK_RETRY_DELAY', 60))
+STRIPE_WEBHOOK_CLAIM_TIMEOUT = int(os.getenv('STRIPE_WEBHOOK_CLAIM_TIMEOUT', 300))
+# Days processed events and their payloads are kept before they are purged
+STRIPE_WEBHOOK_RETENTION_DAYS = int(os.getenv('STRIPE_WEBHOOK_RETENTION_DAYS', 7))
+# How long seen event IDs are remembered to reject redeliveries.
+STRIPE_EVENT_RETENTION_DAYS = int(os.getenv('STRIPE_EVENT_RETENTION_DAYS', 30))
+
+# Billing exports: rows fetched per server-side cursor round trip
+BILLING_EXPORT_CHUNK_SIZE = int(os.getenv('BILLING_EXPORT_CHUNK_SIZE', 2000))
+
+# API token authentication (apps.authentication.tokens)
+AUTH_TOKEN_CACHE_TIMEOUT = int(os.getenv('AUTH_TOKEN_CACHE_TIMEOUT', 300))
+AUTH_TOKEN_LOCAL_TTL = int(os.getenv('AUTH_TOKEN_LOCAL_TTL', 5))
+AUTH_TOKEN_LOCAL_MAXSIZE = int(os.getenv('AUTH_TOKEN_LOCAL_MAXSIZE', 10000))
+
+# Session storage: 'db' reads and writes django_session on every request that
+# touches the session, 'cache' keeps sessions in Redis and copies them to the
+# database in the background (apps.authentication.sessions), 'signed_cookies'
+# stores them client-side with no server state. Compare them with
+# `manage.py benchmark_sessions`.
+SESSION_MODE = os.getenv('SESSION_MODE', 'db')
+SESSION_ENGINES = {
+    'db': 'django.contrib.sessions.backends.db',
+    'cache': 'apps.authentication.sessions',
+    'signed_cookies': 'django.contrib.sessions.backends.signed_cookies',
+}
+if SESSION_MODE not in SESSION_ENGINES:
+    raise ImproperlyConfigured(
+        f"SESSION_MODE must be one of {', '.join(SESSION_ENGINES)}, not {SESSION_MODE!r}"
+    )
+SESSION_ENGINE = SESSION_ENGINES[SESSION_MODE]
+# Seconds a cache-mode session change waits before it is written to the database;
+# saves within the window are coalesced into one write
+SESSION_WRITE_BEHIND_DELAY = int(os.getenv('SESSION_WRITE_BEHIND_DELAY', 5))
+
+# Email outbox (apps.notifications)
+EMAIL_OUTBOX_BATCH_SIZE = int(os.getenv('EMAIL_OUTBOX_BATCH_SIZE', 50))
+EMAIL_OUTBOX_MAX_ATTEMPTS = int(os.getenv('EMAIL_OUTBOX_MAX_ATTEMPTS', 6))
+# Retry delay in seconds, doubled after every failed attempt up to the maximum
+EMAIL_OUTBOX_RETRY_BACKOFF = int(os.getenv('EMAIL_OUTBOX_RETRY_BACKOFF', 30))
+EMAIL_OUTBOX_MAX_BACKOFF = int(os.getenv('EMAIL_OUTBOX_MAX_BACKOFF', 3600))
+EMAIL_OUTBOX_CLAIM_TIMEOUT = int(os.getenv('EMAIL_OUTBOX_CLAIM_TIMEOUT', 300))
+EMAIL_OUTBOX_RETENTION_DAYS = int(os.getenv('EMAIL_OUTBOX_RETENTION_DAYS', 14))
+
+# AWS SES client pool (utils.emails_utils)
+AWS_SES_MAX_POOL_CONNECTIONS = int(os.getenv('AWS_SES_MAX_POOL_CONNECTIONS', 10))
+AWS_SES_CONNECT_TIMEOUT = float(os.getenv('AWS_SES_CONNECT_TIMEOUT', 5))
+AWS_SES_READ_TIMEOUT = float(os.getenv('AWS_SES_READ_TIMEOUT', 10))
+AWS_SES_MAX_ATTEMPTS = int(os.getenv('AWS_SES_MAX_ATTEMPTS', 3))
+# Log client reuse every N lookups (0 disables)
+AWS_SES_STATS_LOG_INTERVAL = int(os.getenv('AWS_SES_STATS_LOG_INTERVAL', 1000))
+# Bulk sending: threads in the per-process send pool, retries per throttled message, and the
+# fraction of the account's MaxSendRate one bulk send may use
+AWS_SES_BULK_MAX_WORKERS = int(os.getenv('AWS_SES_BULK_MAX_WORKERS', 8))
+AWS_SES_BULK_MAX_RETRIES = int(os.getenv('AWS_SES_BULK_MAX_RETRIES', 5))
+AWS_SES_SEND_RATE_SHARE = float(os.getenv('AWS_SES_SEND_RATE_SHARE', 1.0))
+AWS_SES_SEND_QUOTA_CACHE_SECONDS = int(os.getenv('AWS_SES_SEND_QUOTA_CACHE_SECONDS', 300))
+# Used when the send quota cannot be read (the SES sandbox allows 1 per second)
+AWS_SES_DEFAULT_MAX_SEND_RATE = float(os.getenv('AWS_SES_DEFAULT_MAX_SEND_RATE', 1))
+
+# Bulk user import (manage.py import_users): users inserted per transaction and
+# processes used to hash passwords (1 hashes inline)
+USER_IMPORT_BATCH_SIZE = int(os.getenv('USER_IMPORT_BATCH_SIZE', 1000))
+USER_IMPORT_HASH_WORKERS = int(os.getenv('USER_IMPORT_HASH_WORKERS', os.cpu_count() or 1))
+
+# GDPR anonymisation jobs (manage.py anonymize_users): users per transaction
+GDPR_ANONYMIZATION_CHUNK_SIZE = int(os.getenv('GDPR_ANONYMIZATION_CHUNK_SIZE', 500))
+# GDPR data exports: any Django storage class (options are passed to its
+# constructor), rows per cursor fetch, and days before archives are purged
+GDPR_EXPORT_STORAGE = os.getenv('GDPR_EXPORT_STORAGE', 'django.core.files.storage.FileSystemStorage')
+# Kept outside MEDIA_ROOT: archives are only served through the download view
+GDPR_EXPORT_STORAGE_OPTIONS = {'location': os.path.join(BASE_DIR, 'private')}
+GDPR_EXPORT_CHUNK_SIZE = int(os.getenv('GDPR_EXPORT_CHUNK_SIZE', 2000))
+GDPR_EXPORT_RETENTION_DAYS = int(os.getenv('GDPR_EXPORT_RETENTION_DAYS', 7))
+# Seconds after which an export still pending or running is considered lost
+# (e.g. its worker was killed) and marked failed, so the user can request another
+GDPR_EXPORT_TIMEOUT = int(os.getenv('GDPR_EXPORT_TIMEOUT', 60 * 60))
+
+# Invoice PDFs
+INVOICE_ISSUER_NAME = os.getenv('INVOICE_ISSUER_NAME', 'Your App')
+INVOICE_CURRENCY = os.getenv('INVOICE_CURRENCY', 'USD')
+# Any Django storage class; options are passed to its constructor
+INVOICE_PDF_STORAGE = os.getenv('INVOICE_PDF_STORAGE', 'django.core.files.storage.FileSystemStorage')
+# Kept outside MEDIA_ROOT: PDFs are only served through the invoice_pdf view
+INVOICE_PDF_STORAGE_OPTIONS = {'location': os.path.join(BASE_DIR, 'private')}
+# Scheme and host prepended to the invoice_pdf view in links sent to customers
+INVOICE_PDF_BASE_URL = os.getenv('INVOICE_PDF_BASE_URL', 'http://localhost:8000')
+# Processes used to render PDFs in bulk (1 renders inline). Celery prefork
+# workers are daemonic and cannot start them; see INVOICE_PDF_QUEUE.
+INVOICE_PDF_WORKERS = int(os.getenv('INVOICE_PDF_WORKERS', os.cpu_count() or 1))
+INVOICE_PDF_CHUNK_SIZE = int(os.getenv('INVOICE_PDF_CHUNK_SIZE', 8))
+# Celery queue for bulk PDF rendering, empty for the default queue. Serve it
+# with a worker started with `-Q <queue> --pool threads` so it can use the pool.
+INVOICE_PDF_QUEUE = os.getenv('INVOICE_PDF_QUEUE', '')
+if INVOICE_PDF_QUEUE:
+    CELERY_TASK_ROUTES = {'apps.subscriptions.tasks.generate_invoice_pdfs': {'queue': INVOICE_PDF_QUEUE}}
+# Bulk invoice runs: subscriptions invoiced per transaction, invoices rendered per task
+INVOICE_DUE_DAYS = int(os.getenv('INVOICE_DUE_DAYS', 14))
+INVOICE_RUN_CHUNK_SIZE = int(os.getenv('INVOICE_RUN_CHUNK_SIZE', 500))
+INVOICE_RENDER_CHUNK_SIZE = int(os.getenv('INVOICE_RENDER_CHUNK_SIZE', 50))
+
 # Staticfile Storge
 STATICFILES_STORAGE = 'django.contrib.staticfiles.storage.StaticFilesStorage'
 
@@ -1,6 +1,11 @@
+import re
+
+from django.http import HttpResponse, StreamingHttpResponse
 from rest_framework.response import Response
 from rest_framework import status
 
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
 
 def api_response(data=None, message=None, status_code=status.HTTP_200_OK, errors=None):
     """
@@ -128,3 +133,87 @@ class StandardizedResponseMixin:
             response.status_code = response.status_code
             response['success_headers'] = success_headers
         return super().finalize_response(request, response, *args, **kwargs)
+
+
+def parse_range_header(header, size):
+    """
+    Parse a single-range ``Range: bytes=...`` header.
+
+    Malformed headers and multi-range requests are ignored, as HTTP allows,
+    and the whole resource is served instead.
+
+    :param header: The Range header value, or None
+    :param size: Size of the resource in bytes
+    :return: Tuple of (first byte, last byte) inclusive, or None to serve the whole resource
+    :raises ValueError: If the range cannot be satisfied
+    """
+    match = RANGE_RE.match(header or '')
+    if not match:
+        return None
+    start, end = match.groups()
+    if not start and not end:
+        return None
+    if not start:
+        if int(end) == 0 or size == 0:
+            raise ValueError(f"Unsatisfiable range: {header}")
+        # Suffix range: the last N bytes.
+        return max(size - int(end), 0), size - 1
+    start = int(start)
+    end = min(int(end), size - 1) if end else size - 1
+    if start > end:
+        raise ValueError(f"Unsatisfiable range: {header}")
+    return start, end
+
+
+def _read_range(fileobj, start, length, chunk_size):
+    try:
+        fileobj.seek(start)
+        while length > 0:
+            data = fileobj.read(min(chunk_size, length))
+            if not data:
+                break
+            length -= len(data)
+            yield data
+    finally:
+        fileobj.close()
+
+
+def ranged_file_response(request, fileobj, size, content_type='application/octet-stream', filename=None,
+                         chunk_size=64 * 1024):
+    """
+    Stream a file, honouring single byte-range requests.
+
+    Clients can resume interrupted downloads of large files (e.g. GDPR
+    exports) with ``Range: bytes=<offset>-``. The file is read in chunks and
+    closed once the response is done, so memory use does not depend on the
+    file size.
+
+    :param request: The request, whose Range header is honoured
+    :param fileobj: Seekable binary file; it is closed by the response
+    :param size: Size of the file in bytes
+    :param content_type: Content-Type of the response
+    :param filename: Optional download name for the Content-Disposition header
+    :param chunk_size: Bytes read per chunk
+    :return: StreamingHttpResponse with status 200 or 206, or HttpResponse with status 416
+    """
+    try:
+        byte_range = parse_range_header(request.META.get('HTTP_RANGE'), size)
+    except ValueError:
+        fileobj.close()
+        response = HttpResponse(status=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+        response['Content-Range'] = f'bytes */{size}'
+        return response
+
+    start, end = byte_range or (0, size - 1)
+    response = StreamingHttpResponse(
+        _read_range(fileobj, start, end - start + 1, chunk_size),
+        status=status.HTTP_206_PARTIAL_CONTENT if byte_range else status.HTTP_200_OK,
+        content_type=content_type,
+    )
+    if byte_range:
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+    response['Content-Length'] = end - start + 1
+    response['Accept-Ranges'] = 'bytes'
+    if filename:
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
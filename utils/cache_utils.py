@@ -0,0 +1,72 @@
+import threading
+import time
+from collections import OrderedDict
+
+_MISSING = object()
+
+
+class LocalTTLCache:
+    """
+    A small, thread-safe, in-process LRU cache with a per-entry time-to-live.
+
+    Intended as a bounded first layer in front of the shared Django cache for
+    values that are read on (almost) every request. Entries are evicted when
+    they expire or when the cache grows beyond ``maxsize``.
+
+    Usage:
+        local_cache = LocalTTLCache(maxsize=1024, ttl=5)
+        value = local_cache.get(key)
+        if value is None:
+            value = compute()
+            local_cache.set(key, value)
+    """
+
+    def __init__(self, maxsize=1024, ttl=5):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """
+        Return the cached value for ``key``, or ``default`` if it is missing or expired.
+
+        :param key: The cache key
+        :param default: Value returned on a miss
+        """
+        with self._lock:
+            item = self._data.get(key, _MISSING)
+            if item is _MISSING:
+                return default
+            expires_at, value = item
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        """
+        Store ``value`` under ``key``, evicting the least recently used entry when full.
+
+        :param key: The cache key
+        :param value: The value to store
+        :param ttl: Optional per-entry TTL in seconds, defaults to the cache TTL
+        """
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
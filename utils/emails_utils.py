@@ -1,14 +1,193 @@
 import logging
+import os
+import random
+import threading
+import time
+import weakref
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from django.conf import settings
-from django.template.loader import render_to_string
+from django.template import Context, Template
+from django.template.loader import select_template
+from django.template.loader_tags import ExtendsNode
+from django.utils import translation
 from django.utils.html import strip_tags
 import boto3
-from botocore.exceptions import ClientError
+from botocore.config import Config
+from botocore.exceptions import BotoCoreError, ClientError
 
 logger = logging.getLogger(__name__)
 
 
-def send_email(subject, template_name, context, recipient_list, from_email=None):
+class SESClientCache:
+    """
+    Lazily created SES clients, one per thread, built from one boto3 Session per process.
+
+    Creating a client loads botocore's service model and opens a new connection
+    pool, so it is done once per thread instead of once per email. Clients are
+    configured with a bounded connection pool and explicit timeouts. The cache
+    remembers the process it was filled in, so a forked child (Celery prefork,
+    gunicorn workers) never reuses its parent's sockets. Clients are tracked
+    for stats() through weak references only, so a client is freed with the
+    thread that used it.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._session = None
+        self._local = threading.local()
+        self._clients = weakref.WeakSet()
+        self.lookups = 0
+        self.clients_created = 0
+
+    def _config(self):
+        return Config(
+            max_pool_connections=settings.AWS_SES_MAX_POOL_CONNECTIONS,
+            connect_timeout=settings.AWS_SES_CONNECT_TIMEOUT,
+            read_timeout=settings.AWS_SES_READ_TIMEOUT,
+            retries={'max_attempts': settings.AWS_SES_MAX_ATTEMPTS, 'mode': 'standard'},
+        )
+
+    def get_client(self):
+        """
+        Return the SES client for the current thread, creating it on first use.
+        """
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._reset()
+
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            # boto3 Sessions are not thread-safe, so clients are created under the lock.
+            with self._lock:
+                if self._session is None:
+                    self._session = boto3.session.Session()
+                client = self._session.client('ses', region_name=settings.AWS_SES_REGION_NAME, config=self._config())
+                self._clients.add(client)
+                self.clients_created += 1
+            self._local.client = client
+
+        with self._lock:
+            self.lookups += 1
+            lookups = self.lookups
+        if settings.AWS_SES_STATS_LOG_INTERVAL and lookups % settings.AWS_SES_STATS_LOG_INTERVAL == 0:
+            logger.info(f"SES client stats: {self.stats()}")
+        return client
+
+    def stats(self):
+        """
+        Report client and connection reuse for this process.
+
+        :return: Dict with client lookups, clients created, HTTP requests sent,
+                 connections opened and the resulting reuse rates
+        """
+        connections_opened = 0
+        requests_sent = 0
+        with self._lock:
+            clients = list(self._clients)
+        for client in clients:
+            # botocore exposes no public pool metrics; read them from urllib3.
+            manager = getattr(client._endpoint.http_session, '_manager', None)
+            if manager is None:
+                continue
+            for key in manager.pools.keys():
+                pool = manager.pools[key]
+                connections_opened += pool.num_connections
+                requests_sent += pool.num_requests
+        return {
+            'lookups': self.lookups,
+            'clients_created': self.clients_created,
+            'client_reuse_rate': round(1 - self.clients_created / self.lookups, 4) if self.lookups else 0.0,
+            'requests': requests_sent,
+            'connections_opened': connections_opened,
+            'connection_reuse_rate': round(1 - connections_opened / requests_sent, 4) if requests_sent else 0.0,
+        }
+
+
+ses_clients = SESClientCache()
+
+
+def get_ses_client():
+    return ses_clients.get_client()
+
+
+def get_ses_stats():
+    return ses_clients.stats()
+
+
+class CompiledEmailTemplate:
+    """
+    An email template compiled once for one locale.
+
+    Holds the compiled HTML template and a plain-text skeleton: the template
+    source with its HTML tags stripped, compiled with autoescaping off. Rendering
+    a message then only fills in the context, instead of rendering the HTML and
+    stripping tags from the result every time.
+
+    Templates that extend a base template are stripped after rendering, since
+    their skeleton would not include the parent.
+    """
+
+    def __init__(self, template_name, language):
+        self.language = language
+        # A locale-specific variant (e.g. 'es/password_reset.html') wins over the shared template.
+        self.html_template = select_template([f'{language}/{template_name}', template_name]).template
+        if any(isinstance(node, ExtendsNode) for node in self.html_template.nodelist):
+            self.text_template = None
+        else:
+            self.text_template = Template(
+                '{% autoescape off %}' + strip_tags(self.html_template.source) + '{% endautoescape %}',
+                engine=self.html_template.engine,
+            )
+
+    def render(self, context):
+        """
+        :param context: Template context dict
+        :return: Tuple of (text content, HTML content)
+        """
+        with translation.override(self.language):
+            html_content = self.html_template.render(Context(context))
+            if self.text_template is None:
+                return strip_tags(html_content), html_content
+            return self.text_template.render(Context(context)), html_content
+
+
+@lru_cache(maxsize=None)
+def _get_cached_email_template(template_name, language):
+    return CompiledEmailTemplate(template_name, language)
+
+
+def get_email_template(template_name, language=None):
+    """
+    Return the CompiledEmailTemplate for a template and locale, compiled once per process.
+
+    In DEBUG the template is recompiled on every call so edits show up immediately.
+
+    :param template_name: Name of the HTML template
+    :param language: Language code, defaults to the active language
+    """
+    language = language or translation.get_language() or settings.LANGUAGE_CODE
+    if settings.DEBUG:
+        return CompiledEmailTemplate(template_name, language)
+    return _get_cached_email_template(template_name, language)
+
+
+def render_email_template(template_name, context, language=None):
+    """
+    Render an email template for one recipient.
+
+    :return: Tuple of (text content, HTML content)
+    """
+    return get_email_template(template_name, language).render(context)
+
+
+def send_email(subject, template_name, context, recipient_list, from_email=None, language=None):
     """
     Send an email using a template.
 
@@ -17,32 +196,47 @@ def send_email(subject, template_name, context, recipient_list, from_email=None)
     :param context: Dictionary containing context for the template
     :param recipient_list: List of recipient email addresses
     :param from_email: Sender's email address (optional)
+    :param language: Language to render the template in (optional)
+    """
+    text_content, html_content = render_email_template(template_name, context, language)
+    return send_ses_email(subject, recipient_list, text_content, html_content, from_email)
+
+
+def send_ses_email(subject, recipient_list, text_content, html_content=None, from_email=None):
+    """
+    Send an already rendered email through SES.
+
+    :param subject: Email subject
+    :param recipient_list: List of recipient email addresses
+    :param text_content: Plain text body
+    :param html_content: HTML body (optional)
+    :param from_email: Sender's email address (optional)
+    :return: The SES message ID
     """
     if from_email is None:
         from_email = settings.DEFAULT_FROM_EMAIL
 
-    html_content = render_to_string(template_name, context)
-    text_content = strip_tags(html_content)
+    body = {
+        'Text': {
+            'Charset': 'UTF-8',
+            'Data': text_content,
+        },
+    }
+    if html_content is not None:
+        body['Html'] = {
+            'Charset': 'UTF-8',
+            'Data': html_content,
+        }
 
     try:
-        # Create a new SES resource and specify a region.
-        client = boto3.client('ses', region_name=settings.AWS_SES_REGION_NAME)
+        client = get_ses_client()
 
         response = client.send_email(
             Destination={
                 'ToAddresses': recipient_list,
             },
             Message={
-                'Body': {
-                    'Html': {
-                        'Charset': 'UTF-8',
-                        'Data': html_content,
-                    },
-                    'Text': {
-                        'Charset': 'UTF-8',
-                        'Data': text_content,
-                    },
-                },
+                'Body': body,
                 'Subject': {
                     'Charset': 'UTF-8',
                     'Data': subject,
@@ -55,6 +249,8 @@ def send_email(subject, template_name, context, recipient_list, from_email=None)
         raise
     else:
         logger.info(f"Email sent successfully to {', '.join(recipient_list)}. Message ID: {response['MessageId']}")
+        return response['MessageId']
+
 
 def send_password_reset_email(user, reset_url):
     subject = "Password Reset Request"
@@ -72,3 +268,148 @@ def send_password_reset_email(user, reset_url):
     except Exception as e:
         logger.error(f"Failed to send password reset email to {user.email}: {str(e)}")
         return False
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket: allows ``rate`` tokens per second with bursts of up to ``capacity``.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity or max(rate, 1))
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens=1):
+        """
+        Block until ``tokens`` tokens are available and take them.
+        """
+        tokens = min(tokens, self.capacity)
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                wait = (tokens - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+_send_quota = {'rate': None, 'fetched_at': 0.0}
+_send_quota_lock = threading.Lock()
+
+
+def get_max_send_rate():
+    """
+    Return the account's SES MaxSendRate (recipients per second), cached for
+    AWS_SES_SEND_QUOTA_CACHE_SECONDS. Falls back to AWS_SES_DEFAULT_MAX_SEND_RATE
+    if the quota cannot be read.
+    """
+    with _send_quota_lock:
+        if _send_quota['rate'] and time.monotonic() - _send_quota['fetched_at'] < settings.AWS_SES_SEND_QUOTA_CACHE_SECONDS:
+            return _send_quota['rate']
+        try:
+            rate = float(get_ses_client().get_send_quota()['MaxSendRate'])
+        except (BotoCoreError, ClientError) as e:
+            logger.warning(f"Could not read SES send quota, using the default rate: {str(e)}")
+            rate = float(settings.AWS_SES_DEFAULT_MAX_SEND_RATE)
+        _send_quota.update(rate=rate, fetched_at=time.monotonic())
+        return rate
+
+
+def is_throttling_error(error):
+    """
+    True for SES rate-limit errors, which are worth retrying. Exceeding the daily
+    quota is reported with the same code but will not clear up by retrying.
+    """
+    if not isinstance(error, ClientError):
+        return False
+    details = error.response.get('Error', {})
+    if details.get('Code') not in ('Throttling', 'ThrottlingException', 'TooManyRequestsException'):
+        return False
+    return 'daily message quota' not in details.get('Message', '').lower()
+
+
+BulkEmail = namedtuple('BulkEmail', ['subject', 'recipient_list', 'text_content', 'html_content', 'from_email'])
+BulkEmail.__new__.__defaults__ = (None, None)
+
+BulkSendResult = namedtuple('BulkSendResult', ['message_id', 'error'])
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    """
+    Return the process's bulk-send thread pool, created on first use.
+
+    The threads outlive each send_bulk_emails() call, so each keeps its SES
+    client instead of creating a new one per call.
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=settings.AWS_SES_BULK_MAX_WORKERS,
+                                           thread_name_prefix='ses-bulk')
+        return _executor
+
+
+def _reset_after_fork():
+    global _executor
+    _executor = None
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def send_bulk_emails(messages, max_retries=None, rate=None):
+    """
+    Send many already rendered emails as fast as the SES sending quota allows.
+
+    Sends are paced by a token bucket sized from the account's MaxSendRate
+    (scaled by AWS_SES_SEND_RATE_SHARE), one token per recipient, and spread over
+    the process's long-lived pool of AWS_SES_BULK_MAX_WORKERS threads, each
+    with its own SES client. Messages rejected for exceeding the rate are
+    retried with jittered backoff; any other error fails only that message.
+
+    :param messages: Iterable of BulkEmail
+    :param max_retries: Retries per throttled message, defaults to AWS_SES_BULK_MAX_RETRIES
+    :param rate: Recipients per second, defaults to the account's share of MaxSendRate
+    :return: List of BulkSendResult in the order of ``messages``
+    """
+    messages = list(messages)
+    if not messages:
+        return []
+    max_retries = settings.AWS_SES_BULK_MAX_RETRIES if max_retries is None else max_retries
+    rate = rate or get_max_send_rate() * settings.AWS_SES_SEND_RATE_SHARE
+    bucket = TokenBucket(rate)
+    throttled = []
+
+    def send(message):
+        for attempt in range(max_retries + 1):
+            bucket.acquire(len(message.recipient_list))
+            try:
+                return BulkSendResult(send_ses_email(*message), None)
+            except Exception as e:
+                if not is_throttling_error(e) or attempt == max_retries:
+                    return BulkSendResult(None, e)
+                throttled.append(1)
+                time.sleep(min(0.1 * 2 ** attempt, 5) * random.uniform(0.5, 1.5))
+
+    started = time.monotonic()
+    results = list(_get_executor().map(send, messages))
+
+    elapsed = time.monotonic() - started
+    failed = sum(1 for result in results if result.error is not None)
+    logger.info(
+        f"Bulk sent {len(messages) - failed} of {len(messages)} emails in {elapsed:.1f}s "
+        f"({len(messages) / elapsed if elapsed else 0:.1f}/s at a limit of {rate:.1f}/s, "
+        f"{len(throttled)} throttled retries)"
+    )
+    return results
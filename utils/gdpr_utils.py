@@ -1,33 +1,50 @@
 import uuid
 from django.utils import timezone
 
-def anonymize_user_data(user):
-    """
-    Anonymize user data in compliance with GDPR.
+# Every user column anonymisation rewrites. Saves and bulk updates write
+# exactly these, so concurrent changes to other columns are not clobbered.
+ANONYMIZED_FIELDS = [
+    'username', 'email', 'first_name', 'last_name', 'password', 'stripe_customer_id', 'is_active', 'date_deleted',
+]
 
-    This function replaces personal information with anonymous data and
-    deactivates the user account.
+
+def anonymize_user_fields(user, date_deleted=None):
+    """
+    Replace the personal data on a user instance without saving it.
 
     :param user: The User object to be anonymized
+    :param date_deleted: Deletion timestamp, defaults to now
+    :return: The names of the changed fields (ANONYMIZED_FIELDS)
     """
     # Generate a unique identifier
-    unique_id = uuid.uuid4().hex[:10]
+    unique_id = uuid.uuid4().hex
 
     # Anonymize personal data
     user.username = f"deleted_user_{unique_id}"
     user.email = f"{unique_id}@deleted.com"
     user.first_name = "Deleted"
     user.last_name = "User"
-
-    # Clear any other personal data fields
-    # Add any additional fields your User model might have
-    user.phone_number = ""  # If you have this field
+    user.set_unusable_password()
+    # Unlink the Stripe customer, which also holds the user's email
+    user.stripe_customer_id = None
 
     # Deactivate the account
     user.is_active = False
 
     # Set deletion timestamp
-    user.date_deleted = timezone.now()  # Assuming you've added this field to your User model
+    user.date_deleted = date_deleted or timezone.now()
+    return ANONYMIZED_FIELDS
+
 
-    # Save the changes
-    user.save()
\ No newline at end of file
+def anonymize_user_data(user):
+    """
+    Anonymize user data in compliance with GDPR.
+
+    This function replaces personal information with anonymous data,
+    deactivates the user account, and scrubs related records the same way
+    the bulk anonymisation job does (see apps.users.anonymization).
+
+    :param user: The User object to be anonymized
+    """
+    from apps.users.anonymization import anonymize_users
+    anonymize_users([user])
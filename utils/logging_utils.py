@@ -1,3 +1,4 @@
+import asyncio
 import logging
 import sys
 from functools import wraps
@@ -24,12 +25,23 @@ def get_logger(name):
 
 def log_exception(logger):
     """
-    A decorator to log exceptions raised in functions.
+    A decorator to log exceptions raised in functions. Works for coroutine functions too.
 
     :param logger: The logger instance to use
     """
 
     def decorator(func):
+        if asyncio.iscoroutinefunction(func):
+            @wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                try:
+                    return await func(*args, **kwargs)
+                except Exception as e:
+                    logger.exception(f"Exception in {func.__name__}: {str(e)}")
+                    raise
+
+            return async_wrapper
+
         @wraps(func)
         def wrapper(*args, **kwargs):
             try:
@@ -45,12 +57,23 @@ def log_exception(logger):
 
 def timed_function(logger):
     """
-    A decorator to log the execution time of functions.
+    A decorator to log the execution time of functions. Works for coroutine functions too.
 
     :param logger: The logger instance to use
     """
 
     def decorator(func):
+        if asyncio.iscoroutinefunction(func):
+            @wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                start_time = time.time()
+                result = await func(*args, **kwargs)
+                end_time = time.time()
+                logger.info(f"{func.__name__} took {end_time - start_time:.2f} seconds to execute.")
+                return result
+
+            return async_wrapper
+
         @wraps(func)
         def wrapper(*args, **kwargs):
             start_time = time.time()
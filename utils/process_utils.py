@@ -0,0 +1,26 @@
+import multiprocessing
+
+from utils.logging_utils import get_logger
+
+logger = get_logger(__name__)
+
+
+def can_use_process_pool(workers):
+    """
+    Tell whether CPU-bound work can be spread over a pool of worker processes here.
+
+    A pool of one process only adds overhead. Daemonic processes may not start
+    children, and Celery's prefork workers are daemonic, so tasks running there
+    must do the work inline; a Celery worker started with a non-forking pool
+    (``--pool threads`` or ``solo``) is not daemonic and can use a process pool.
+    The daemonic case is logged, since it means the configured pool is ignored.
+
+    :param workers: Configured number of worker processes
+    :return: True if a pool of ``workers`` processes may be started
+    """
+    if workers <= 1:
+        return False
+    if multiprocessing.current_process().daemon:
+        logger.warning(f"Working inline instead of in {workers} processes: daemonic processes cannot start children")
+        return False
+    return True
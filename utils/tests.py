@@ -0,0 +1,29 @@
+from unittest.mock import patch
+
+from django.test import SimpleTestCase
+
+from .api_utils import parse_range_header
+from .process_utils import can_use_process_pool
+
+
+class RangeHeaderTestCase(SimpleTestCase):
+    def test_parse_range_header(self):
+        self.assertIsNone(parse_range_header(None, 100))
+        self.assertIsNone(parse_range_header('bytes=0-1,5-6', 100))
+        self.assertIsNone(parse_range_header('items=0-1', 100))
+        self.assertEqual(parse_range_header('bytes=10-19', 100), (10, 19))
+        self.assertEqual(parse_range_header('bytes=90-', 100), (90, 99))
+        self.assertEqual(parse_range_header('bytes=95-200', 100), (95, 99))
+        self.assertEqual(parse_range_header('bytes=-10', 100), (90, 99))
+        with self.assertRaises(ValueError):
+            parse_range_header('bytes=100-', 100)
+
+
+class ProcessPoolTestCase(SimpleTestCase):
+    def test_pool_needs_several_workers_and_a_non_daemonic_process(self):
+        self.assertFalse(can_use_process_pool(1))
+        self.assertTrue(can_use_process_pool(4))
+        with patch('utils.process_utils.multiprocessing.current_process') as current_process:
+            current_process.return_value.daemon = True
+            with self.assertLogs('utils.process_utils', 'WARNING'):
+                self.assertFalse(can_use_process_pool(4))
@@ -0,0 +1,133 @@
+from functools import lru_cache
+
+from django.core.cache import caches
+from rest_framework.throttling import AnonRateThrottle, SimpleRateThrottle, UserRateThrottle
+
+# KEYS[1] is the counter of the current window, KEYS[2] the previous one.
+# ARGV: limit, window length in seconds, fraction of the current window elapsed.
+# Returns {allowed, current count, previous count}.
+SLIDING_WINDOW_SCRIPT = """
+local current = tonumber(redis.call('GET', KEYS[1]) or '0')
+local previous = tonumber(redis.call('GET', KEYS[2]) or '0')
+if previous * (1 - tonumber(ARGV[3])) + current >= tonumber(ARGV[1]) then
+    return {0, current, previous}
+end
+current = redis.call('INCR', KEYS[1])
+if current == 1 then
+    redis.call('EXPIRE', KEYS[1], 2 * tonumber(ARGV[2]))
+end
+return {1, current, previous}
+"""
+
+
+@lru_cache(maxsize=None)
+def _get_redis_script(cache_alias):
+    from django_redis import get_redis_connection
+    return get_redis_connection(cache_alias).register_script(SLIDING_WINDOW_SCRIPT)
+
+
+class SlidingWindowRateThrottle(SimpleRateThrottle):
+    """
+    Rate throttle that keeps two counters per client instead of a timestamp list.
+
+    Requests are counted in fixed windows as long as the rate's duration. The
+    rate over the sliding window is estimated as the current window's count
+    plus the previous window's count weighted by how much of it still
+    overlaps. Storage per client is two integers whatever the rate, and on
+    Redis the check and the increment are one atomic script call. Other cache
+    backends use get_many/incr, which is not atomic but good enough for
+    development.
+
+    Rates come from DEFAULT_THROTTLE_RATES like DRF's own throttles, so this
+    is a drop-in base for any SimpleRateThrottle subclass.
+    """
+    cache_alias = 'default'
+
+    def allow_request(self, request, view):
+        if self.rate is None:
+            return True
+
+        self.key = self.get_cache_key(request, view)
+        if self.key is None:
+            return True
+
+        now = self.timer()
+        window = int(now // self.duration)
+        self.elapsed = (now % self.duration) / self.duration
+        keys = [f'{self.key}:{window}', f'{self.key}:{window - 1}']
+        allowed, self.current, self.previous = self.hit(keys)
+        return bool(allowed)
+
+    def hit(self, keys):
+        """
+        Count a request against the window counters if it is within the rate.
+
+        :param keys: Cache keys of the current and the previous window counters
+        :return: Tuple of (allowed, current window count, previous window count)
+        """
+        # The backend itself, not the django.core.cache.cache proxy, tells Redis apart.
+        cache = caches[self.cache_alias]
+        if 'django_redis' in type(cache).__module__:
+            script = _get_redis_script(self.cache_alias)
+            allowed, current, previous = script(
+                keys=[cache.make_key(key) for key in keys],
+                args=[self.num_requests, self.duration, self.elapsed],
+            )
+            return allowed, current, previous
+
+        counts = cache.get_many(keys)
+        current, previous = counts.get(keys[0], 0), counts.get(keys[1], 0)
+        if previous * (1 - self.elapsed) + current >= self.num_requests:
+            return 0, current, previous
+        cache.add(keys[0], 0, 2 * self.duration)
+        try:
+            current = cache.incr(keys[0])
+        except ValueError:
+            # The counter expired or the cache does not store anything.
+            current += 1
+        return 1, current, previous
+
+    def wait(self):
+        """
+        Seconds until the estimated rate drops below the limit again.
+        """
+        limit = self.num_requests
+        if self.current < limit and self.previous:
+            # Wait for enough of the previous window to slide out.
+            needed = 1 - (limit - self.current) / self.previous
+            return max(needed - self.elapsed, 0) * self.duration
+        # The current window is full by itself: wait for it to become the
+        # previous window and slide out far enough.
+        needed = 1 - limit / self.current if self.current else 0
+        return (1 - self.elapsed + max(needed, 0)) * self.duration
+
+
+class AnonSlidingWindowRateThrottle(SlidingWindowRateThrottle, AnonRateThrottle):
+    """
+    Limits anonymous requests per client IP, using the 'anon' rate.
+    """
+
+
+class UserSlidingWindowRateThrottle(SlidingWindowRateThrottle, UserRateThrottle):
+    """
+    Limits requests per user, or per IP for anonymous requests, using the 'user' rate.
+    """
+
+
+class ClientIPSlidingWindowRateThrottle(SlidingWindowRateThrottle):
+    """
+    Limits requests per client IP, whether or not the client is logged in.
+
+    Subclasses set ``scope`` to pick a rate from DEFAULT_THROTTLE_RATES.
+    """
+
+    def get_cache_key(self, request, view):
+        return self.cache_format % {'scope': self.scope, 'ident': self.get_ident(request)}
+
+
+class LoginRateThrottle(ClientIPSlidingWindowRateThrottle):
+    scope = 'login'
+
+
+class PasswordResetRateThrottle(ClientIPSlidingWindowRateThrottle):
+    scope = 'password_reset'